@@ -0,0 +1,232 @@
+import contextvars
+import threading
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Optional, Tuple
+
+from dispatcher import dispatch_command
+from code_shapes import native_intent
+from command_store import CommandStore
+from utils import log
+from tracing import trace
+
+# Special commands understood by Assistant.handle
+EXIT_COMMANDS = ("exit", "quit")
+STORE_LAST = "store last"
+NO_STORE = "no store"
+CLEAR_PATTERNS = "clear patterns"
+
+
+@dataclass
+class SpeculationPolicy:
+    """
+    Ask the LLM while pattern matching is still in its slow stages.
+
+    Once matching gets past the exact and pattern stages, parse_prompt starts on
+    another thread. A match scoring at least min_score cancels the LLM request;
+    if the LLM answers first, matching stops and its intent is used. Weaker
+    matches wait for the LLM and are only used if it fails.
+    """
+    # Compared with the match score: similarity for fuzzy matches, 1.0 otherwise
+    min_score: float = 0.8
+
+
+@dataclass
+class AssistantResult:
+    """Structured outcome of handling one prompt."""
+    prompt: str
+    # "command" for normal prompts, "special" for store/clear commands, "exit" to quit
+    kind: str = "command"
+    # "pattern" when the pattern store answered, "llm" when the model did
+    source: Optional[str] = None
+    intent: Optional[dict] = None
+    variables: Dict[str, str] = field(default_factory=dict)
+    category: Optional[str] = None
+    # Matching stage ("exact", "regex", "fuzzy", "fallback"), pattern and similarity score
+    match_stage: Optional[str] = None
+    matched_pattern: Optional[str] = None
+    score: Optional[float] = None
+    stored: bool = False
+    # Dispatch outcome ("ok", "fallback", "no_code", "invalid", "error"), None when not executed
+    outcome: Optional[str] = None
+    message: Optional[str] = None
+    timings: Dict[str, float] = field(default_factory=dict)
+    total_ms: float = 0.0
+
+
+class Assistant:
+    """
+    The assistant's command handling without the REPL.
+
+    Holds the command store and the state the special commands need (the last
+    LLM-handled prompt and the "no store" flag), so tests, batch jobs and
+    benchmarks can call handle() directly instead of driving main.py over stdin.
+    """
+
+    def __init__(self, command_store: Optional[CommandStore] = None, execute: bool = True,
+                 on_resolved: Optional[Callable[[AssistantResult], None]] = None,
+                 speculation: Optional[SpeculationPolicy] = None, few_shot: int = 0):
+        """
+        Args:
+            command_store: Store to match and learn patterns in; loads the default file if omitted.
+            execute: Dispatch intents. Set to False to only resolve them.
+            on_resolved: Called with the result once the intent is known, before it is dispatched.
+            speculation: Start the LLM call alongside slow pattern matching; None
+                matches first and only then asks the LLM.
+            few_shot: Show the LLM this many of the most similar stored
+                commands, with their intents, as examples.
+        """
+        self.command_store = command_store if command_store is not None else CommandStore()
+        self.execute = execute
+        self.on_resolved = on_resolved
+        self.speculation = speculation
+        self.few_shot = few_shot
+        self.last_prompt = ""
+        self.last_intent = None
+        self.skip_next_store = False
+
+    def handle(self, prompt: str) -> AssistantResult:
+        """
+        Handle one prompt: a special command, or a command resolved from the
+        pattern store or the LLM and then dispatched.
+        """
+        command = prompt.strip().lower()
+        if command in EXIT_COMMANDS:
+            log("Assistant exited by user.")
+            return AssistantResult(prompt, kind="exit")
+        if command == STORE_LAST:
+            return self._store_last(prompt)
+        if command == NO_STORE:
+            self.skip_next_store = True
+            return AssistantResult(prompt, kind="special", message="Next command will not be stored as a pattern.")
+        if command == CLEAR_PATTERNS:
+            with self.command_store.lock:
+                self.command_store.clear_patterns()
+            return AssistantResult(prompt, kind="special", message="✅ All command patterns cleared.")
+
+        with trace(prompt) as current_trace:
+            result = self._handle_command(prompt, current_trace)
+        result.timings = {name: round(seconds * 1000, 3) for name, seconds in current_trace.spans.items()}
+        result.total_ms = round(current_trace.elapsed() * 1000, 3)
+        return result
+
+    def _store_last(self, prompt: str) -> AssistantResult:
+        if not (self.last_prompt and self.last_intent):
+            return AssistantResult(prompt, kind="special", message="No previous command to store.")
+        log(f"Storing command as pattern: {self.last_prompt}")
+        with self.command_store.lock:
+            stored = self.command_store.add_pattern(self.last_prompt, self.last_intent, store_command=True)
+        return AssistantResult(prompt, kind="special", intent=self.last_intent, stored=stored)
+
+    def _handle_command(self, prompt: str, current_trace) -> AssistantResult:
+        log(f"User prompt: {prompt}")
+        result = AssistantResult(prompt)
+
+        # Check if the command matches a stored pattern. The store's lock is held
+        # for lookups and updates only, never while waiting on the LLM or dispatching
+        llm_intent = None
+        if self.speculation is None:
+            with self.command_store.lock:
+                match = self.command_store.match_command_details(prompt)
+        else:
+            match, llm_intent = self._match_speculatively(prompt)
+
+        if match:
+            result.source = "pattern"
+            result.intent = match["intent"]
+            result.variables = match["variables"]
+            result.category = match["category"]
+            result.match_stage = match["stage"]
+            result.matched_pattern = match["pattern"]
+            result.score = match["score"]
+            log(f"Matched command pattern in category '{result.category}'. Variables: {result.variables}")
+        else:
+            # No match found, use LLM to parse the prompt. Imported on the first
+            # miss so prompts answered from patterns never load the HTTP client
+            from llm_agent import parse_prompt
+            result.source = "llm"
+            if llm_intent is None:
+                llm_intent = parse_prompt(prompt, examples=self._examples(prompt))
+            # Generated code that is really a file operation runs (and is stored) natively
+            result.intent = native_intent(llm_intent)
+            log(f"LLM returned intent: {result.intent}")
+
+            # Store the command and intent for future use
+            self.last_prompt = prompt
+            self.last_intent = result.intent
+
+            # Store all commands by default unless skipped
+            if not self.skip_next_store:
+                with self.command_store.lock:
+                    result.stored = self.command_store.add_pattern(prompt, result.intent, store_command=True)
+            else:
+                result.message = "Command not stored as requested."
+                self.skip_next_store = False
+
+        current_trace.set(source=result.source, category=result.category, action=result.intent.get("action"))
+        if self.on_resolved is not None:
+            self.on_resolved(result)
+        if self.execute:
+            result.outcome = dispatch_command(result.intent, prompt, result.source == "pattern")
+        return result
+
+    def _examples(self, prompt: str):
+        if not self.few_shot:
+            return None
+        with self.command_store.lock:
+            return self.command_store.few_shot_examples(prompt, self.few_shot)
+
+    def _match_speculatively(self, prompt: str) -> Tuple[Optional[dict], Optional[dict]]:
+        """
+        Match the prompt while the LLM parses it, once matching reaches the slow
+        stages (see SpeculationPolicy).
+
+        Returns:
+            (match, None) to use the match, or (None, intent) to use the LLM's intent.
+        """
+        answered = threading.Event()
+        state = {}
+
+        def ask_llm(context, candidates):
+            from llm_agent import LLMCancelled, parse_prompt
+            # Scored here, off the matching thread and without the store lock
+            examples = None
+            if candidates is not None:
+                examples = self.command_store.few_shot_examples(prompt, self.few_shot, candidates=candidates)
+            try:
+                # Runs in a copy of the caller's context so its spans land in the prompt's trace
+                intent = context.run(parse_prompt, prompt, state["cancellation"], examples)
+            except LLMCancelled:
+                return
+            state["intent"] = intent
+            if intent.get("action") != "unknown":
+                answered.set()
+
+        def start_llm():
+            from llm_agent import Cancellation
+            state["cancellation"] = Cancellation()
+            # Called with the store lock held, so only the candidate list is taken here
+            candidates = self.command_store.few_shot_candidates(prompt) if self.few_shot else None
+            thread = threading.Thread(target=ask_llm, args=(contextvars.copy_context(), candidates),
+                                      name="speculative-llm", daemon=True)
+            state["thread"] = thread
+            thread.start()
+
+        with self.command_store.lock:
+            match = self.command_store.match_command_details(prompt, on_slow_path=start_llm, stop=answered)
+
+        if "thread" not in state:
+            # Answered by the exact or pattern stage; the LLM was never asked
+            return match, None
+        if answered.is_set():
+            log(f"LLM answered before pattern matching finished: {prompt}")
+            return None, state["intent"]
+        if match and match["score"] >= self.speculation.min_score:
+            state["cancellation"].cancel()
+            return match, None
+
+        state["thread"].join()
+        intent = state.get("intent", {"action": "unknown"})
+        if match and intent.get("action") == "unknown":
+            log(f"LLM failed; using the weaker pattern match ({match['score']:.2f}) for: {prompt}")
+            return match, None
+        return None, intent
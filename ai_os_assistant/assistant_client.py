@@ -0,0 +1,162 @@
+"""
+Thin command-line client for the assistant daemon (daemon.py).
+
+Sends prompts over the daemon's local socket and prints what the assistant
+printed, so no model client or pattern library is loaded per command.
+
+Usage:
+    python daemon.py &
+    python assistant_client.py "Create a file named notes.txt"
+    python assistant_client.py            # interactive prompt
+
+Only the standard library is imported here, to keep the client's startup short.
+"""
+import argparse
+import json
+import os
+import socket
+import sys
+import tempfile
+from typing import Optional, Tuple
+
+# TCP port used where Unix domain sockets aren't available (older Windows)
+DEFAULT_PORT = 47631
+
+
+def default_address() -> str:
+    """The daemon address from AI_ASSISTANT_SOCKET, or a per-user default."""
+    address = os.environ.get("AI_ASSISTANT_SOCKET")
+    if address:
+        return address
+    if hasattr(socket, "AF_UNIX"):
+        user = os.getuid() if hasattr(os, "getuid") else os.environ.get("USERNAME", "user")
+        return os.path.join(tempfile.gettempdir(), f"ai_assistant-{user}.sock")
+    return f"127.0.0.1:{DEFAULT_PORT}"
+
+
+def tcp_address(address: str) -> Optional[Tuple[str, int]]:
+    """Return (host, port) if the address is HOST:PORT, None if it is a socket path."""
+    host, sep, port = address.rpartition(":")
+    if sep and host and port.isdigit() and "/" not in host and "\\" not in host:
+        return host, int(port)
+    return None
+
+
+def connect(address: str, timeout: Optional[float] = None) -> socket.socket:
+    tcp = tcp_address(address)
+    if tcp is not None:
+        return socket.create_connection(tcp, timeout=timeout)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(address)
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+
+class AssistantClient:
+    """
+    One connection to the daemon. Requests and responses are single JSON lines.
+
+    Example:
+        with AssistantClient() as client:
+            response = client.handle("Create a file named notes.txt")
+            print(response["output"], response["result"]["source"])
+    """
+
+    def __init__(self, address: Optional[str] = None, timeout: Optional[float] = None):
+        self.address = address or default_address()
+        self._sock = connect(self.address, timeout)
+        self._file = self._sock.makefile("rwb")
+        self._next_id = 0
+
+    def request(self, payload: dict) -> dict:
+        self._next_id += 1
+        payload = dict(payload, id=self._next_id)
+        self._file.write(json.dumps(payload).encode("utf-8") + b"\n")
+        self._file.flush()
+        line = self._file.readline()
+        if not line:
+            raise ConnectionError("assistant daemon closed the connection")
+        return json.loads(line)
+
+    def handle(self, prompt: str) -> dict:
+        """Run one prompt; the response has "result" (an AssistantResult as a dict) and "output"."""
+        return self.request({"op": "handle", "prompt": prompt})
+
+    def ping(self) -> dict:
+        return self.request({"op": "ping"})
+
+    def shutdown(self) -> dict:
+        return self.request({"op": "shutdown"})
+
+    def close(self):
+        try:
+            self._file.close()
+        finally:
+            self._sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def show_response(response: dict, as_json: bool = False) -> Optional[dict]:
+    """Print a handle() response the way the REPL would and return its result."""
+    if as_json:
+        print(json.dumps(response, indent=2))
+        return response.get("result")
+    if not response.get("ok"):
+        print(f"!! {response.get('error', 'request failed')}")
+        return None
+    print(response.get("output", ""), end="")
+    result = response["result"]
+    if result["kind"] == "special" and result["message"]:
+        print(result["message"])
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Send commands to a running assistant daemon")
+    parser.add_argument("prompt", nargs="*", help="Command to run; starts an interactive prompt if omitted")
+    parser.add_argument("--address", default=None,
+                        help="Daemon socket path or HOST:PORT (default: $AI_ASSISTANT_SOCKET or a per-user socket)")
+    parser.add_argument("--json", action="store_true", help="Print the raw JSON responses")
+    parser.add_argument("--ping", action="store_true", help="Check that the daemon is running")
+    parser.add_argument("--shutdown", action="store_true", help="Stop the daemon")
+    args = parser.parse_args(argv)
+
+    try:
+        client = AssistantClient(args.address)
+    except OSError:
+        print(f"!! The assistant daemon is not running on {args.address or default_address()}. Start it with:")
+        print("python daemon.py")
+        return 2
+
+    with client:
+        if args.ping or args.shutdown:
+            response = client.shutdown() if args.shutdown else client.ping()
+            print(json.dumps(response) if args.json else response.get("status", response))
+            return 0 if response.get("ok") else 1
+        if args.prompt:
+            result = show_response(client.handle(" ".join(args.prompt)), args.json)
+            return 0 if result is not None else 1
+
+        while True:
+            try:
+                prompt = input("> ")
+            except (EOFError, KeyboardInterrupt):
+                print()
+                break
+            result = show_response(client.handle(prompt), args.json)
+            if result is not None and result["kind"] == "exit":
+                break
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
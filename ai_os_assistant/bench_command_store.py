@@ -0,0 +1,256 @@
+"""
+Benchmark CommandStore matching and persistence on synthetic pattern libraries.
+
+Usage:
+    python bench_command_store.py                      # 10^2 .. 10^5 patterns
+    python bench_command_store.py --sizes 100,1000     # smaller run
+    python bench_command_store.py --compare bench_results/command_store-abc1234.json
+
+Results are written as JSON (one entry per library size and operation) so runs
+from different commits can be compared with --compare.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from command_store import CommandStore, CATEGORY_KEYWORDS
+
+DEFAULT_SIZES = [100, 1000, 10000, 100000]
+RESULTS_DIR = "bench_results"
+
+# Vocabulary used to make synthetic commands distinct from each other
+WORDS = ["alpha", "bravo", "charlie", "delta", "echo", "foxtrot", "golf", "hotel", "india", "juliet",
+         "kilo", "lima", "mike", "november", "oscar", "papa", "quebec", "romeo", "sierra", "tango",
+         "uniform", "victor", "whiskey", "xray", "yankee", "zulu", "report", "project", "backup", "notes"]
+
+# Per-category variable and value generator used by the synthetic library
+CATEGORY_VARIABLES = {
+    "file_creation": ("filename", lambda rng: f"{rng.choice(WORDS)}_{rng.randrange(1000)}.txt"),
+    "open_webpage": ("url", lambda rng: f"www.{rng.choice(WORDS)}{rng.randrange(1000)}.com"),
+    "search_query": ("query", lambda rng: " ".join(rng.sample(WORDS, 3))),
+    "file_rename": ("filename", lambda rng: f"{rng.choice(WORDS)}.csv"),
+    "file_deletion": ("filename", lambda rng: f"{rng.choice(WORDS)}.log"),
+    "directory_creation": ("folder", lambda rng: rng.choice(WORDS)),
+    "directory_deletion": ("folder", lambda rng: rng.choice(WORDS)),
+    "system_operation": ("number", lambda rng: str(rng.randrange(1, 60))),
+    "program_launch": ("program", lambda rng: rng.choice(WORDS).capitalize()),
+}
+
+
+def generate_library(size: int, seed: int = 0):
+    """
+    Build a synthetic pattern library spread evenly over CATEGORY_KEYWORDS.
+
+    Roughly a third of the entries are raw commands (no variables), the rest are
+    variable patterns, mirroring what add_pattern(store_command=True) produces.
+
+    Returns:
+        Tuple of (patterns dict, commands that hit a variable pattern,
+        raw commands stored verbatim).
+    """
+    rng = random.Random(seed)
+    categories = list(CATEGORY_KEYWORDS)
+    patterns = {category: [] for category in categories}
+    hit_commands = []
+    raw_commands = []
+
+    for i in range(size):
+        category = categories[i % len(categories)]
+        keyword = rng.choice(CATEGORY_KEYWORDS[category])
+        var_name, make_value = CATEGORY_VARIABLES[category]
+        # A unique tag keeps patterns distinct at every library size
+        tag = f"{rng.choice(WORDS)} {rng.choice(WORDS)} {i}"
+
+        if i % 3 == 0:
+            command = f"please {keyword} {tag} now"
+            patterns[category].append({
+                "raw_command": command,
+                "pattern": command,
+                "intent_template": {"action": "run_code", "code": f"print({i})"},
+                "variables": []
+            })
+            raw_commands.append(command)
+        else:
+            value = make_value(rng)
+            pattern = f"{keyword} {tag} with {{{var_name}}}"
+            command = pattern.replace(f"{{{var_name}}}", value)
+            patterns[category].append({
+                "pattern": pattern,
+                "intent_template": {"action": "run_code", "code": f"print('{{{var_name}}}')"},
+                "variables": [var_name],
+                "example_command": command
+            })
+            hit_commands.append(command)
+
+    return patterns, hit_commands, raw_commands
+
+
+def percentile(sorted_values, fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def measure(func, inputs, max_seconds: float, min_samples: int = 3):
+    """Call func on each input until the inputs or the time budget run out."""
+    samples = []
+    deadline = time.perf_counter() + max_seconds
+    for item in inputs:
+        start = time.perf_counter()
+        func(item)
+        samples.append(time.perf_counter() - start)
+        if len(samples) >= min_samples and time.perf_counter() > deadline:
+            break
+    return samples
+
+
+def summarize(size: int, operation: str, samples) -> dict:
+    ordered = sorted(samples)
+    total = sum(ordered)
+    return {
+        "size": size,
+        "operation": operation,
+        "samples": len(ordered),
+        "mean_ms": round(statistics.mean(ordered) * 1000, 4),
+        "p50_ms": round(percentile(ordered, 0.50) * 1000, 4),
+        "p90_ms": round(percentile(ordered, 0.90) * 1000, 4),
+        "p99_ms": round(percentile(ordered, 0.99) * 1000, 4),
+        "max_ms": round(ordered[-1] * 1000, 4),
+        "ops_per_sec": round(len(ordered) / total, 2) if total else None,
+    }
+
+
+def bench_size(size: int, iterations: int, max_seconds: float, seed: int, workdir: str):
+    """Run every benchmark against one library size."""
+    rng = random.Random(seed + size)
+    patterns, hit_commands, raw_commands = generate_library(size, seed)
+    path = os.path.join(workdir, f"patterns_{size}.json")
+    with open(path, "w") as f:
+        json.dump(patterns, f, indent=2)
+
+    # add_pattern and fuzzy hits print to stdout; keep the benchmark output readable
+    with contextlib.redirect_stdout(io.StringIO()):
+        store = CommandStore(path=path)
+        results = []
+
+        def pick(commands, count):
+            return [rng.choice(commands) for _ in range(count)] if commands else []
+
+        results.append(summarize(size, "load_patterns",
+                                 measure(lambda _: store.load_patterns(), range(iterations), max_seconds)))
+        results.append(summarize(size, "save_patterns",
+                                 measure(lambda _: store.save_patterns(), range(iterations), max_seconds)))
+
+        categorize_inputs = pick(hit_commands + raw_commands, iterations * 10)
+        results.append(summarize(size, "detect_category",
+                                 measure(store.detect_category, categorize_inputs, max_seconds)))
+
+        results.append(summarize(size, "match_command.hit",
+                                 measure(store.match_command, pick(hit_commands, iterations), max_seconds)))
+
+        miss_inputs = [f"{rng.choice(WORDS)} {rng.choice(WORDS)} unrelated request {i}" for i in range(iterations)]
+        results.append(summarize(size, "match_command.miss",
+                                 measure(store.match_command, miss_inputs, max_seconds)))
+
+        # Fuzzy hits: a stored raw command with one word changed
+        fuzzy_inputs = []
+        for command in pick(raw_commands, iterations):
+            words = command.split()
+            words[-1] = "immediately"
+            fuzzy_inputs.append(" ".join(words))
+        results.append(summarize(size, "match_command.fuzzy",
+                                 measure(store.match_command, fuzzy_inputs, max_seconds)))
+
+        # add_pattern saves the whole library each time, so keep the count small
+        new_commands = [f"create file {rng.choice(WORDS)} {i} named bench_{i}.txt" for i in range(max(3, iterations // 5))]
+        add_intent = {"action": "create_file", "filename": "placeholder.txt"}
+        results.append(summarize(size, "add_pattern",
+                                 measure(lambda cmd: store.add_pattern(cmd, dict(add_intent, filename=cmd.split()[-1]),
+                                                                       store_command=True),
+                                         new_commands, max_seconds)))
+    return results
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(current: dict, baseline_path: str):
+    """Print the p50 ratio of this run against an earlier results file."""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    previous = {(r["size"], r["operation"]): r for r in baseline["results"]}
+    print(f"\nComparison against {baseline_path} (commit {baseline.get('commit')}):")
+    print(f"{'size':>8}  {'operation':<22} {'p50 before':>12} {'p50 now':>12} {'ratio':>8}")
+    for result in current["results"]:
+        before = previous.get((result["size"], result["operation"]))
+        if not before or not before["p50_ms"]:
+            continue
+        ratio = result["p50_ms"] / before["p50_ms"]
+        print(f"{result['size']:>8}  {result['operation']:<22} {before['p50_ms']:>12.4f} "
+              f"{result['p50_ms']:>12.4f} {ratio:>7.2f}x")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark CommandStore at several library sizes")
+    parser.add_argument("--sizes", default=",".join(str(s) for s in DEFAULT_SIZES),
+                        help="Comma-separated library sizes (default: %(default)s)")
+    parser.add_argument("--iterations", type=int, default=200, help="Samples per operation (default: %(default)s)")
+    parser.add_argument("--max-seconds", type=float, default=10.0,
+                        help="Time budget per operation and size; stops early on slow cases (default: %(default)s)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help=f"Results file (default: {RESULTS_DIR}/command_store-<commit>.json)")
+    parser.add_argument("--compare", help="Earlier results file to compare against")
+    args = parser.parse_args(argv)
+
+    sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+    commit = git_commit()
+    run = {
+        "benchmark": "command_store",
+        "commit": commit,
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "iterations": args.iterations,
+        "results": [],
+    }
+
+    workdir = tempfile.mkdtemp(prefix="bench_command_store_")
+    try:
+        print(f"{'size':>8}  {'operation':<22} {'samples':>7} {'p50 ms':>10} {'p90 ms':>10} {'p99 ms':>10} {'ops/s':>10}")
+        for size in sizes:
+            for result in bench_size(size, args.iterations, args.max_seconds, args.seed, workdir):
+                run["results"].append(result)
+                print(f"{result['size']:>8}  {result['operation']:<22} {result['samples']:>7} {result['p50_ms']:>10.4f} "
+                      f"{result['p90_ms']:>10.4f} {result['p99_ms']:>10.4f} {result['ops_per_sec'] or 0:>10.1f}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    output = args.output or os.path.join(RESULTS_DIR, f"command_store-{commit}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(run, f, indent=2)
+    print(f"\nResults written to {output}")
+
+    if args.compare:
+        compare(run, args.compare)
+
+
+if __name__ == "__main__":
+    main()
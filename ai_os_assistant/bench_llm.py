@@ -0,0 +1,163 @@
+"""
+Benchmark the LLM path against the offline Ollama stand-in.
+
+Measures parse_prompt, generate_code_for_action and the interactive main loop
+with a simulated model whose timing is known exactly, so the assistant's own
+overhead (HTTP, stream parsing, JSON extraction, pattern storage) can be
+separated from model latency.
+
+Usage:
+    python bench_llm.py --token-delay 0.002 --think-tokens 100
+    python bench_llm.py --profile parse_prompt.prof
+"""
+import argparse
+import contextlib
+import cProfile
+import io
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from mock_ollama import MockOllamaServer, add_mock_arguments, build_reply, config_from_args, split_tokens
+
+PROMPTS = [
+    "Create a file named report.txt",
+    "Open my browser to www.github.com",
+    "Search for quantum computing tutorials",
+    "Make me a file called notes.md",
+    "Tell me something the patterns have never seen",
+]
+
+
+def expected_model_seconds(config, prompt: str) -> float:
+    """Time the stand-in spends 'generating' its reply to a prompt, up to the end of the intent JSON."""
+    from llm_agent import _JsonEnd, _ThinkFilter
+    reply = build_reply(config, [{"role": "user", "content": prompt}])
+    answer = _ThinkFilter().feed(reply)
+    end = _JsonEnd().feed(answer)
+    if end != -1:
+        reply = reply[:len(reply) - len(answer) + end]
+    tokens = split_tokens(reply, config.chars_per_token)
+    return config.first_token_delay + config.token_delay * len(tokens)
+
+
+def summarize(name: str, samples, model_seconds) -> dict:
+    ordered = sorted(samples)
+    overhead = [s - m for s, m in zip(samples, model_seconds)]
+    return {
+        "operation": name,
+        "samples": len(ordered),
+        "p50_ms": round(statistics.median(ordered) * 1000, 3),
+        "p90_ms": round(ordered[int(0.9 * (len(ordered) - 1))] * 1000, 3),
+        "mean_ms": round(statistics.mean(ordered) * 1000, 3),
+        "model_ms": round(statistics.mean(model_seconds) * 1000, 3),
+        "overhead_ms": round(statistics.mean(overhead) * 1000, 3),
+        "per_sec": round(len(ordered) / sum(ordered), 2),
+    }
+
+
+def bench_calls(config, iterations: int):
+    import llm_agent
+    results = []
+
+    samples, model = [], []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for i in range(iterations):
+            prompt = PROMPTS[i % len(PROMPTS)]
+            start = time.perf_counter()
+            llm_agent.parse_prompt(prompt)
+            samples.append(time.perf_counter() - start)
+            model.append(expected_model_seconds(config, prompt))
+    results.append(summarize("parse_prompt", samples, model))
+
+    samples, model = [], []
+    code_request = "You are a code-only agent"
+    with contextlib.redirect_stdout(io.StringIO()):
+        for i in range(iterations):
+            start = time.perf_counter()
+            llm_agent.generate_code_for_action({"action": "unknown"}, PROMPTS[i % len(PROMPTS)])
+            samples.append(time.perf_counter() - start)
+            model.append(expected_model_seconds(config, code_request))
+    results.append(summarize("generate_code_for_action", samples, model))
+    return results
+
+
+def bench_main_loop(config, server, commands: int) -> dict:
+    """
+    Run main.py in a scratch directory and time a batch of prompts end to end.
+
+    Prompts the assistant learns along the way are answered from the pattern
+    store, so the model time is taken from what the stand-in actually served.
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    workdir = tempfile.mkdtemp(prefix="bench_llm_")
+    prompts = [f"Tell me something new number {i}" for i in range(commands)]
+    try:
+        env = dict(os.environ, OLLAMA_URL=server.url)
+        before = server.stats.to_dict()
+        start = time.perf_counter()
+        subprocess.run([sys.executable, os.path.join(here, "main.py")], cwd=workdir, env=env,
+                       input="\n".join(prompts + ["exit"]) + "\n", capture_output=True, text=True, check=True)
+        elapsed = time.perf_counter() - start
+        after = server.stats.to_dict()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    llm_requests = after["requests"] - before["requests"]
+    model_seconds = (llm_requests * config.first_token_delay
+                     + (after["tokens"] - before["tokens"]) * config.token_delay)
+    return {
+        "operation": "main_loop",
+        "samples": commands,
+        "total_ms": round(elapsed * 1000, 3),
+        "mean_ms": round(elapsed / commands * 1000, 3),
+        "model_ms": round(model_seconds / commands * 1000, 3),
+        "overhead_ms": round((elapsed - model_seconds) / commands * 1000, 3),
+        "per_sec": round(commands / elapsed, 2),
+        "llm_requests": llm_requests,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the LLM path against the mock Ollama server")
+    add_mock_arguments(parser)
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--loop-commands", type=int, default=20, help="Prompts sent through main.py (0 to skip)")
+    parser.add_argument("--profile", help="Write cProfile stats for the parse_prompt calls to this file")
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    args = parser.parse_args(argv)
+
+    config = config_from_args(args)
+    with MockOllamaServer(config) as server:
+        # llm_agent reads OLLAMA_URL at import time
+        os.environ["OLLAMA_URL"] = server.url
+        # One simulated model, so each prompt is a single request whose model time is known
+        os.environ.setdefault("OLLAMA_MODELS", config.model)
+        profiler = cProfile.Profile() if args.profile else None
+        if profiler:
+            profiler.enable()
+        results = bench_calls(config, args.iterations)
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(args.profile)
+        if args.loop_commands:
+            results.append(bench_main_loop(config, server, args.loop_commands))
+        stats = server.stats.to_dict()
+
+    print(f"{'operation':<26} {'mean ms':>10} {'model ms':>10} {'overhead ms':>12} {'per sec':>9}")
+    for result in results:
+        print(f"{result['operation']:<26} {result['mean_ms']:>10.3f} {result['model_ms']:>10.3f} "
+              f"{result['overhead_ms']:>12.3f} {result['per_sec']:>9.2f}")
+    print(f"Mock server: {stats}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"config": vars(args), "results": results, "mock": stats}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
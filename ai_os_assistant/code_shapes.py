@@ -0,0 +1,325 @@
+"""
+Native intents for common shapes of generated code.
+
+Much of the code the LLM writes is a file operation in disguise, e.g.
+open('{filename}', 'w').close(), which is replayed through exec and a compile on
+every match. recognize() parses the code (ast) and maps these shapes onto
+native actions the dispatcher runs directly:
+
+    open(F, 'w').close()                     -> create_file
+    with open(F, 'w') as f: f.write(C)       -> create_file (with content)
+    several of the above, or a for loop over
+    range() building the names               -> create_files
+    os.makedirs(D) / os.mkdir(D)             -> create_directory
+    os.remove(F) / os.unlink(F)              -> delete_file
+    shutil.rmtree(D) / os.rmdir(D)           -> delete_directory
+    webbrowser.open(U)                       -> open_url
+    a mix of the above                       -> multi, one step per statement
+
+Arguments must be string literals; placeholders in them ("{filename}") are kept,
+so a stored template stays a template. The native intent must behave like the
+code: files opened with another encoding than UTF-8 stay code, and
+create_directory keeps the call's exist_ok and whether it creates parents. Imports of os, shutil and webbrowser are
+ignored. Anything else leaves the code as it is.
+
+Usage:
+    python code_shapes.py --dry-run      # show which stored patterns would change
+    python code_shapes.py                # rewrite the stored library
+"""
+import argparse
+import ast
+from typing import Dict, List, Optional
+
+from intents import MULTI_ACTION
+from patterns import Pattern, thaw
+from utils import log
+
+# Most files a range() loop may expand to
+MAX_LOOP_FILES = 100
+
+_IGNORED_IMPORTS = frozenset(("os", "shutil", "webbrowser"))
+
+# Spellings of the encoding create_file writes
+_UTF8 = frozenset(("utf-8", "utf8"))
+
+_CALLS = {
+    ("os", "makedirs"): ("create_directory", "directory"),
+    ("os", "mkdir"): ("create_directory", "directory"),
+    ("os", "remove"): ("delete_file", "filename"),
+    ("os", "unlink"): ("delete_file", "filename"),
+    ("shutil", "rmtree"): ("delete_directory", "directory"),
+    ("os", "rmdir"): ("delete_directory", "directory"),
+    ("webbrowser", "open"): ("open_url", "url"),
+    ("webbrowser", "open_new"): ("open_url", "url"),
+    ("webbrowser", "open_new_tab"): ("open_url", "url"),
+}
+
+
+def _string(node) -> Optional[str]:
+    if isinstance(node, ast.Constant) and isinstance(node.value, str):
+        return node.value
+    return None
+
+
+def _same_as_create_file(keyword) -> bool:
+    """Whether an open() keyword writes the same bytes as create_file (UTF-8, default newlines)."""
+    if keyword.arg == "encoding":
+        encoding = _string(keyword.value)
+        return encoding is not None and encoding.lower().replace("_", "-") in _UTF8
+    if keyword.arg == "newline":
+        return isinstance(keyword.value, ast.Constant) and keyword.value.value is None
+    return False
+
+
+def _write_mode(call) -> bool:
+    """Whether a call is open(<literal>, 'w'), optionally with a UTF-8 encoding."""
+    if not (isinstance(call, ast.Call) and isinstance(call.func, ast.Name) and call.func.id == "open"):
+        return False
+    if len(call.args) != 2 or _string(call.args[0]) is None:
+        return False
+    return _string(call.args[1]) == "w" and all(_same_as_create_file(keyword) for keyword in call.keywords)
+
+
+def _opened_filename(statement) -> Optional[str]:
+    """The file an `open(F, 'w').close()` statement creates."""
+    if not isinstance(statement, ast.Expr):
+        return None
+    call = statement.value
+    if (isinstance(call, ast.Call) and not call.args and not call.keywords
+            and isinstance(call.func, ast.Attribute) and call.func.attr == "close"
+            and _write_mode(call.func.value)):
+        return _string(call.func.value.args[0])
+    return None
+
+
+def _with_open(statement) -> Optional[Dict[str, str]]:
+    """create_file for `with open(F, 'w') as f: f.write(C)` (or pass)."""
+    if not isinstance(statement, ast.With) or len(statement.items) != 1:
+        return None
+    item = statement.items[0]
+    if not _write_mode(item.context_expr):
+        return None
+    filename = _string(item.context_expr.args[0])
+    body = statement.body
+    if len(body) == 1 and isinstance(body[0], ast.Pass):
+        return {"action": "create_file", "filename": filename}
+    handle = item.optional_vars
+    if not (isinstance(handle, ast.Name) and len(body) == 1 and isinstance(body[0], ast.Expr)):
+        return None
+    call = body[0].value
+    if (isinstance(call, ast.Call) and len(call.args) == 1 and not call.keywords
+            and isinstance(call.func, ast.Attribute) and call.func.attr == "write"
+            and isinstance(call.func.value, ast.Name) and call.func.value.id == handle.id
+            and _string(call.args[0]) is not None):
+        return {"action": "create_file", "filename": filename, "content": _string(call.args[0])}
+    return None
+
+
+def _module_call(statement) -> Optional[dict]:
+    """The intent for `module.function(<literal>)` calls in _CALLS."""
+    if not isinstance(statement, ast.Expr) or not isinstance(statement.value, ast.Call):
+        return None
+    call = statement.value
+    func = call.func
+    if not (isinstance(func, ast.Attribute) and isinstance(func.value, ast.Name)):
+        return None
+    target = _CALLS.get((func.value.id, func.attr))
+    if target is None or len(call.args) != 1 or _string(call.args[0]) is None:
+        return None
+    action, field = target
+    intent = {"action": action, field: _string(call.args[0])}
+    if func.attr in ("makedirs", "mkdir"):
+        # create_directory defaults to makedirs(exist_ok=True); anything else is spelled out
+        exist_ok = False
+        for keyword in call.keywords:
+            if not (keyword.arg == "exist_ok" and func.attr == "makedirs"
+                    and isinstance(keyword.value, ast.Constant) and type(keyword.value.value) is bool):
+                return None
+            exist_ok = keyword.value.value
+        if not exist_ok:
+            intent["exist_ok"] = False
+        if func.attr == "mkdir":
+            intent["parents"] = False
+    elif call.keywords:
+        return None
+    if func.attr == "rmdir":
+        intent["recursive"] = False
+    return intent
+
+
+def _loop_name(node, variable: str, value: int) -> Optional[str]:
+    """Evaluate a filename expression built from string literals and str(i) or f'{i}'."""
+    if _string(node) is not None:
+        return _string(node)
+    if isinstance(node, ast.BinOp) and isinstance(node.op, ast.Add):
+        left = _loop_name(node.left, variable, value)
+        right = _loop_name(node.right, variable, value)
+        return None if left is None or right is None else left + right
+    if (isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id == "str"
+            and len(node.args) == 1 and not node.keywords
+            and isinstance(node.args[0], ast.Name) and node.args[0].id == variable):
+        return str(value)
+    if isinstance(node, ast.JoinedStr):
+        parts = []
+        for part in node.values:
+            if isinstance(part, ast.FormattedValue):
+                if not (isinstance(part.value, ast.Name) and part.value.id == variable
+                        and part.conversion == -1 and part.format_spec is None):
+                    return None
+                parts.append(str(value))
+            else:
+                parts.append(part.value)
+        return "".join(parts)
+    return None
+
+
+def _range_loop(statement) -> Optional[List[str]]:
+    """The files created by `for i in range(a, b): open(<name from i>, 'w').close()`."""
+    if not (isinstance(statement, ast.For) and isinstance(statement.target, ast.Name)
+            and not statement.orelse and len(statement.body) == 1):
+        return None
+    loop = statement.iter
+    if not (isinstance(loop, ast.Call) and isinstance(loop.func, ast.Name) and loop.func.id == "range"
+            and 1 <= len(loop.args) <= 2 and not loop.keywords
+            and all(isinstance(arg, ast.Constant) and type(arg.value) is int for arg in loop.args)):
+        return None
+    bounds = [arg.value for arg in loop.args]
+    values = range(*bounds)
+    if not 0 < len(values) <= MAX_LOOP_FILES:
+        return None
+    body = statement.body[0]
+    if not (isinstance(body, ast.Expr) and isinstance(body.value, ast.Call)
+            and isinstance(body.value.func, ast.Attribute) and body.value.func.attr == "close"
+            and not body.value.args):
+        return None
+    opened = body.value.func.value
+    if not (isinstance(opened, ast.Call) and isinstance(opened.func, ast.Name) and opened.func.id == "open"
+            and len(opened.args) == 2 and _string(opened.args[1]) == "w" and not opened.keywords):
+        return None
+    names = [_loop_name(opened.args[0], statement.target.id, value) for value in values]
+    return None if None in names else names
+
+
+def recognize(code: str) -> Optional[dict]:
+    """
+    The native intent equivalent to a piece of generated code.
+
+    Returns:
+        The intent, or None if the code isn't one of the recognised shapes.
+    """
+    try:
+        tree = ast.parse(code)
+    except (SyntaxError, ValueError):
+        return None
+    intents = []
+    for statement in tree.body:
+        if isinstance(statement, ast.Import):
+            if all(alias.name in _IGNORED_IMPORTS and alias.asname is None for alias in statement.names):
+                continue
+            return None
+        filename = _opened_filename(statement)
+        if filename is not None:
+            intents.append({"action": "create_file", "filename": filename})
+            continue
+        looped = _range_loop(statement)
+        if looped is not None:
+            intents.append({"action": "create_files", "filenames": looped})
+            continue
+        intent = _with_open(statement) or _module_call(statement)
+        if intent is None:
+            return None
+        intents.append(intent)
+
+    if len(intents) == 1:
+        return intents[0]
+    # Several empty files (from statements and/or loops) are one create_files
+    if intents and all(intent["action"] == "create_files"
+                       or (intent["action"] == "create_file" and not intent.get("content"))
+                       for intent in intents):
+        names = []
+        for intent in intents:
+            names.extend(intent["filenames"] if intent["action"] == "create_files" else [intent["filename"]])
+        return {"action": "create_files", "filenames": names}
+    # Otherwise each statement is a step, run in order where they touch the same paths
+    return {"action": MULTI_ACTION, "intents": intents} if intents else None
+
+
+def native_intent(intent: dict) -> dict:
+    """
+    The native form of a run_code intent if its code is recognised, else the
+    intent itself. The steps of a multi intent are converted one by one.
+    """
+    if isinstance(intent, dict) and intent.get("action") == MULTI_ACTION and isinstance(intent.get("intents"), list):
+        steps = []
+        for step in intent["intents"]:
+            native = native_intent(step)
+            # A step whose code became several steps is spliced in, since multi intents don't nest
+            if native is not step and native.get("action") == MULTI_ACTION:
+                steps.extend(native["intents"])
+            else:
+                steps.append(native)
+        if len(steps) == len(intent["intents"]) and all(a is b for a, b in zip(steps, intent["intents"])):
+            return intent
+        return dict(intent, intents=steps)
+    if not isinstance(intent, dict) or intent.get("action") != "run_code" or not isinstance(intent.get("code"), str):
+        return intent
+    native = recognize(intent["code"])
+    if native is None:
+        return intent
+    log(f"Using native {native['action']} intent for generated code: {intent['code']!r}")
+    return native
+
+
+def rewrite_library(patterns: Dict[str, List[Pattern]]) -> List[Pattern]:
+    """
+    Replace stored run_code patterns whose code is recognised with native ones.
+    Changed categories get new lists, so their match indexes are rebuilt.
+
+    Returns:
+        The new patterns.
+    """
+    rewritten = []
+    for category, entries in patterns.items():
+        changed = False
+        updated = []
+        for pattern in entries:
+            template = thaw(pattern.intent_template)
+            native = native_intent(template)
+            if native is template:
+                updated.append(pattern)
+                continue
+            replacement = Pattern(category, pattern.pattern, native, pattern.variables, pattern.example_command,
+                                  pattern.raw_command, pattern.extra, pattern.hits, pattern.last_used)
+            updated.append(replacement)
+            rewritten.append(replacement)
+            changed = True
+        if changed:
+            patterns[category] = updated
+    return rewritten
+
+
+def main(argv=None):
+    from command_store import COMMAND_STORE_FILE, CommandStore
+
+    parser = argparse.ArgumentParser(description="Rewrite stored generated code as native intents")
+    parser.add_argument("--path", default=COMMAND_STORE_FILE, help="Pattern library (default: %(default)s)")
+    parser.add_argument("--dry-run", action="store_true", help="Show the changes without saving them")
+    args = parser.parse_args(argv)
+
+    store = CommandStore(args.path, refresh_interval=None)
+    if args.dry_run:
+        with store.lock:
+            rewritten = rewrite_library({category: list(entries) for category, entries in store.patterns.items()})
+    else:
+        found = []
+        with store.lock:
+            store.update_patterns(lambda patterns: found.extend(rewrite_library(patterns)))
+        rewritten = found
+    for pattern in rewritten:
+        print(f"[{pattern.category}] {pattern.pattern} -> {thaw(pattern.intent_template)}")
+    verb = "Would rewrite" if args.dry_run else "Rewrote"
+    print(f"{verb} {len(rewritten)} pattern(s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,51 @@
 import json
 import os
 import re
-from typing import Dict, List, Optional, Tuple, Set
-from utils import log
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Tuple, Set
+from utils import log, ERROR, WARNING
+from tracing import span, timed
+from metrics import PATTERN_MATCHES, FUZZY_SCORE
+from patterns import Pattern, dump_library, load_library, normalize_command, same_patterns
+from templates import make_template
+from pattern_trie import CategoryIndex
+from extractors import EXTRACTORS, ExtractorRegistry
+from intents import validate_intent
+from code_shapes import native_intent
+from file_watcher import FileWatcher
 from difflib import SequenceMatcher
 
+try:
+    import fcntl
+except ImportError:
+    # No advisory locks on Windows; saves are still atomic but not merged under a lock
+    fcntl = None
+
 # File to store command patterns
 COMMAND_STORE_FILE = "command_patterns.json"
 
+# Seconds between checks of the pattern file for changes made by other processes
+REFRESH_INTERVAL = 1.0
+
+# Seconds between saves of hit counts and last-used times; flush_usage() saves them sooner
+USAGE_SAVE_INTERVAL = 30.0
+
+# Hit counts and last-used times are saved next to the pattern file, in PATH + USAGE_SUFFIX,
+# so using the assistant doesn't modify the library itself
+USAGE_SUFFIX = ".usage"
+
+# Stores with hits not saved yet; a background thread saves them every USAGE_SAVE_INTERVAL
+# seconds, so matching never waits for a save
+_unsaved_usage = weakref.WeakSet()
+_usage_saver = None
+_usage_saver_lock = threading.Lock()
+
+# How eviction picks the raw commands to drop: least frequently or least recently used
+EVICTION_POLICIES = ("lfu", "lru")
+
 # Keywords for common command categories
 CATEGORY_KEYWORDS = {
     "file_creation": ["create file", "make file", "new file"],
@@ -21,31 +59,494 @@ CATEGORY_KEYWORDS = {
     "search_query": ["search for", "find", "look up", "google", "bing", "search"],
 }
 
+def _save_usage_periodically():
+    while True:
+        time.sleep(USAGE_SAVE_INTERVAL)
+        for store in list(_unsaved_usage):
+            _unsaved_usage.discard(store)
+            with store.lock:
+                store.flush_usage()
+
+
+def _schedule_usage_save(store):
+    global _usage_saver
+    _unsaved_usage.add(store)
+    with _usage_saver_lock:
+        if _usage_saver is None:
+            _usage_saver = threading.Thread(target=_save_usage_periodically, name="save-usage", daemon=True)
+            _usage_saver.start()
+
+
 class CommandStore:
-    def __init__(self):
-        self.patterns = {}
-        self.load_patterns()
+    def __init__(self, path: str = COMMAND_STORE_FILE, load_in_background: bool = False,
+                 refresh_interval: Optional[float] = REFRESH_INTERVAL,
+                 extractors: Optional[ExtractorRegistry] = None, capacity: Optional[int] = None,
+                 eviction: str = "lfu", archive_path: Optional[str] = None):
+        """
+        Args:
+            path: JSON file holding the pattern library. Pattern usage is kept
+                next to it, in path + USAGE_SUFFIX.
+            load_in_background: Read the file on a background thread so the caller
+                can carry on (e.g. show the prompt); the first access to the
+                patterns waits for the load to finish.
+            refresh_interval: How often (seconds) match_command checks the file for
+                patterns saved by other processes. None disables the check.
+            extractors: Variable extractors used when learning patterns; defaults
+                to extractors.EXTRACTORS, which register_extractor() adds to.
+            capacity: Most raw commands to keep; storing more evicts the coldest
+                ones. None keeps every command. Variable patterns are never evicted.
+            eviction: "lfu" evicts the least used commands (oldest use first
+                among equals), "lru" the least recently used ones.
+            archive_path: JSON-lines file evicted commands are appended to.
+        """
+        if eviction not in EVICTION_POLICIES:
+            raise ValueError(f"eviction must be one of {', '.join(EVICTION_POLICIES)}, not {eviction!r}")
+        self.path = path
+        self.usage_path = path + USAGE_SUFFIX
+        self.extractors = extractors if extractors is not None else EXTRACTORS
+        self._patterns = {}
+        self._loaded = threading.Event()
+        # Held by callers that share one store between threads (see Assistant)
+        self.lock = threading.RLock()
+        self.load_seconds = None
+        self.refresh_interval = refresh_interval
+        # (inode, mtime, size) of the file as last read or written by this process
+        self._signature = None
+        # category -> hash of its JSON as last read or written by this process;
+        # a category missing here is parsed on the next reload
+        self._fingerprints = {}
+        # FileWatcher reloading changes in the background, see watch()
+        self._watcher = None
+        self._last_refresh = time.monotonic()
+        self._replace_on_save = False
+        # Patterns stored here since the file was last read or written, which a
+        # sync with the file must not drop
+        self._added = []
+        self.capacity = capacity
+        self.eviction = eviction
+        self.archive_path = archive_path
+        # Hits recorded since usage was last saved
+        self._usage_dirty = False
+        # category -> CategoryIndex, brought up to date on lookup
+        self._indexes = {}
+        if load_in_background:
+            threading.Thread(target=self.load_patterns, name="load-patterns", daemon=True).start()
+        else:
+            self.load_patterns()
+    
+    @property
+    def patterns(self) -> Dict[str, List[Pattern]]:
+        """Stored patterns by category."""
+        if not self._loaded.is_set():
+            self._loaded.wait()
+        return self._patterns
+    
+    @patterns.setter
+    def patterns(self, value: dict):
+        # Don't let a background load overwrite patterns replaced in the meantime
+        self._loaded.wait()
+        # Plain dicts (the JSON form) are accepted and converted
+        self._patterns = load_library(value)
+        # Replaced wholesale, so the next save shouldn't merge the old file back in
+        self._replace_on_save = True
+    
+    def wait_until_loaded(self, timeout: Optional[float] = None) -> bool:
+        return self._loaded.wait(timeout)
+    
+    @contextmanager
+    def _file_lock(self, exclusive: bool):
+        """
+        Hold an advisory lock on a side file next to the pattern file.
+        
+        The pattern file itself is replaced on every save, so the lock lives on
+        a separate file that keeps its inode.
+        """
+        if fcntl is None:
+            yield
+            return
+        try:
+            lock_file = open(self.path + ".lock", "a+")
+        except OSError as e:
+            log(f"Could not open pattern lock file: {e}", ERROR)
+            yield
+            return
+        with lock_file:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+    
+    def _file_signature(self) -> Optional[Tuple[int, int, int]]:
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+    
+    def _read_raw(self) -> Optional[dict]:
+        """The pattern file's JSON ({} if there is no file), or None if it can't be read; call with the file lock held."""
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, 'r') as f:
+                return json.load(f)
+        except Exception as e:
+            log(f"Error loading command patterns: {e}", ERROR)
+            return None
+    
+    @staticmethod
+    def _fingerprints_of(data: dict) -> Dict[str, int]:
+        """A hash of each category's JSON, to tell which categories a reload needs to parse."""
+        return {category: hash(json.dumps(entries, separators=(",", ":"))) for category, entries in data.items()}
     
     def load_patterns(self):
         """Load command patterns from file."""
-        if os.path.exists(COMMAND_STORE_FILE):
+        start = time.perf_counter()
+        try:
+            with self._file_lock(exclusive=False):
+                self._signature = self._file_signature()
+                raw = self._read_raw()
+                usage = self._read_usage()
+            # Fingerprinted like a reload, so the first reload only parses what changed since
+            self._fingerprints = self._fingerprints_of(raw or {})
+            self._patterns = load_library(raw or {})
+            self._apply_usage(usage)
+        finally:
+            self.load_seconds = time.perf_counter() - start
+            self._loaded.set()
+    
+    def reload_changes(self) -> Set[str]:
+        """
+        Pick up patterns saved by other processes since this store last read or
+        wrote the file. Only categories whose JSON changed since then are
+        parsed, and their match indexes are built before they replace the old
+        ones, so matching carries on with the old patterns meanwhile. An
+        unreadable file (e.g. one being written in place) is left for the
+        next change.
+        
+        Returns:
+            The names of the categories that changed.
+        """
+        if self._file_signature() == self._signature:
+            return set()
+        with self._file_lock(exclusive=False):
+            signature = self._file_signature()
+            raw = self._read_raw()
+        if raw is None:
+            return set()
+        fingerprints = self._fingerprints_of(raw)
+        previous = self._fingerprints
+        categories = {category for category in set(fingerprints) | set(previous)
+                      if fingerprints.get(category) != previous.get(category)}
+        on_disk = load_library({category: raw[category] for category in categories if category in raw})
+        # Categories whose only change is usage keep their index
+        indexes = {category: CategoryIndex(entries) for category, entries in on_disk.items()
+                   if not same_patterns(self.patterns.get(category, []), entries)}
+        with self.lock:
+            if self._fingerprints is not previous:
+                # Saved or reloaded by another thread in the meantime; this read may be stale
+                return set()
+            self._signature = signature
+            self._fingerprints = fingerprints
+            changed = self._apply_disk_changes(on_disk, categories)
+            self._keep_added()
+            for category in changed:
+                if category in indexes and self.patterns.get(category) is indexes[category].source:
+                    self._indexes[category] = indexes[category]
+        return changed
+    
+    def _apply_disk_changes(self, on_disk: Dict[str, List[Pattern]], categories: Optional[Set[str]] = None) -> Set[str]:
+        """Update categories (all of them if None) from on_disk; one missing from on_disk was removed."""
+        changed = set()
+        if categories is None:
+            categories = set(self.patterns) | set(on_disk)
+        for category in categories:
+            current = self.patterns.get(category, [])
+            updated = on_disk.get(category, [])
+            if same_patterns(current, updated):
+                # Only usage differs: keep these patterns, and their index, with the higher counts
+                if any([mine.merge_usage(theirs) for mine, theirs in zip(current, updated)]):
+                    index = self._indexes.get(category)
+                    if index is not None:
+                        index.usage_changed()
+                continue
+            # Hits recorded here but not saved yet aren't lost with the reload
+            by_key = {p.key: p for p in current}
+            for pattern_data in updated:
+                if pattern_data.key in by_key:
+                    pattern_data.merge_usage(by_key[pattern_data.key])
+            changed.add(category)
+            if updated:
+                self.patterns[category] = updated
+            else:
+                self.patterns.pop(category, None)
+        if changed:
+            log(f"Reloaded command patterns changed by another process: {', '.join(sorted(changed))}")
+        return changed
+    
+    def check_for_changes(self) -> Set[str]:
+        """Call reload_changes() at most once per refresh_interval, unless a watcher already does."""
+        if self.refresh_interval is None or self._watcher is not None:
+            return set()
+        now = time.monotonic()
+        if now - self._last_refresh < self.refresh_interval:
+            return set()
+        self._last_refresh = now
+        return self.reload_changes()
+    
+    def watch(self, poll_interval: float = REFRESH_INTERVAL, use_inotify: bool = True) -> FileWatcher:
+        """
+        Reload patterns other processes save as soon as the file changes, on a
+        background thread, rather than on the next match.
+        
+        Args:
+            poll_interval: Seconds between checks where inotify isn't available.
+            use_inotify: False always polls the file.
+            
+        Returns:
+            The running watcher.
+        """
+        if self._watcher is None:
+            self._watcher = FileWatcher(self.path, self.reload_changes, poll_interval,
+                                        use_inotify=use_inotify).start()
+        return self._watcher
+    
+    def stop_watching(self):
+        """Stop the watcher started by watch(); matches check the file again."""
+        watcher, self._watcher = self._watcher, None
+        if watcher is not None:
+            watcher.stop()
+    
+    def _sync_from_disk(self):
+        """
+        Bring memory up to date with the file, including patterns other processes
+        removed, keeping the patterns added here since the last sync; call with
+        the exclusive file lock held.
+        """
+        raw = self._read_raw()
+        if raw is None:
+            # Unreadable, so there is nothing to take from it; the next save replaces it
+            return
+        self._signature = self._file_signature()
+        self._apply_disk_changes(load_library(raw))
+        self._keep_added()
+    
+    def _keep_added(self):
+        """Put back patterns added here but not saved yet that a reload dropped."""
+        for pattern_data in self._added:
+            current = self.patterns.get(pattern_data.category)
+            if current is None:
+                current = self.patterns[pattern_data.category] = []
+            if all(p.key != pattern_data.key for p in current):
+                current.append(pattern_data)
+    
+    def _write_file(self, patterns: Dict[str, List[Pattern]]):
+        """Write the pattern file atomically, and its usage to the usage file; call with the exclusive file lock held."""
+        temp_path = f"{self.path}.{os.getpid()}.tmp"
+        data = dump_library(patterns, usage=False)
+        with open(temp_path, 'w') as f:
+            json.dump(data, f, indent=2)
+        os.replace(temp_path, self.path)
+        self._signature = self._file_signature()
+        self._fingerprints = self._fingerprints_of(data)
+        # The file now holds exactly these patterns, so usage of any others can go
+        self._write_usage(prune=True)
+    
+    def _read_usage(self) -> dict:
+        """The usage file's {category: {pattern key: [hits, last_used]}}; call with the file lock held."""
+        try:
+            with open(self.usage_path, 'r') as f:
+                usage = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            log(f"Error loading pattern usage: {e}", WARNING)
+            return {}
+        return usage if isinstance(usage, dict) else {}
+    
+    def _apply_usage(self, usage: dict):
+        """Take the higher hit counts and later uses saved in usage (see _read_usage)."""
+        for category, entries in self._patterns.items():
+            saved = usage.get(category)
+            if not saved:
+                continue
+            changed = False
+            for pattern_data in entries:
+                counts = saved.get(pattern_data.key)
+                if counts and (counts[0] > pattern_data.hits or counts[1] > pattern_data.last_used):
+                    pattern_data.hits = max(pattern_data.hits, counts[0])
+                    pattern_data.last_used = max(pattern_data.last_used, counts[1])
+                    changed = True
+            index = self._indexes.get(category)
+            if changed and index is not None:
+                index.usage_changed()
+    
+    def _write_usage(self, prune: bool):
+        """
+        Save hit counts and last uses to the usage file, taking in those other
+        processes saved there first; call with the exclusive file lock held.
+        
+        Args:
+            prune: Drop usage of patterns not stored here, because the pattern
+                file was just written from memory. Otherwise usage of patterns
+                another process saved since this store read the file is kept.
+        """
+        usage = self._read_usage()
+        self._apply_usage(usage)
+        if prune:
+            usage = {}
+        for category, entries in self._patterns.items():
+            counts = {p.key: [p.hits, p.last_used] for p in entries if p.hits or p.last_used}
+            if counts:
+                usage.setdefault(category, {}).update(counts)
+        self._usage_dirty = False
+        if not usage and not os.path.exists(self.usage_path):
+            return
+        temp_path = f"{self.usage_path}.{os.getpid()}.tmp"
+        with open(temp_path, 'w') as f:
+            json.dump(usage, f)
+        os.replace(temp_path, self.usage_path)
+    
+    @timed("save_patterns")
+    def save_patterns(self, merge: bool = True):
+        """
+        Save command patterns to file.
+        
+        Args:
+            merge: First take in what other processes saved since this store last
+                read the file (additions and removals), then add the patterns
+                stored here since, so concurrent assistants don't overwrite each
+                other's changes. Pass False (or assign `patterns`) to replace the
+                file's contents.
+        """
+        try:
+            with self._file_lock(exclusive=True):
+                if merge and not self._replace_on_save and self._file_signature() != self._signature:
+                    self._sync_from_disk()
+                self._write_file(self.patterns)
+                self._added = []
+                self._replace_on_save = False
+        except Exception as e:
+            log(f"Error saving command patterns: {e}", ERROR)
+    
+    def update_patterns(self, change: Callable[[Dict[str, List[Pattern]]], object]):
+        """
+        Change the library and save it while holding the file lock, so patterns
+        other processes saved are loaded first and removals aren't undone by a
+        later merge.
+        
+        Args:
+            change: Called with the patterns dict; edits it in place.
+            
+        Returns:
+            Whatever change returned.
+        """
+        with self._file_lock(exclusive=True):
+            if self._file_signature() != self._signature:
+                self._sync_from_disk()
+            result = change(self.patterns)
             try:
-                with open(COMMAND_STORE_FILE, 'r') as f:
-                    self.patterns = json.load(f)
+                self._write_file(self.patterns)
+                self._added = []
             except Exception as e:
-                log(f"Error loading command patterns: {e}")
-                self.patterns = {}
-        else:
-            self.patterns = {}
+                log(f"Error saving command patterns: {e}", ERROR)
+        return result
+    
+    def record_hit(self, pattern_data: Pattern):
+        """Count a match of a stored pattern; usage is saved in the background every USAGE_SAVE_INTERVAL seconds."""
+        hits, last_used = pattern_data.hits, pattern_data.last_used
+        pattern_data.record_use(time.time())
+        index = self._indexes.get(pattern_data.category)
+        if index is not None:
+            index.used(pattern_data, hits, last_used)
+        if not self._usage_dirty:
+            self._usage_dirty = True
+            _schedule_usage_save(self)
     
-    def save_patterns(self):
-        """Save command patterns to file."""
+    def flush_usage(self):
+        """
+        Save hit counts recorded since the last save (e.g. before exiting) to
+        the usage file. The pattern file is left alone, so patterns assigned
+        but not saved yet aren't written by a usage save.
+        """
+        if not self._usage_dirty:
+            return
         try:
-            with open(COMMAND_STORE_FILE, 'w') as f:
-                json.dump(self.patterns, f, indent=2)
+            with self._file_lock(exclusive=True):
+                self._write_usage(prune=False)
         except Exception as e:
-            log(f"Error saving command patterns: {e}")
+            log(f"Error saving pattern usage: {e}", ERROR)
+    
+    def _eviction_key(self, pattern_data: Pattern, position: int):
+        if self.eviction == "lru":
+            return pattern_data.last_used, pattern_data.hits, position
+        return pattern_data.hits, pattern_data.last_used, position
+    
+    def evict(self, capacity: Optional[int] = None) -> List[Pattern]:
+        """
+        Drop the coldest raw commands until at most `capacity` are stored, and
+        append them to archive_path if it is set.
+        
+        Args:
+            capacity: Defaults to the store's capacity.
+            
+        Returns:
+            The evicted patterns.
+        """
+        capacity = self.capacity if capacity is None else capacity
+        if capacity is None:
+            return []
+        
+        def drop_coldest(patterns):
+            raw = []
+            for entries in patterns.values():
+                for p in entries:
+                    if p.raw_command is not None and not p.variables:
+                        raw.append(p)
+            if len(raw) <= capacity:
+                return []
+            # Ties go to the command stored first
+            order = {id(p): position for position, p in enumerate(raw)}
+            raw.sort(key=lambda p: self._eviction_key(p, order[id(p)]))
+            evicted = raw[:len(raw) - capacity]
+            evicted_ids = {id(p) for p in evicted}
+            for category in {p.category for p in evicted}:
+                # A new list, so the category's match index is rebuilt
+                patterns[category] = [p for p in patterns[category] if id(p) not in evicted_ids]
+            return evicted
+        
+        evicted = self.update_patterns(drop_coldest)
+        if evicted:
+            log(f"Evicted {len(evicted)} cold stored command(s) ({self.eviction}, capacity {capacity})")
+            if self.archive_path:
+                self._archive(evicted)
+        return evicted
+    
+    def _archive(self, evicted: List[Pattern]):
+        now = time.time()
+        try:
+            with open(self.archive_path, "a") as f:
+                for pattern_data in evicted:
+                    entry = {"category": pattern_data.category, "evicted_at": now}
+                    entry.update(pattern_data.to_dict())
+                    f.write(json.dumps(entry) + "\n")
+        except OSError as e:
+            log(f"Could not archive evicted commands: {e}", ERROR)
+    
+    def _over_capacity(self) -> bool:
+        if self.capacity is None:
+            return False
+        raw = sum(1 for entries in self.patterns.values() for p in entries
+                  if p.raw_command is not None and not p.variables)
+        return raw > self.capacity
+    
+    def clear_patterns(self):
+        """Remove every stored pattern, including those saved by other processes."""
+        self.patterns = {}
+        self.save_patterns()
     
+    @timed("detect_category")
     def detect_category(self, command: str) -> str:
         """
         Automatically detect the category of a command based on keywords.
@@ -78,7 +579,7 @@ class CommandStore:
         # For commands we don't recognize, use a default category
         return "custom_command"
     
-    def extract_potential_variables(self, command: str, category: str) -> List[Dict[str, str]]:
+    def extract_potential_variables(self, command: str, category: str) -> List[Dict[str, object]]:
         """
         Extract potential variables from a command based on its category.
         
@@ -87,95 +588,35 @@ class CommandStore:
             category: The detected category.
             
         Returns:
-            List of dicts with potential variable names and values.
-        """
-        variables = []
-        
-        # Different extraction rules based on category
-        if category == "file_creation":
-            # Look for filenames in commands
-            filenames = re.findall(r'\b([\w\-\.]+\.(txt|doc|docx|pdf|csv|xlsx?|json|html?|css|js|py|java|cpp|c|go|rs|php))\b', command)
-            if filenames:
-                variables.append({
-                    "name": "filename",
-                    "value": filenames[0][0]  # Get the full filename, not just the extension
-                })
-        
-        elif category == "open_webpage":
-            # Look for URLs or domain names
-            urls = re.findall(r'\b(www\.[a-zA-Z0-9\-\.]+\.[a-zA-Z]{2,}|https?://[a-zA-Z0-9\-\.]+\.[a-zA-Z]{2,}|[a-zA-Z0-9\-\.]+\.(com|org|net|io|edu|gov))\b', command)
-            if urls:
-                variables.append({
-                    "name": "url",
-                    "value": urls[0][0] if isinstance(urls[0], tuple) else urls[0]
-                })
-        
-        elif category == "search_query":
-            # Try to extract search terms
-            search_terms = re.findall(r'(?:search for|find|look up|google|bing|search)(?:\s+for)?\s+"([^"]+)"', command)
-            if not search_terms:
-                # Try without quotes
-                match = re.search(r'(?:search for|find|look up|google|bing|search)(?:\s+for)?\s+(.+?)(?:\s+in|\s+on|\s+with|$)', command)
-                if match:
-                    search_terms = [match.group(1)]
-            
-            if search_terms:
-                variables.append({
-                    "name": "query",
-                    "value": search_terms[0]
-                })
-        
-        # Add more extraction rules for different categories as needed
-        
-        # If we couldn't find specific variables, look for any quoted text, paths, or numbers
-        if not variables:
-            # Quoted text
-            quotes = re.findall(r'"([^"]+)"', command)
-            if quotes:
-                variables.append({
-                    "name": "quoted_text",
-                    "value": quotes[0]
-                })
-            
-            # Paths
-            paths = re.findall(r'[a-zA-Z]:\\(?:[^\\/:*?"<>|\r\n]+\\)*[^\\/:*?"<>|\r\n]*', command)
-            if paths:
-                variables.append({
-                    "name": "path",
-                    "value": paths[0]
-                })
-            
-            # Numbers
-            numbers = re.findall(r'\b\d+\b', command)
-            if numbers:
-                variables.append({
-                    "name": "number",
-                    "value": numbers[0]
-                })
-            
-            # For search queries with no special pattern
-            if category == "search_query":
-                # Try to extract everything after "search for" or similar phrases
-                match = re.search(r'(?:search for|find|look up|google|search)\s+(.+?)(?:\s+in|\s+on|\s+with|$)', command.lower())
-                if match:
-                    variables.append({
-                        "name": "query",
-                        "value": match.group(1).strip()
-                    })
-        
-        return variables
+            List of dicts with the variable name, value and its start/end in the command,
+            one per value found; repeated names are numbered (filename, filename_2).
+        """
+        return [{"name": name, "value": value, "start": start, "end": end}
+                for name, value, start, end in self.extractors.extract(command, category)]
     
-    def create_pattern_from_command(self, command: str, variables: List[Dict[str, str]]) -> str:
+    def create_pattern_from_command(self, command: str, variables: List[Dict[str, object]]) -> str:
         """
         Create a pattern from a command by replacing variable parts with placeholders.
         
         Args:
             command: The user command.
-            variables: List of variable dictionaries with name and value.
+            variables: List of variable dictionaries with name and value, and
+                optionally the start/end of the value in the command.
             
         Returns:
             Pattern string with placeholders.
         """
+        if variables and all("start" in var for var in variables):
+            # Replace each value where it was found, in one pass
+            parts = []
+            cursor = 0
+            for var in sorted(variables, key=lambda var: var["start"]):
+                parts.append(command[cursor:var["start"]])
+                parts.append(f"{{{var['name']}}}")
+                cursor = var["end"]
+            parts.append(command[cursor:])
+            return "".join(parts)
+        
         pattern = command
         
         # Replace variable values with placeholders
@@ -187,7 +628,12 @@ class CommandStore:
         
         return pattern
     
-    def add_pattern(self, command: str, intent: dict, store_command: bool = False):
+    def _add(self, pattern_data: Pattern):
+        self.patterns[pattern_data.category].append(pattern_data)
+        self._added.append(pattern_data)
+    
+    @timed("add_pattern")
+    def add_pattern(self, command: str, intent: dict, store_command: bool = False) -> bool:
         """
         Add a new command pattern.
         
@@ -195,16 +641,27 @@ class CommandStore:
             command: The user command.
             intent: The parsed intent.
             store_command: Whether to store this command (defaults to False).
+            
+        Returns:
+            True if a new pattern was stored.
         """
+        # Generated code that is really a file operation is stored as the native intent
+        intent = native_intent(intent)
+        errors = validate_intent(intent)
+        if errors:
+            log(f"Not storing invalid intent for '{command}': {'; '.join(errors)}", WARNING)
+            return False
+
         if not store_command:
             # Only auto-store certain pattern types
             action = intent.get("action", "unknown")
-            if action == "create_file" or (action == "run_code" and "open(" in intent.get("code", "")):
+            # open_url is what webbrowser.open(...) code becomes (see code_shapes)
+            if action in ("create_file", "create_files", "open_url") or (action == "run_code" and "open(" in intent.get("code", "")):
                 # These are helpful to auto-store
                 pass
             else:
                 # Don't auto-store other patterns
-                return
+                return False
         
         # Detect the command category
         category = self.detect_category(command)
@@ -220,21 +677,20 @@ class CommandStore:
             # Store the exact command with its original intent
             pattern_exists = False
             for p in self.patterns[category]:
-                if p.get("raw_command") == command:
+                if p.raw_command == command:
                     pattern_exists = True
                     break
             
             if not pattern_exists:
-                self.patterns[category].append({
-                    "raw_command": command,
-                    "pattern": command,  # No variables, so pattern is the same as the command
-                    "intent_template": intent,
-                    "variables": []
-                })
+                # No variables, so pattern is the same as the command
+                # Counts as one use, so LFU eviction doesn't pick the newest command first
+                self._add(Pattern(category, command, intent, raw_command=command, hits=1, last_used=time.time()))
                 self.save_patterns()
                 log(f"Added raw command pattern: {command}")
                 print(f"✅ Stored command: {command}")
-            return
+                if self._over_capacity():
+                    self.evict()
+            return not pattern_exists
         
         # Create a pattern with placeholders for variables
         pattern = self.create_pattern_from_command(command, variables)
@@ -244,7 +700,7 @@ class CommandStore:
             if store_command:
                 log(f"Could not create a meaningful pattern for: {command}")
                 print(f"⚠️ Could not extract variables from command: {command}")
-            return
+            return False
         
         # Add the pattern to the appropriate category
         if category not in self.patterns:
@@ -253,7 +709,7 @@ class CommandStore:
         # Check if this pattern already exists
         pattern_exists = False
         for p in self.patterns[category]:
-            if p.get("pattern") == pattern:
+            if p.pattern == pattern:
                 pattern_exists = True
                 break
         
@@ -261,26 +717,16 @@ class CommandStore:
             # Get variable names and create the pattern data
             var_names = [var["name"] for var in variables]
             
-            # Create a template for the intent
-            intent_template = intent.copy()
-            
-            # Replace variable values in the intent template
-            for key, value in intent_template.items():
-                if isinstance(value, str):
-                    for var in variables:
-                        if var["value"] in value:
-                            intent_template[key] = value.replace(var["value"], f"{{{var['name']}}}")
+            # Create a template for the intent by replacing variable values with placeholders
+            intent_template = make_template(intent, {var["name"]: var["value"] for var in variables})
             
-            # Save the pattern
-            self.patterns[category].append({
-                "pattern": pattern,
-                "intent_template": intent_template,
-                "variables": var_names,
-                "example_command": command  # Store an example for reference
-            })
+            # Save the pattern, with an example for reference
+            self._add(Pattern(category, pattern, intent_template, var_names,
+                              example_command=command, hits=1, last_used=time.time()))
             self.save_patterns()
             log(f"Added {category} pattern: {pattern}")
             print(f"✅ Stored {category} pattern: {pattern}")
+        return not pattern_exists
     
     def similarity_score(self, s1: str, s2: str) -> float:
         """Calculate the similarity between two strings using sequence matching."""
@@ -332,18 +778,34 @@ class CommandStore:
         
         return combined_score
     
-    def find_best_raw_command_match(self, command: str, category: str) -> Optional[Tuple[dict, float]]:
-        """Find the best matching raw command in a category based on similarity."""
+    def find_best_raw_command_match(self, command: str, category: str,
+                                    stop: Optional[threading.Event] = None) -> Optional[Tuple[Pattern, float]]:
+        """
+        Find the best matching raw command in a category based on similarity.
+        Candidates are compared most used first, so among equally similar
+        commands the hottest wins, and the scan stops at a perfect score.
+        
+        Args:
+            command: The user command.
+            category: The category whose stored commands are compared.
+            stop: Give up (returning None) as soon as this is set.
+        """
         if category not in self.patterns:
             return None
         
         best_pattern = None
         best_score = 0
+        highest_score = 0
         
-        for pattern_data in self.patterns[category]:
-            if "raw_command" in pattern_data:
-                raw_command = pattern_data["raw_command"]
+        for pattern_data in self.category_index(category).ranked():
+            if best_score >= 1.0:
+                break
+            if stop is not None and stop.is_set():
+                return None
+            if pattern_data.raw_command is not None:
+                raw_command = pattern_data.raw_command
                 score = self.similarity_score(command, raw_command)
+                highest_score = max(highest_score, score)
                 
                 # Consider it a match if the similarity is high enough
                 # Lower the threshold further and check for common action words
@@ -352,19 +814,96 @@ class CommandStore:
                     best_pattern = pattern_data
             
             # Also try matching against example commands if they exist
-            elif "example_command" in pattern_data:
-                example_command = pattern_data["example_command"]
+            elif pattern_data.example_command is not None:
+                example_command = pattern_data.example_command
                 score = self.similarity_score(command, example_command)
+                highest_score = max(highest_score, score)
                 
                 if score > 0.65 and score > best_score:
                     best_score = score
                     best_pattern = pattern_data
         
+        FUZZY_SCORE.observe(highest_score, category=category)
+        
         if best_pattern:
             return best_pattern, best_score
         
         return None
     
+    def few_shot_candidates(self, command: str, scan: int = 200) -> List[Pattern]:
+        """
+        The stored patterns few_shot_examples compares a command with: the
+        `scan` most used ones in its category. Cheap, so it can be taken while
+        holding the store lock and scored after releasing it.
+        """
+        category = self.detect_category(command)
+        if category not in self.patterns:
+            return []
+        return self.category_index(category).ranked()[:scan]
+    
+    def few_shot_examples(self, command: str, limit: int = 3, scan: int = 200,
+                          candidates: Optional[List[Pattern]] = None) -> List[Tuple[str, dict]]:
+        """
+        Stored commands most similar to a command, with their intents, to show
+        the LLM as examples.
+        
+        Args:
+            command: The user command.
+            limit: Most examples to return.
+            scan: Most stored commands compared (the most used ones), so large
+                libraries don't slow the LLM path down.
+            candidates: Patterns from few_shot_candidates() to compare instead;
+                scoring them doesn't need the store lock.
+            
+        Returns:
+            (command, intent) pairs, most similar first.
+        """
+        if limit <= 0:
+            return []
+        if candidates is None:
+            candidates = self.few_shot_candidates(command, scan)
+        scored = []
+        for pattern_data in candidates:
+            if pattern_data.raw_command is not None:
+                example, intent = pattern_data.raw_command, pattern_data.render_intent({})
+            else:
+                example = pattern_data.example_command
+                match = pattern_data.regex().match(example)
+                if not match:
+                    continue
+                intent = pattern_data.render_intent(match.groupdict())
+            scored.append((self.similarity_score(command, example), example, intent))
+        scored.sort(key=lambda item: item[0], reverse=True)
+        return [(example, intent) for _, example, intent in scored[:limit]]
+    
+    def category_index(self, category: str) -> CategoryIndex:
+        """The trie and exact-command index for a category, updated for any patterns added since."""
+        patterns = self.patterns.get(category, [])
+        index = self._indexes.get(category)
+        if index is None:
+            index = CategoryIndex(patterns)
+        elif not index.is_current(patterns):
+            index = index.sync(patterns)
+        self._indexes[category] = index
+        return index
+    
+    def invalidate_indexes(self, category: Optional[str] = None):
+        """Drop cached indexes after editing pattern lists in place."""
+        if category is None:
+            self._indexes.clear()
+        else:
+            self._indexes.pop(category, None)
+    
+    def find_exact_command_match(self, command: str, categories: List[str]) -> Optional[Pattern]:
+        """Find a stored raw command that is identical to the command (ignoring case)."""
+        command_key = normalize_command(command)
+        for category in categories:
+            if category in self.patterns:
+                pattern_data = self.category_index(category).exact.get(command_key)
+                if pattern_data is not None:
+                    return pattern_data
+        return None
+    
     def match_command(self, command: str) -> Optional[Tuple[dict, Dict[str, str]]]:
         """
         Match a command against stored patterns.
@@ -375,6 +914,31 @@ class CommandStore:
         Returns:
             Tuple of (intent, variables) if a match is found, None otherwise.
         """
+        match = self.match_command_details(command)
+        if match:
+            return match["intent"], match["variables"]
+        return None
+    
+    @timed("match_command")
+    def match_command_details(self, command: str, on_slow_path: Optional[Callable[[], None]] = None,
+                              stop: Optional[threading.Event] = None) -> Optional[dict]:
+        """
+        Match a command against stored patterns and describe how it matched.
+        
+        Args:
+            command: The user command.
+            on_slow_path: Called once if matching gets past the exact and
+                pattern stages into the slower similarity and fallback stages.
+            stop: Give up (returning None) once this is set; checked during the
+                slow stages only.
+            
+        Returns:
+            Dict with the intent, extracted variables, category, matching stage
+            ("exact", "regex", "fuzzy" or "fallback"), the stored pattern and the
+            similarity score, or None if nothing matched.
+        """
+        self.check_for_changes()
+        
         # First, try to detect the command category
         primary_category = self.detect_category(command)
         
@@ -387,95 +951,109 @@ class CommandStore:
             if cat not in categories_to_check:
                 categories_to_check.append(cat)
         
+        exact_match = self._match_exact(command, categories_to_check, primary_category)
+        if exact_match:
+            return exact_match
+        
+        slow_path = False
+        
         # Try to match against patterns in each category to check
         for category in categories_to_check:
             if category in self.patterns:
                 # First try exact pattern matching
-                for pattern_data in self.patterns[category]:
-                    if "variables" not in pattern_data:
-                        continue
-                        
-                    pattern_str = pattern_data["pattern"]
-                    variables = pattern_data["variables"]
-                    
-                    # Skip raw commands (no variables)
-                    if not variables:
-                        continue
-                    
-                    # Convert pattern to regex with more flexible matching
-                    regex_pattern = re.escape(pattern_str)
-                    for var in variables:
-                        placeholder = re.escape(f"{{{var}}}")
-                        # Replace only the first occurrence to prevent redefinition of group name
-                        if placeholder in regex_pattern:
-                            regex_pattern = re.sub(placeholder, f"(?P<{var}>.+?)", regex_pattern, count=1)
-                    
-                    # Make matching more flexible
-                    # Allow any whitespace between words
-                    regex_pattern = regex_pattern.replace("\\ ", r"\s+")
-                    
-                    match = re.match(f"^{regex_pattern}$", command, re.IGNORECASE)
-                    if match:
-                        # Extract variables
-                        extracted_vars = match.groupdict()
-                        
-                        # Create intent using the template and extracted variables
-                        intent = pattern_data["intent_template"].copy()
-                        
-                        # Replace variables in all intent fields
-                        for key, value in intent.items():
-                            if isinstance(value, str):
-                                for var, var_value in extracted_vars.items():
-                                    if f"{{{var}}}" in value:
-                                        intent[key] = value.replace(f"{{{var}}}", var_value)
-                        
-                        return intent, extracted_vars
+                with span("match_command.regex"):
+                    result = self._match_category_patterns(command, category)
+                if result:
+                    PATTERN_MATCHES.inc(category=category, stage="regex", result="hit")
+                    return self._match_details(*result, category, "regex")
+                
+                if not slow_path:
+                    slow_path = True
+                    if on_slow_path is not None:
+                        on_slow_path()
+                if stop is not None and stop.is_set():
+                    PATTERN_MATCHES.inc(category=primary_category, stage="none", result="stopped")
+                    return None
                 
                 # If no exact match, try similarity matching for raw commands
-                raw_match = self.find_best_raw_command_match(command, category)
+                with span("match_command.fuzzy"):
+                    raw_match = self.find_best_raw_command_match(command, category, stop)
                 if raw_match:
                     pattern_data, score = raw_match
-                    log(f"Found similar command match with score {score}: {pattern_data['raw_command']}")
+                    matched_command = pattern_data.raw_command or pattern_data.example_command
+                    log(f"Found similar command match with score {score}: {matched_command}")
                     print(f"🔍 Using similar command match ({int(score*100)}% similar)")
-                    return pattern_data["intent_template"], {}
+                    PATTERN_MATCHES.inc(category=category, stage="fuzzy", result="hit")
+                    return self._match_details(pattern_data, pattern_data.render_intent({}), {}, category, "fuzzy", score)
+        
+        if not slow_path and on_slow_path is not None:
+            on_slow_path()
         
         # Try other categories as a fallback (commands might be miscategorized)
-        for other_category, patterns in self.patterns.items():
-            if other_category == category:
-                continue
-                
-            for pattern_data in patterns:
-                if "variables" not in pattern_data:
-                    continue
-                    
-                pattern_str = pattern_data["pattern"]
-                variables = pattern_data["variables"]
-                
-                # Skip raw commands in other categories
-                if not variables:
+        with span("match_command.regex"):
+            for other_category in self.patterns:
+                if other_category in categories_to_check:
                     continue
-                
-                # Convert pattern to regex
-                regex_pattern = re.escape(pattern_str)
-                for var in variables:
-                    placeholder = re.escape(f"{{{var}}}")
-                    # Replace only the first occurrence to prevent redefinition of group name
-                    if placeholder in regex_pattern:
-                        regex_pattern = re.sub(placeholder, f"(?P<{var}>.+?)", regex_pattern, count=1)
-                
-                match = re.match(f"^{regex_pattern}$", command)
-                if match:
-                    # Found a match in another category
-                    extracted_vars = match.groupdict()
-                    intent = pattern_data["intent_template"].copy()
-                    
-                    for key, value in intent.items():
-                        if isinstance(value, str):
-                            for var, var_value in extracted_vars.items():
-                                if f"{{{var}}}" in value:
-                                    intent[key] = value.replace(f"{{{var}}}", var_value)
-                    
-                    return intent, extracted_vars
+                if stop is not None and stop.is_set():
+                    PATTERN_MATCHES.inc(category=primary_category, stage="none", result="stopped")
+                    return None
+                result = self._match_category_patterns(command, other_category, flexible=False)
+                if result:
+                    PATTERN_MATCHES.inc(category=other_category, stage="fallback", result="hit")
+                    return self._match_details(*result, other_category, "fallback")
         
         # No pattern match found
-        return None
\ No newline at end of file
+        PATTERN_MATCHES.inc(category=primary_category, stage="none", result="miss")
+        return None
+    
+    def _match_exact(self, command: str, categories: List[str], primary_category: str) -> Optional[dict]:
+        """
+        The exact stage: a command already stored verbatim (ignoring case and
+        spacing) needs no pattern matching at all.
+        
+        Returns:
+            The match details, or None if no stored command is identical.
+        """
+        with span("match_command.exact"):
+            exact_match = self.find_exact_command_match(command, categories)
+        if exact_match is None:
+            return None
+        log(f"Found exact stored command: {exact_match.raw_command}")
+        PATTERN_MATCHES.inc(category=primary_category, stage="exact", result="hit")
+        return self._match_details(exact_match, exact_match.render_intent({}), {}, primary_category, "exact")
+    
+    def _match_details(self, pattern_data: Pattern, intent: dict, variables: Dict[str, str], category: str,
+                       stage: str, score: float = 1.0) -> dict:
+        self.record_hit(pattern_data)
+        return {
+            "intent": intent,
+            "variables": variables,
+            "category": category,
+            "stage": stage,
+            "pattern": pattern_data.key,
+            "score": score,
+        }
+    
+    def _match_category_patterns(self, command: str, category: str,
+                                 flexible: bool = True) -> Optional[Tuple[Pattern, dict, Dict[str, str]]]:
+        """
+        Match a command against the variable patterns of one category, using the
+        category's pattern trie.
+        
+        Args:
+            command: The user command.
+            category: The category whose patterns should be tried.
+            flexible: Match case-insensitively and allow any whitespace between words.
+            
+        Returns:
+            Tuple of (pattern, intent, variables) if a pattern matches, None otherwise.
+        """
+        if category not in self.patterns:
+            return None
+        for pattern_data, extracted_vars in self.category_index(category).trie.match_all(command):
+            # The trie matches like the flexible regex; strict matching also needs exact case and spacing
+            if flexible or pattern_data.regex(flexible=False).match(command):
+                # Create intent using the template and extracted variables
+                return pattern_data, pattern_data.render_intent(extracted_vars), extracted_vars
+        
+        return None
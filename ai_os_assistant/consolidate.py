@@ -0,0 +1,313 @@
+"""
+Consolidation of the pattern library.
+
+Most LLM-handled prompts are stored as separate raw commands, so the library
+keeps growing and fuzzy matching has to scan all of it. A consolidation pass:
+
+1. drops raw commands that an existing variable pattern of their category
+   already matches with the same intent, adding their hits to that pattern;
+2. clusters the remaining raw commands that are similar (similarity_score),
+   infers placeholders from the words where they differ, and replaces each
+   cluster with one variable pattern whose hits are the sum of its members'.
+
+A merge is only made when the inferred intent template reproduces every
+member's stored intent exactly, so the library answers every command it
+answered before.
+
+Usage:
+    python consolidate.py --dry-run
+    python consolidate.py --threshold 0.75
+
+The daemon (and main.py with --consolidate-interval) runs a pass in the
+background every few minutes.
+"""
+import argparse
+import threading
+from dataclasses import dataclass, field
+from difflib import SequenceMatcher
+from typing import Dict, List, Optional, Tuple
+
+from patterns import Pattern
+from pattern_trie import PatternTrie
+from templates import compile_template, make_template
+from utils import log, ERROR
+
+# Raw commands at least this similar (CommandStore.similarity_score) are clustered.
+# Lower than the fuzzy-match threshold because every merge is checked against
+# the members' stored intents.
+MERGE_THRESHOLD = 0.5
+
+# Most placeholders an inferred pattern may have
+MAX_PLACEHOLDERS = 2
+
+# Stop comparing pairs in a category after this many, to bound a pass on huge libraries
+MAX_COMPARISONS = 200000
+
+
+@dataclass
+class Merge:
+    """One change made by a consolidation pass."""
+    category: str
+    # Pattern that now answers the members' commands
+    pattern: Pattern
+    # Raw commands it replaces
+    members: List[Pattern] = field(default_factory=list)
+    # True if the pattern was already in the library
+    existing: bool = False
+
+
+def _skeleton(first: List[str], second: List[str]) -> Optional[List[Optional[str]]]:
+    """
+    The words two commands share, in order, with None for each run of words
+    where they differ. None if a word appears in only one of them, since a
+    placeholder can't be empty.
+    """
+    opcodes = SequenceMatcher(None, [w.lower() for w in first], [w.lower() for w in second],
+                              autojunk=False).get_opcodes()
+    skeleton = []
+    for tag, i1, i2, _, _ in opcodes:
+        if tag == "equal":
+            skeleton.extend(first[i1:i2])
+        elif tag == "replace":
+            if not skeleton or skeleton[-1] is not None:
+                skeleton.append(None)
+        else:
+            return None
+    return skeleton
+
+
+def _explains(pattern: Pattern, command: Pattern, render) -> bool:
+    """Whether the pattern matches the raw command and renders its exact intent."""
+    match = pattern.regex().match(command.raw_command)
+    return bool(match) and render(match.groupdict()) == command.render_intent({})
+
+
+class Consolidator:
+    """
+    Merge raw commands in a CommandStore into variable patterns.
+
+    Example:
+        Consolidator(store).run_once()
+        Consolidator(store, interval=600).start()   # in the background
+    """
+
+    def __init__(self, store, threshold: float = MERGE_THRESHOLD, interval: Optional[float] = None):
+        """
+        Args:
+            store: The CommandStore to consolidate.
+            threshold: Minimum similarity_score for two raw commands to be clustered.
+            interval: Seconds between background passes (see start()).
+        """
+        self.store = store
+        self.threshold = threshold
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def plan(self, patterns: Dict[str, List[Pattern]]) -> List[Merge]:
+        """Work out the merges for a library without changing it."""
+        merges = []
+        for category, entries in patterns.items():
+            raws = [p for p in entries if p.raw_command and not p.variables]
+            if not raws:
+                continue
+            templates = [p for p in entries if p.variables]
+            raws, absorbed = self._absorb(category, raws, templates)
+            merges.extend(absorbed)
+            merges.extend(self._cluster(category, raws))
+        return merges
+
+    def _absorb(self, category: str, raws: List[Pattern], templates: List[Pattern]) -> Tuple[List[Pattern], List[Merge]]:
+        """Find raw commands that existing variable patterns already answer."""
+        trie = PatternTrie()
+        for template in templates:
+            trie.add(template)
+        merges = {}
+        remaining = []
+        for raw in raws:
+            intent = raw.render_intent({})
+            for template, variables in trie.match_all(raw.raw_command):
+                if template.render_intent(variables) == intent:
+                    merge = merges.setdefault(id(template), Merge(category, template, existing=True))
+                    merge.members.append(raw)
+                    break
+            else:
+                remaining.append(raw)
+        return remaining, list(merges.values())
+
+    def _cluster(self, category: str, raws: List[Pattern]) -> List[Merge]:
+        # Only commands that start or end with the same word are compared
+        buckets = {}
+        words = {}
+        for raw in raws:
+            words[id(raw)] = raw.raw_command.split()
+            tokens = words[id(raw)]
+            if tokens:
+                buckets.setdefault(("first", tokens[0].lower()), []).append(raw)
+                buckets.setdefault(("last", tokens[-1].lower()), []).append(raw)
+
+        merged = set()
+        merges = []
+        comparisons = 0
+        for first in raws:
+            if id(first) in merged:
+                continue
+            tokens = words[id(first)]
+            if not tokens:
+                continue
+            seen = set()
+            for key in (("first", tokens[0].lower()), ("last", tokens[-1].lower())):
+                for second in buckets.get(key, []):
+                    if second is first or id(second) in merged or id(second) in seen:
+                        continue
+                    seen.add(id(second))
+                    comparisons += 1
+                    if comparisons > MAX_COMPARISONS:
+                        return merges
+                    if self.store.similarity_score(first.raw_command, second.raw_command) < self.threshold:
+                        continue
+                    merge = self._merge_pair(category, first, second, raws, merged)
+                    if merge:
+                        merges.append(merge)
+                        merged.update(id(member) for member in merge.members)
+                        break
+                if id(first) in merged:
+                    break
+        return merges
+
+    def _merge_pair(self, category: str, first: Pattern, second: Pattern, raws: List[Pattern],
+                    merged: set) -> Optional[Merge]:
+        tokens = first.raw_command.split()
+        skeleton = _skeleton(tokens, second.raw_command.split())
+        if skeleton is None:
+            return None
+        placeholders = skeleton.count(None)
+        literals = len(skeleton) - placeholders
+        if not 1 <= placeholders <= MAX_PLACEHOLDERS or literals < placeholders:
+            return None
+
+        # Name each placeholder after the extractor that recognises its value in the first command
+        literal_pattern = Pattern(category, " ".join("{_%d}" % i if word is None else word
+                                                     for i, word in enumerate(skeleton)),
+                                  {}, ["_%d" % i for i, word in enumerate(skeleton) if word is None])
+        match = literal_pattern.regex().match(first.raw_command)
+        if not match:
+            return None
+        names = {}
+        text = []
+        for i, word in enumerate(skeleton):
+            if word is not None:
+                text.append(word)
+                continue
+            value = match.group(f"_{i}")
+            candidates = self.store.extractors.extract(value, category)
+            name = candidates[0].name if len(candidates) == 1 and candidates[0].value == value else "value"
+            numbered = name
+            count = 2
+            while numbered in names.values():
+                numbered = f"{name}_{count}"
+                count += 1
+            names[f"_{i}"] = numbered
+            text.append(f"{{{numbered}}}")
+
+        values = {names[key]: value for key, value in match.groupdict().items()}
+        template = make_template(first.render_intent({}), values)
+        pattern = Pattern(category, " ".join(text), template, list(names.values()),
+                          example_command=first.raw_command)
+        render = compile_template(template, pattern.variables)
+
+        members = [raw for raw in raws
+                   if id(raw) not in merged and _explains(pattern, raw, render)]
+        if len(members) < 2 or not any(member is first for member in members):
+            return None
+        pattern.hits = sum(max(member.hits, 1) for member in members)
+        pattern.last_used = max(member.last_used for member in members)
+        return Merge(category, pattern, members)
+
+    def run_once(self, dry_run: bool = False) -> List[Merge]:
+        """
+        Run one consolidation pass and save the result.
+
+        Args:
+            dry_run: Only report what would be merged.
+
+        Returns:
+            The merges made (or planned, for a dry run).
+        """
+        with self.store.lock:
+            snapshot = {category: list(entries) for category, entries in self.store.patterns.items()}
+        merges = self.plan(snapshot)
+        if dry_run or not merges:
+            return merges
+
+        def apply(patterns):
+            for merge in merges:
+                entries = patterns.get(merge.category, [])
+                removed = {member.key for member in merge.members}
+                kept = [p for p in entries if not (p.raw_command and not p.variables and p.key in removed)]
+                absorbed = len(entries) - len(kept)
+                if not absorbed:
+                    continue
+                if merge.existing:
+                    for p in kept:
+                        if p.key == merge.pattern.key:
+                            p.hits += sum(max(member.hits, 1) for member in merge.members)
+                            p.last_used = max([p.last_used] + [member.last_used for member in merge.members])
+                            break
+                elif all(p.key != merge.pattern.key for p in kept):
+                    kept.append(merge.pattern)
+                # A new list, so the category's match index is rebuilt
+                patterns[merge.category] = kept
+
+        with self.store.lock:
+            self.store.update_patterns(apply)
+        for merge in merges:
+            log(f"Consolidated {len(merge.members)} raw command(s) in {merge.category} into: {merge.pattern.pattern}")
+        return merges
+
+    def start(self) -> "Consolidator":
+        """Run a pass every `interval` seconds on a background thread."""
+        if not self.interval:
+            raise ValueError("start() needs an interval")
+        self._thread = threading.Thread(target=self._run, name="consolidate-patterns", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.run_once()
+            except Exception as e:
+                log(f"Pattern consolidation failed: {e}", ERROR)
+
+
+def main(argv=None):
+    from command_store import COMMAND_STORE_FILE, CommandStore
+
+    parser = argparse.ArgumentParser(description="Merge similar stored commands into variable patterns")
+    parser.add_argument("--path", default=COMMAND_STORE_FILE, help="Pattern library (default: %(default)s)")
+    parser.add_argument("--threshold", type=float, default=MERGE_THRESHOLD,
+                        help="Minimum similarity for commands to be merged (default: %(default)s)")
+    parser.add_argument("--dry-run", action="store_true", help="Show the merges without saving them")
+    args = parser.parse_args(argv)
+
+    store = CommandStore(args.path, refresh_interval=None)
+    before = sum(len(entries) for entries in store.patterns.values())
+    merges = Consolidator(store, args.threshold).run_once(dry_run=args.dry_run)
+    for merge in merges:
+        target = "existing pattern" if merge.existing else "new pattern"
+        print(f"[{merge.category}] {target}: {merge.pattern.pattern}")
+        for member in merge.members:
+            print(f"    - {member.raw_command}")
+    removed = sum(len(merge.members) for merge in merges) - sum(not merge.existing for merge in merges)
+    verb = "Would shrink" if args.dry_run else "Shrank"
+    print(f"{verb} the library from {before} to {before - removed} patterns")
+
+
+if __name__ == "__main__":
+    main()
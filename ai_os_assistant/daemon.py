@@ -0,0 +1,309 @@
+"""
+Long-running assistant server for assistant_client.py.
+
+Keeps one CommandStore, the Ollama HTTP session and everything imported for
+them warm in a single process and accepts commands over a Unix domain socket
+(or 127.0.0.1:PORT where Unix sockets aren't available).
+
+Usage:
+    python daemon.py [--address PATH|HOST:PORT]
+    python assistant_client.py "Create a file named notes.txt"
+
+Protocol: one JSON object per line in each direction.
+    {"id": 1, "op": "handle", "prompt": "..."}
+        -> {"id": 1, "ok": true, "result": {AssistantResult fields}, "output": "printed text"}
+    {"id": 2, "op": "ping"}      -> {"id": 2, "ok": true, "status": "..."}
+    {"id": 3, "op": "shutdown"}  -> {"id": 3, "ok": true, "status": "stopping"}
+
+Connections are served concurrently with asyncio and prompts run on a thread
+pool, so a slow LLM call from one shell doesn't hold up the others. Each
+connection has its own Assistant (for "store last" / "no store") while all of
+them share the daemon's CommandStore, so patterns learned from any client are
+matched for every client.
+"""
+import argparse
+import asyncio
+import contextvars
+import io
+import json
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import asdict
+from typing import Optional
+
+from assistant import Assistant, SpeculationPolicy
+from assistant_client import connect, default_address, tcp_address
+from command_store import CommandStore
+from main import show_resolved
+from utils import log, flush_log, ERROR
+
+# Longest request line accepted from a client
+MAX_REQUEST_BYTES = 1024 * 1024
+
+
+class _ThreadOutput(io.TextIOBase):
+    """
+    Stand-in for sys.stdout that gives each request its own capture buffer.
+    The buffer lives in a context variable, so threads started with a copy of
+    the request's context (the steps of a multi intent, the speculative LLM
+    call) write to it too.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self._buffer = contextvars.ContextVar("output_buffer", default=None)
+
+    def write(self, text):
+        return (self._buffer.get() or self.stream).write(text)
+
+    def flush(self):
+        if self._buffer.get() is None:
+            self.stream.flush()
+
+    @contextmanager
+    def capture(self):
+        buffer = io.StringIO()
+        token = self._buffer.set(buffer)
+        try:
+            yield buffer
+        finally:
+            self._buffer.reset(token)
+
+
+class AssistantDaemon:
+    """
+    Serve assistant requests from local clients.
+
+    Example:
+        daemon = AssistantDaemon("/tmp/assistant.sock").start()
+        ...
+        daemon.stop()
+    """
+
+    def __init__(self, address: Optional[str] = None, command_store: Optional[CommandStore] = None,
+                 execute: bool = True, workers: int = 8, speculation: Optional[SpeculationPolicy] = None,
+                 few_shot: int = 0):
+        """
+        Args:
+            address: Socket path or HOST:PORT; defaults to assistant_client.default_address().
+            command_store: Store shared by every connection; loads the default file if omitted.
+            execute: Dispatch intents. Set to False to only resolve them.
+            workers: Prompts handled at the same time.
+            speculation, few_shot: Passed to each connection's Assistant.
+        """
+        self.address = address or default_address()
+        self.command_store = command_store if command_store is not None else CommandStore()
+        self.execute = execute
+        self.workers = workers
+        self.speculation = speculation
+        self.few_shot = few_shot
+        self.connections = 0
+        self.handled = 0
+        self._executor = None
+        self._output = None
+        self._loop = None
+        self._stopping = None
+        self._ready = threading.Event()
+        self._thread = None
+
+    async def serve(self):
+        """Serve until stop() is called or a client sends "shutdown"."""
+        self._loop = asyncio.get_running_loop()
+        self._stopping = asyncio.Event()
+        server = await self._start_server()
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="assistant-daemon")
+        # Output printed while handling a prompt is sent back to the client that sent it
+        self._output = _ThreadOutput(sys.stdout)
+        original_stdout, sys.stdout = sys.stdout, self._output
+        try:
+            async with server:
+                log(f"Assistant daemon listening on {self.address}")
+                self._ready.set()
+                await self._stopping.wait()
+        finally:
+            sys.stdout = original_stdout
+            self._executor.shutdown(wait=False)
+            if tcp_address(self.address) is None:
+                self._remove_socket_file()
+            log("Assistant daemon stopped.")
+            flush_log()
+
+    async def _start_server(self):
+        tcp = tcp_address(self.address)
+        if tcp is not None:
+            return await asyncio.start_server(self._handle_connection, tcp[0], tcp[1], limit=MAX_REQUEST_BYTES)
+        if os.path.exists(self.address):
+            self._check_stale_socket()
+        server = await asyncio.start_unix_server(self._handle_connection, self.address, limit=MAX_REQUEST_BYTES)
+        # Commands run with the user's permissions, so only the user may connect
+        os.chmod(self.address, 0o600)
+        return server
+
+    def _check_stale_socket(self):
+        try:
+            connect(self.address, timeout=1).close()
+        except OSError:
+            # Left behind by a daemon that didn't shut down cleanly
+            self._remove_socket_file()
+            return
+        raise RuntimeError(f"An assistant daemon is already running on {self.address}")
+
+    def _remove_socket_file(self):
+        try:
+            os.unlink(self.address)
+        except FileNotFoundError:
+            pass
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        # Per-connection state ("store last", "no store"), shared pattern store
+        assistant = Assistant(self.command_store, execute=self.execute, on_resolved=show_resolved,
+                              speculation=self.speculation, few_shot=self.few_shot)
+        self.connections += 1
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    await self._send(writer, {"ok": False, "error": "request too long"})
+                    break
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                    if not isinstance(request, dict):
+                        raise ValueError("expected a JSON object")
+                except ValueError as e:
+                    await self._send(writer, {"ok": False, "error": f"invalid request: {e}"})
+                    continue
+                response = await self._respond(assistant, request)
+                response["id"] = request.get("id")
+                await self._send(writer, response)
+        except (ConnectionResetError, BrokenPipeError):
+            pass
+        except asyncio.CancelledError:
+            # Connections still open when the daemon stops end here
+            pass
+        finally:
+            self.connections -= 1
+            writer.close()
+
+    async def _send(self, writer: asyncio.StreamWriter, response: dict):
+        writer.write(json.dumps(response, default=str).encode("utf-8") + b"\n")
+        await writer.drain()
+
+    async def _respond(self, assistant: Assistant, request: dict) -> dict:
+        op = request.get("op", "handle")
+        if op == "ping":
+            return {"ok": True, "status": f"running (pid {os.getpid()}, {self.connections} client(s), "
+                                          f"{self.handled} prompt(s) handled)"}
+        if op == "shutdown":
+            self._stopping.set()
+            return {"ok": True, "status": "stopping"}
+        if op != "handle" or not isinstance(request.get("prompt"), str):
+            return {"ok": False, "error": f"unsupported request: {op}"}
+
+        try:
+            result, output = await self._loop.run_in_executor(
+                self._executor, self._handle_prompt, assistant, request["prompt"])
+        except Exception as e:
+            log(f"Daemon failed to handle '{request['prompt']}': {e}", ERROR)
+            return {"ok": False, "error": str(e)}
+        self.handled += 1
+        return {"ok": True, "result": asdict(result), "output": output}
+
+    def _handle_prompt(self, assistant: Assistant, prompt: str):
+        with self._output.capture() as output:
+            result = assistant.handle(prompt)
+        return result, output.getvalue()
+
+    def start(self, timeout: float = 10.0) -> "AssistantDaemon":
+        """Serve from a background thread; returns once the socket is listening."""
+        self._thread = threading.Thread(target=asyncio.run, args=(self.serve(),), name="assistant-daemon", daemon=True)
+        self._thread.start()
+        if not self._ready.wait(timeout):
+            raise RuntimeError(f"Assistant daemon did not start on {self.address}")
+        return self
+
+    def stop(self):
+        if self._loop is not None and self._stopping is not None and not self._loop.is_closed():
+            try:
+                self._loop.call_soon_threadsafe(self._stopping.set)
+            except RuntimeError:
+                # Already stopped by a client's "shutdown" request
+                pass
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the assistant as a long-lived local server")
+    parser.add_argument("--address", default=None,
+                        help="Socket path or HOST:PORT (default: $AI_ASSISTANT_SOCKET or a per-user socket)")
+    parser.add_argument("--workers", type=int, default=8, help="Prompts handled at the same time")
+    parser.add_argument("--metrics-port", type=int, default=None,
+                        help="Serve Prometheus metrics on http://127.0.0.1:PORT/metrics")
+    parser.add_argument("--consolidate-interval", type=float, default=None,
+                        help="Merge similar stored commands into patterns every N seconds in the background")
+    parser.add_argument("--max-commands", type=int, default=None,
+                        help="Most raw commands to keep stored; the coldest ones are evicted")
+    parser.add_argument("--eviction", choices=["lfu", "lru"], default="lfu",
+                        help="Evict the least frequently or least recently used commands (default: %(default)s)")
+    parser.add_argument("--archive", default=None, help="Append evicted commands to this JSON-lines file")
+    parser.add_argument("--speculate", type=float, nargs="?", const=0.8, default=None, metavar="MIN_SCORE",
+                        help="Ask the LLM while slow similarity matching runs; matches scoring at least "
+                             "MIN_SCORE (default 0.8) cancel it")
+    parser.add_argument("--few-shot", type=int, default=0, metavar="N",
+                        help="Show the LLM the N most similar stored commands as examples")
+    parser.add_argument("--trace", action="store_true",
+                        help="Write per-prompt stage timings (including the prompt text) to ai_assistant_trace.jsonl")
+    parser.add_argument("--no-watch", action="store_true",
+                        help="Check the pattern file for other processes' changes on each match instead of "
+                             "reloading them as soon as it changes")
+    args = parser.parse_args(argv)
+
+    if args.trace:
+        from tracing import set_tracing
+        set_tracing(True)
+
+    command_store = CommandStore(capacity=args.max_commands, eviction=args.eviction, archive_path=args.archive)
+    speculation = SpeculationPolicy(args.speculate) if args.speculate is not None else None
+    daemon = AssistantDaemon(args.address, command_store, workers=args.workers, speculation=speculation,
+                             few_shot=args.few_shot)
+    # Warm up the LLM client now rather than on the first prompt that needs it,
+    # and have Ollama load the model while the daemon starts
+    import llm_agent
+    llm_agent.warm_up(background=True)
+
+    if args.metrics_port is not None:
+        from metrics import start_metrics_server, watch_command_store
+        watch_command_store(daemon.command_store)
+        server = start_metrics_server(args.metrics_port)
+        print(f"Metrics available at http://127.0.0.1:{server.server_address[1]}/metrics")
+
+    if args.consolidate_interval:
+        from consolidate import Consolidator
+        Consolidator(daemon.command_store, interval=args.consolidate_interval).start()
+
+    if not args.no_watch:
+        daemon.command_store.watch()
+
+    print(f"AI OS Assistant daemon listening on {daemon.address}. Stop it with Ctrl+C or "
+          f"'python assistant_client.py --shutdown'.")
+    try:
+        asyncio.run(daemon.serve())
+    except KeyboardInterrupt:
+        pass
+    except RuntimeError as e:
+        print(f"!! {e}")
+        return 1
+    finally:
+        command_store.stop_watching()
+        command_store.flush_usage()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,44 +1,449 @@
+"""
+Running intents.
 
-from file_manager import rename_files, sort_files, create_file
-from llm_agent import generate_code_for_action
-from utils import log
+Each action maps to a handler in the ACTIONS registry, a function taking the
+intent. Handlers may be coroutine functions (run on a shared event loop
+thread) and may have a batch form that takes several intents at once, used by
+dispatch_batch() for runs of intents with the same action. Actions without a
+handler fall back to asking the LLM for code.
 
-def dispatch_command(intent: dict, user_prompt: str = "", from_pattern: bool = False):
+Plugins add actions through the "ai_os_assistant.actions" entry point group.
+Each entry point is a function called with the registry, loaded the first time
+an action has no handler:
+
+    # the plugin's pyproject.toml
+    [project.entry-points."ai_os_assistant.actions"]
+    launch_app = "my_plugin:register"
+
+    # my_plugin.py
+    def register(actions):
+        actions.register("launch_app", launch_app, Field("name"))
+"""
+import contextvars
+import functools
+import inspect
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, List, NamedTuple, Optional, Set, Tuple
+from file_manager import (rename_files, sort_files, create_file, create_files, create_directory, delete_file,
+                          delete_directory, open_url)
+from utils import log, ERROR
+from tracing import timed
+from metrics import DISPATCH_OUTCOMES, DISPATCH_LATENCY
+from intents import MULTI_ACTION, Field, SCHEMAS, SchemaRegistry, validate_intent
+from code_shapes import native_intent
+
+# Entry point group for action plugins
+PLUGIN_GROUP = "ai_os_assistant.actions"
+
+# Most steps of a multi intent run at once
+MAX_WORKERS = 8
+
+# Globals generated code runs with; copied for each run so runs don't share state
+SAFE_GLOBALS = {"__builtins__": __builtins__, "open": open, "range": range, "print": print}
+
+
+class Action(NamedTuple):
+    name: str
+    handler: Callable[[dict], object]
+    # Runs several intents of this action at once; None to run them one by one
+    batch: Optional[Callable[[List[dict]], object]] = None
+    # Fields holding the paths the action reads or writes (a path or a list of
+    # them), used to order the steps of a multi intent; None if unknown, which
+    # makes the action wait for every earlier step and block every later one
+    paths: Optional[Tuple[str, ...]] = None
+
+
+class ActionRegistry:
+    def __init__(self, schemas: SchemaRegistry = SCHEMAS):
+        self.schemas = schemas
+        self._actions = {}
+        self._plugins_loaded = False
+        self._plugins_lock = threading.Lock()
+        self._loop = None
+        self._loop_lock = threading.Lock()
+
+    def register(self, action: str, handler: Callable[[dict], object], *fields: Field,
+                 batch: Optional[Callable[[List[dict]], object]] = None, paths: Optional[Tuple[str, ...]] = None):
+        """
+        Add (or replace) the handler for an action.
+
+        Args:
+            action: The intent's "action" value.
+            handler: Function (or coroutine function) taking the intent.
+            fields: The intent's fields, registered as the action's schema. The
+                built-in actions' schemas are in intents.py.
+            batch: Function (or coroutine function) taking a list of intents.
+            paths: Names of the fields holding the paths the action touches;
+                () for none, None if they can't be told from the intent.
+        """
+        if fields:
+            self.schemas.register(action, *fields)
+        self._actions[action] = Action(action, handler, batch, None if paths is None else tuple(paths))
+
+    def __contains__(self, action) -> bool:
+        return action in self._actions
+
+    def actions(self) -> List[str]:
+        return list(self._actions)
+
+    def get(self, action: str) -> Optional[Action]:
+        """The action's handler, loading the plugins first if it has none."""
+        entry = self._actions.get(action)
+        if entry is None and not self._plugins_loaded:
+            self.load_plugins()
+            entry = self._actions.get(action)
+        return entry
+
+    def load_plugins(self):
+        """Call every registration function in the PLUGIN_GROUP entry points, once."""
+        with self._plugins_lock:
+            if self._plugins_loaded:
+                return
+            self._plugins_loaded = True
+            # Deferred so startup doesn't pay for scanning installed packages
+            from importlib.metadata import entry_points
+            for entry_point in entry_points(group=PLUGIN_GROUP):
+                try:
+                    entry_point.load()(self)
+                    log(f"Loaded action plugin: {entry_point.name}")
+                except Exception as e:
+                    log(f"!! Could not load action plugin '{entry_point.name}': {e}", ERROR)
+
+    def call(self, function: Callable, argument):
+        """Call a handler, running coroutine functions on the registry's event loop."""
+        if not inspect.iscoroutinefunction(function):
+            return function(argument)
+        # asyncio is only imported once an async handler runs; it is slow to import
+        import asyncio
+        return asyncio.run_coroutine_threadsafe(function(argument), self._event_loop()).result()
+
+    def _event_loop(self) -> "asyncio.AbstractEventLoop":
+        import asyncio
+        with self._loop_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name="async-actions", daemon=True).start()
+            return self._loop
+
+
+ACTIONS = ActionRegistry()
+
+
+def register_action(action: str, *fields: Field, batch: Optional[Callable[[List[dict]], object]] = None,
+                    paths: Optional[Tuple[str, ...]] = None):
+    """
+    Decorator adding a handler to the default registry.
+
+        @register_action("launch_app", Field("name"))
+        def launch_app(intent):
+            subprocess.Popen([intent["name"]])
+    """
+    def decorator(handler):
+        ACTIONS.register(action, handler, *fields, batch=batch, paths=paths)
+        return handler
+    return decorator
+
+
+@functools.lru_cache(maxsize=256)
+def _compile_code(code: str):
+    # Stored patterns replay the same code, so it is compiled once
+    return compile(code, "<generated code>", "exec")
+
+
+def run_code(code: str):
+    exec(_compile_code(code), dict(SAFE_GLOBALS))
+
+
+def _rename_files(intent: dict):
+    log(f"Renaming files in directory: {intent['directory']}")
+    rename_files(intent["directory"], intent.get("pattern"))
+
+
+def _sort_files(intent: dict):
+    log(f"Sorting files in directory: {intent['directory']} by {intent.get('group_by')}")
+    sort_files(intent["directory"], intent.get("file_type"), intent.get("group_by"))
+
+
+def _create_file(intent: dict):
+    log(f"Creating file: {intent['filename']}")
+    create_file(intent["filename"], intent.get("content", ""))
+
+
+def _create_files(intents: List[dict]):
+    log(f"Creating {len(intents)} files: {', '.join(intent['filename'] for intent in intents)}")
+    create_files([(intent["filename"], intent.get("content", "")) for intent in intents])
+
+
+def _create_file_list(intent: dict):
+    log(f"Creating files: {', '.join(intent['filenames'])}")
+    create_files([(filename, "") for filename in intent["filenames"]])
+
+
+def _create_directory(intent: dict):
+    log(f"Creating folder: {intent['directory']}")
+    create_directory(intent["directory"], intent.get("exist_ok", True), intent.get("parents", True))
+
+
+def _delete_file(intent: dict):
+    log(f"Deleting file: {intent['filename']}")
+    delete_file(intent["filename"])
+
+
+def _delete_directory(intent: dict):
+    log(f"Deleting folder: {intent['directory']}")
+    delete_directory(intent["directory"], intent.get("recursive", True))
+
+
+def _open_url(intent: dict):
+    log(f"Opening URL: {intent['url']}")
+    open_url(intent["url"])
+
+
+def _run_code(intent: dict):
+    code = intent["code"]
+    log(f"Running generated code:\n{code}")
+    print("Running generated code:")
+    print(code)
+    run_code(code)
+
+
+ACTIONS.register("rename_files", _rename_files, paths=("directory",))
+ACTIONS.register("sort_files", _sort_files, paths=("directory",))
+ACTIONS.register("create_file", _create_file, batch=_create_files, paths=("filename",))
+ACTIONS.register("run_code", _run_code)
+ACTIONS.register("create_files", _create_file_list, paths=("filenames",))
+ACTIONS.register("create_directory", _create_directory, paths=("directory",))
+ACTIONS.register("delete_file", _delete_file, paths=("filename",))
+ACTIONS.register("delete_directory", _delete_directory, paths=("directory",))
+ACTIONS.register("open_url", _open_url, paths=())
+
+
+def _generate_and_run(intent: dict, user_prompt: str) -> str:
+    """Ask the LLM for code for an action without a handler and run it."""
     action = intent.get("action")
-    
+    log(f"Unknown action: {action} — falling back to LLM to generate code.")
+    print(f"! Unknown action: '{action}', generating code via Ollama...")
+    # Deferred so startup doesn't pay for the HTTP client unless it is needed
+    from llm_agent import generate_code_for_action
+    generated = generate_code_for_action(intent, user_prompt)
+    code = generated.get("code")
+    if not code:
+        print("!! LLM could not generate usable code.")
+        return "no_code"
+    log(f"Generated fallback code:\n{code}")
+    print(code)
+    native = native_intent(generated)
+    entry = ACTIONS.get(native["action"]) if native is not generated and not validate_intent(native) else None
+    if entry is not None:
+        ACTIONS.call(entry.handler, native)
+    else:
+        run_code(code)
+    return "fallback"
+
+
+def _check(intent: dict) -> Optional[str]:
+    """Return "invalid" (after reporting why) if the intent doesn't fit its schema, else None."""
+    errors = validate_intent(intent)
+    if not errors:
+        return None
+    action = intent.get("action") if isinstance(intent, dict) else None
+    log(f"!! Invalid intent for '{action}': {'; '.join(errors)}", ERROR)
+    print(f"!! Invalid {action} intent: {'; '.join(errors)}")
+    return "invalid"
+
+
+@timed("dispatch_command")
+def dispatch_command(intent, user_prompt: str = "", from_pattern: bool = False) -> str:
+    """
+    Execute an intent. Returns the outcome: "ok", "fallback", "no_code", "invalid" or "error".
+
+    A multi intent (or a list of intents) runs through dispatch_intents(); its
+    outcome is "ok" if every step succeeded, else the first other step outcome.
+    """
+    if isinstance(intent, list):
+        intent = {"action": MULTI_ACTION, "intents": intent}
+    action = intent.get("action")
+    if action == MULTI_ACTION:
+        invalid = _check(intent)
+        if invalid is not None:
+            DISPATCH_OUTCOMES.inc(action=action, outcome=invalid)
+            return invalid
+        outcomes = dispatch_intents(list(intent["intents"]), user_prompt, from_pattern)
+        return next((outcome for outcome in outcomes if outcome != "ok"), "ok")
+
     # Log additional info if this intent was generated from a pattern
     if from_pattern:
         log(f"Executing intent from stored pattern: {action}")
-    
+
+    start = time.perf_counter()
+    outcome = "ok"
     try:
-        if action == "rename_files":
-            log(f"Renaming files in directory: {intent['directory']}")
-            rename_files(intent["directory"], intent.get("pattern"))
-        elif action == "sort_files":
-            log(f"Sorting files in directory: {intent['directory']} by {intent.get('group_by')}")
-            sort_files(intent["directory"], intent.get("file_type"), intent.get("group_by"))
-        elif action == "create_file":
-            log(f"Creating file: {intent['filename']}")
-            create_file(intent["filename"], intent.get("content", ""))
-        elif action == "run_code":
-            code = intent.get("code", "")
-            log(f"Running generated code:\n{code}")
-            print("Running generated code:")
-            print(code)
-            safe_globals = {"__builtins__": __builtins__, "open": open, "range": range, "print": print}
-            exec(code, safe_globals)
+        invalid = _check(intent)
+        entry = ACTIONS.get(action) if invalid is None else None
+        if invalid is not None:
+            outcome = invalid
+        elif entry is None:
+            outcome = _generate_and_run(intent, user_prompt)
         else:
-            log(f"Unknown action: {action} — falling back to LLM to generate code.")
-            print(f"! Unknown action: '{action}', generating code via Ollama...")
-            generated = generate_code_for_action(intent, user_prompt)
-            code = generated.get("code")
-            if code:
-                log(f"Generated fallback code:\n{code}")
-                print(code)
-                safe_globals = {"__builtins__": __builtins__, "open": open, "range": range, "print": print}
-                exec(code, safe_globals)
-            else:
-                print("!! LLM could not generate usable code.")
+            ACTIONS.call(entry.handler, intent)
     except Exception as e:
-        log(f"!! Error during action '{action}': {e}")
+        outcome = "error"
+        log(f"!! Error during action '{action}': {e}", ERROR)
         print(f"!! Error: {e}")
+    finally:
+        DISPATCH_OUTCOMES.inc(action=action, outcome=outcome)
+        DISPATCH_LATENCY.observe(time.perf_counter() - start, action=action)
+    return outcome
+
+
+@timed("dispatch_batch")
+def dispatch_batch(intents: List[dict], user_prompt: str = "", from_pattern: bool = False) -> List[str]:
+    """
+    Execute several intents in order. Runs of valid intents with the same
+    action go to the action's batch handler in one call, if it has one.
+
+    Returns:
+        The outcome of each intent (see dispatch_command).
+    """
+    outcomes = [None] * len(intents)
+    i = 0
+    while i < len(intents):
+        intent = intents[i]
+        action = intent.get("action")
+        entry = ACTIONS.get(action) if not validate_intent(intent) else None
+        end = i + 1
+        if entry is not None and entry.batch is not None:
+            while (end < len(intents) and intents[end].get("action") == action
+                   and not validate_intent(intents[end])):
+                end += 1
+        if end - i == 1:
+            outcomes[i] = dispatch_command(intent, user_prompt, from_pattern)
+            i = end
+            continue
+
+        start = time.perf_counter()
+        try:
+            ACTIONS.call(entry.batch, intents[i:end])
+            outcome = "ok"
+        except Exception as e:
+            outcome = "error"
+            log(f"!! Error during batched action '{action}': {e}", ERROR)
+            print(f"!! Error: {e}")
+        DISPATCH_OUTCOMES.inc(end - i, action=action, outcome=outcome)
+        DISPATCH_LATENCY.observe(time.perf_counter() - start, action=action)
+        outcomes[i:end] = [outcome] * (end - i)
+        i = end
+    return outcomes
+
+
+def touched_paths(intent: dict) -> Optional[List[str]]:
+    """
+    The absolute paths an intent reads or writes, from its action's path
+    fields. None if they can't be told (generated code, unknown actions).
+    """
+    entry = ACTIONS.get(intent.get("action"))
+    if entry is None or entry.paths is None:
+        return None
+    paths = []
+    for field in entry.paths:
+        value = intent.get(field)
+        for path in value if isinstance(value, (list, tuple)) else [value]:
+            if isinstance(path, str) and path:
+                paths.append(os.path.normcase(os.path.abspath(os.path.expanduser(path))))
+    return paths
+
+
+def _overlaps(first: Optional[List[str]], second: Optional[List[str]]) -> bool:
+    """Whether two intents touch the same path, or one a path inside the other's folder."""
+    if first is None or second is None:
+        return True
+    for a in first:
+        for b in second:
+            if a == b or a.startswith(b.rstrip(os.sep) + os.sep) or b.startswith(a.rstrip(os.sep) + os.sep):
+                return True
+    return False
+
+
+def dependencies(intents: List[dict]) -> List[Set[int]]:
+    """For each intent, the earlier intents it must wait for."""
+    paths = [touched_paths(intent) if isinstance(intent, dict) else None for intent in intents]
+    return [{j for j in range(i) if _overlaps(paths[i], paths[j])} for i in range(len(intents))]
+
+
+@timed("dispatch_intents")
+def dispatch_intents(intents: List[dict], user_prompt: str = "", from_pattern: bool = False,
+                     max_workers: int = MAX_WORKERS) -> List[str]:
+    """
+    Execute several intents on a thread pool. An intent waits for the earlier
+    ones that touch the same paths (see dependencies()) and is skipped if one
+    of them didn't succeed; the others run in parallel. Steps that become
+    ready together and share an action with a batch handler run as one batch
+    (see dispatch_batch()).
+
+    Returns:
+        The outcome of each intent (see dispatch_command), or "skipped".
+    """
+    if len(intents) == 1:
+        return [dispatch_command(intents[0], user_prompt, from_pattern)]
+    waiting = dependencies(intents)
+    dependents = [[] for _ in intents]
+    for i, needs in enumerate(waiting):
+        for j in needs:
+            dependents[j].append(i)
+    outcomes = [None] * len(intents)
+    blocked = set()
+    ready = [i for i, needs in enumerate(waiting) if not needs]
+
+    def finish(i: int, outcome: str):
+        outcomes[i] = outcome
+        for j in dependents[i]:
+            waiting[j].discard(i)
+            if outcome not in ("ok", "fallback"):
+                blocked.add(j)
+            if not waiting[j]:
+                if j in blocked:
+                    log(f"Skipping step {j + 1} ({intents[j].get('action')}): an earlier step it depends on failed")
+                    finish(j, "skipped")
+                else:
+                    ready.append(j)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(intents))),
+                            thread_name_prefix="dispatch") as pool:
+        running = {}
+        while ready or running:
+            for group in _batches(intents, sorted(ready)):
+                # Run in a copy of the caller's context, so its trace and output capture apply to the step
+                context = contextvars.copy_context()
+                running[pool.submit(context.run, dispatch_batch, [intents[i] for i in group], user_prompt,
+                                    from_pattern)] = group
+            ready.clear()
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                group = running.pop(future)
+                for i, outcome in zip(group, future.result()):
+                    finish(i, outcome)
+    return outcomes
+
+
+def _batches(intents: List[dict], ready: List[int]) -> List[List[int]]:
+    """
+    Group steps that are ready together: valid steps of an action with a batch
+    handler go to it in one call, every other step runs on its own.
+    """
+    groups = []
+    by_action = {}
+    for i in ready:
+        intent = intents[i]
+        action = intent.get("action") if isinstance(intent, dict) else None
+        entry = ACTIONS.get(action) if action is not None and not validate_intent(intent) else None
+        if entry is None or entry.batch is None:
+            groups.append([i])
+        elif action in by_action:
+            by_action[action].append(i)
+        else:
+            by_action[action] = [i]
+            groups.append(by_action[action])
+    return groups
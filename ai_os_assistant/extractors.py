@@ -0,0 +1,157 @@
+"""
+Variable extractors used when a command is learned as a pattern.
+
+Each category has a list of extractors, each a regex for one kind of variable
+(filename, url, query, ...). A category's extractors are compiled together into
+a single alternation, so a command is scanned once per category, and every
+candidate is returned with its span rather than only the first one. Commands in
+categories whose extractors find nothing fall back to the generic extractors
+(quoted text, Windows paths, numbers).
+
+Extra extractors can be registered at runtime:
+
+    from extractors import register_extractor
+    register_extractor("program_launch", "program", r"(?i:\\blaunch\\s+(\\w+))")
+
+An extractor's value is its first capturing group that took part in the match,
+or the whole match if it has none. Patterns should use plain (unnamed) groups
+and no numbered backreferences, since they are combined into one regex.
+"""
+import re
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+# Category name for the fallback extractors
+GENERIC = "*"
+
+FILE_EXTENSIONS = "txt|doc|docx|pdf|csv|xlsx?|json|html?|css|js|py|java|cpp|c|go|rs|php"
+
+
+class Candidate(NamedTuple):
+    """A variable found in a command; start and end index into the command."""
+    name: str
+    value: str
+    start: int
+    end: int
+
+
+class _CompiledCategory:
+    __slots__ = ("regex", "groups")
+
+    def __init__(self, extractors: List[Tuple[str, str, int]]):
+        parts = []
+        # outer group index -> (variable name, indexes of the extractor's own groups)
+        self.groups = {}
+        index = 1
+        for name, pattern, flags in extractors:
+            inner = re.compile(pattern, flags).groups
+            if flags:
+                pattern = f"(?{_inline_flags(flags)}:{pattern})"
+            parts.append(f"({pattern})")
+            self.groups[index] = (name, tuple(range(index + 1, index + 1 + inner)))
+            index += 1 + inner
+        self.regex = re.compile("|".join(parts))
+
+    def find(self, command: str) -> List[Tuple[str, str, int, int]]:
+        """(name, value, start, end) for each match, in order; matches never overlap."""
+        found = []
+        for match in self.regex.finditer(command):
+            # The extractor's outer group is the last one to close
+            outer = match.lastindex
+            name, inner = self.groups[outer]
+            group = outer
+            for candidate in inner:
+                if match.start(candidate) != -1:
+                    group = candidate
+                    break
+            start, end = match.span(group)
+            if end > start:
+                found.append((name, match.group(group), start, end))
+        return found
+
+
+def _inline_flags(flags: int) -> str:
+    letters = ""
+    if flags & re.IGNORECASE:
+        letters += "i"
+    if flags & re.MULTILINE:
+        letters += "m"
+    if flags & re.DOTALL:
+        letters += "s"
+    if flags & ~(re.IGNORECASE | re.MULTILINE | re.DOTALL):
+        raise ValueError("only IGNORECASE, MULTILINE and DOTALL can be used for extractors")
+    return letters
+
+
+class ExtractorRegistry:
+    def __init__(self):
+        self._extractors = {}
+        self._compiled = {}
+
+    def register(self, category: str, name: str, pattern: str, flags: int = 0):
+        """
+        Add an extractor for a category (GENERIC for the fallback extractors).
+
+        Args:
+            category: Category the extractor applies to.
+            name: Variable name for the values it finds; must be an identifier.
+            pattern: Regex matching the value (see the module docstring).
+            flags: re.IGNORECASE, re.MULTILINE and/or re.DOTALL.
+        """
+        if not name.isidentifier():
+            raise ValueError(f"Extractor name must be an identifier: {name!r}")
+        compiled = re.compile(pattern, flags)
+        if compiled.groupindex:
+            raise ValueError("Extractor patterns must use unnamed groups")
+        self._extractors.setdefault(category, []).append((name, pattern, flags))
+        self._compiled.pop(category, None)
+
+    def categories(self) -> List[str]:
+        return list(self._extractors)
+
+    def _for_category(self, category: str) -> Optional[_CompiledCategory]:
+        compiled = self._compiled.get(category)
+        if compiled is None and category in self._extractors:
+            compiled = self._compiled[category] = _CompiledCategory(self._extractors[category])
+        return compiled
+
+    def extract(self, command: str, category: str) -> List[Candidate]:
+        """
+        Find every variable in a command, in order of position. Where extractors
+        overlap, the match that starts first wins (then the extractor registered
+        first). Repeated names are numbered (filename, filename_2, ...).
+        """
+        found = []
+        compiled = self._for_category(category)
+        if compiled is not None:
+            found = compiled.find(command)
+        if not found and category != GENERIC:
+            compiled = self._for_category(GENERIC)
+            if compiled is not None:
+                found = compiled.find(command)
+
+        candidates = []
+        counts = {}
+        for name, value, start, end in found:
+            count = counts[name] = counts.get(name, 0) + 1
+            candidates.append(Candidate(name if count == 1 else f"{name}_{count}", value, start, end))
+        return candidates
+
+
+EXTRACTORS = ExtractorRegistry()
+
+
+def register_extractor(category: str, name: str, pattern: str, flags: int = 0):
+    """Add an extractor to the default registry used by CommandStore."""
+    EXTRACTORS.register(category, name, pattern, flags)
+
+
+EXTRACTORS.register("file_creation", "filename", rf"\b([\w\-\.]+\.(?:{FILE_EXTENSIONS}))\b")
+EXTRACTORS.register("open_webpage", "url",
+                    r"\b(www\.[a-zA-Z0-9\-\.]+\.[a-zA-Z]{2,}|https?://[a-zA-Z0-9\-\.]+\.[a-zA-Z]{2,}"
+                    r"|[a-zA-Z0-9\-\.]+\.(?:com|org|net|io|edu|gov))\b")
+EXTRACTORS.register("search_query", "query",
+                    r'\b(?:search for|find|look up|google|bing|search)(?:\s+for)?\s+'
+                    r'(?:"([^"]+)"|(.+?)(?:\s+in\b|\s+on\b|\s+with\b|$))', re.IGNORECASE)
+EXTRACTORS.register(GENERIC, "quoted_text", r'"([^"]+)"')
+EXTRACTORS.register(GENERIC, "path", r'[a-zA-Z]:\\(?:[^\\/:*?"<>|\r\n]+\\)*[^\\/:*?"<>|\r\n]*')
+EXTRACTORS.register(GENERIC, "number", r"\b\d+\b")
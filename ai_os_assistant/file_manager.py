@@ -38,3 +38,34 @@ def create_file(filename, content=""):
     with open(filename, 'w', encoding='utf-8') as f:
         f.write(content)
     print(f"✅ Created file: {filename}")
+
+def create_files(files):
+    """Create several files; files is a list of (filename, content) pairs."""
+    for filename, content in files:
+        with open(filename, 'w', encoding='utf-8') as f:
+            f.write(content)
+    print(f"✅ Created {len(files)} files: {', '.join(filename for filename, _ in files)}")
+
+def create_directory(directory, exist_ok=True, parents=True):
+    if parents:
+        os.makedirs(directory, exist_ok=exist_ok)
+    elif not (exist_ok and os.path.isdir(directory)):
+        os.mkdir(directory)
+    print(f"✅ Created folder: {directory}")
+
+def delete_file(filename):
+    os.remove(filename)
+    print(f"🗑️ Deleted file: {filename}")
+
+def delete_directory(directory, recursive=True):
+    if recursive:
+        shutil.rmtree(directory)
+    else:
+        os.rmdir(directory)
+    print(f"🗑️ Deleted folder: {directory}")
+
+def open_url(url):
+    # Imported here; most sessions never open a browser
+    import webbrowser
+    webbrowser.open(url)
+    print(f"🌐 Opened: {url}")
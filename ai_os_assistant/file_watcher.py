@@ -0,0 +1,160 @@
+"""
+Watch one file for changes made by other processes.
+
+On Linux the file's directory is watched with inotify (through ctypes, no extra
+packages), so a change is seen as soon as the writer closes or renames the file;
+the pattern file is saved by writing a temporary file and renaming it over the
+old one, which is why the directory is watched rather than the file. Elsewhere,
+or if inotify can't be set up, the file's (inode, mtime, size) is polled.
+
+    watcher = FileWatcher("command_patterns.json", on_change).start()
+    ...
+    watcher.stop()
+"""
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import threading
+from typing import Callable, Optional, Tuple
+
+from utils import log, ERROR, WARNING
+
+# inotify event masks (linux/inotify.h)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = getattr(os, "O_CLOEXEC", 0o2000000)
+
+_EVENT = struct.Struct("iIII")
+_WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+
+def _load_inotify():
+    """libc's inotify functions, or None where there is no inotify."""
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        return libc
+    except (OSError, AttributeError):
+        return None
+
+
+class FileWatcher:
+    """Call a function on a background thread whenever a file changes."""
+
+    def __init__(self, path: str, on_change: Callable[[], object], poll_interval: float = 1.0,
+                 debounce: float = 0.05, use_inotify: bool = True):
+        """
+        Args:
+            path: The file to watch. It doesn't have to exist yet.
+            on_change: Called (on the watcher's thread) after the file changed.
+            poll_interval: Seconds between checks when polling.
+            debounce: Seconds to wait for further events before calling on_change,
+                so a burst of writes causes one call.
+            use_inotify: Use inotify where available; False always polls.
+        """
+        self.path = os.path.abspath(path)
+        self.on_change = on_change
+        self.poll_interval = poll_interval
+        self.debounce = debounce
+        self.use_inotify = use_inotify
+        # "inotify" or "polling", once started
+        self.mode = None
+        self._stop = threading.Event()
+        self._thread = None
+        self._fd = None
+        # What the file looked like when polling started
+        self._last = None
+
+    def start(self) -> "FileWatcher":
+        self._fd = self._open_inotify() if self.use_inotify else None
+        self.mode = "inotify" if self._fd is not None else "polling"
+        target = self._watch_inotify if self._fd is not None else self._poll
+        # Taken here rather than on the thread, so a change made right after start() isn't missed
+        self._last = self._signature()
+        self._thread = threading.Thread(target=target, name="watch-patterns", daemon=True)
+        self._thread.start()
+        log(f"Watching {self.path} for changes ({self.mode})")
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def _open_inotify(self) -> Optional[int]:
+        libc = _load_inotify()
+        if libc is None:
+            return None
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            log(f"inotify is unavailable ({os.strerror(ctypes.get_errno())}); polling instead", WARNING)
+            return None
+        directory = os.path.dirname(self.path)
+        if libc.inotify_add_watch(fd, os.fsencode(directory), _WATCH_MASK) < 0:
+            log(f"Can't watch {directory} ({os.strerror(ctypes.get_errno())}); polling instead", WARNING)
+            os.close(fd)
+            return None
+        return fd
+
+    def _changed(self):
+        try:
+            self.on_change()
+        except Exception as e:
+            log(f"Error handling a change to {self.path}: {e}", ERROR)
+
+    def _read_events(self) -> bool:
+        """Read the pending inotify events; True if one was about the watched file."""
+        name = os.path.basename(self.path)
+        relevant = False
+        while True:
+            try:
+                data = os.read(self._fd, 65536)
+            except BlockingIOError:
+                return relevant
+            offset = 0
+            while offset < len(data):
+                _, mask, _, length = _EVENT.unpack_from(data, offset)
+                offset += _EVENT.size
+                event_name = data[offset:offset + length].rstrip(b"\0").decode(errors="replace")
+                offset += length
+                if mask & IN_Q_OVERFLOW or event_name == name:
+                    relevant = True
+
+    def _watch_inotify(self):
+        while not self._stop.is_set():
+            # The timeout lets stop() end the thread
+            readable, _, _ = select.select([self._fd], [], [], 0.5)
+            if not readable or not self._read_events():
+                continue
+            # Let a burst of writes settle into one reload
+            while select.select([self._fd], [], [], self.debounce)[0]:
+                self._read_events()
+            self._changed()
+
+    def _signature(self) -> Optional[Tuple[int, int, int]]:
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def _poll(self):
+        while not self._stop.wait(self.poll_interval):
+            current = self._signature()
+            if current != self._last:
+                self._last = current
+                self._changed()
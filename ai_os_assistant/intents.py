@@ -0,0 +1,171 @@
+"""
+Schemas for the intents the dispatcher runs natively.
+
+Each action has a list of fields. The schema is compiled once into a plain
+Python function (straight-line isinstance checks, no loops over the schema), so
+validating an intent costs about as much as reading its fields. Intents are
+validated when the LLM returns them and when stored patterns are loaded,
+rather than failing with a KeyError halfway through dispatching.
+
+Actions without a schema are not validated; the dispatcher asks the LLM to
+write code for them. A prompt asking for several things is one "multi" intent
+whose steps are validated one by one.
+
+    from intents import Field, register_schema
+    register_schema("open_url", Field("url"))
+"""
+from types import MappingProxyType
+from typing import Callable, List, NamedTuple, Optional, Tuple, Union
+
+
+class Field(NamedTuple):
+    name: str
+    # Accepted type(s) of the value
+    type: Union[type, Tuple[type, ...]] = str
+    required: bool = True
+    # Strings must not be blank (required fields only)
+    non_empty: bool = True
+
+
+_MISSING = object()
+
+# Action of an intent made of several steps: {"action": "multi", "intents": [...]}
+MULTI_ACTION = "multi"
+
+_TYPE_NAMES = {str: "a string", int: "a number", float: "a number", bool: "true or false",
+               list: "a list", dict: "an object"}
+
+
+def _type_name(types) -> str:
+    types = types if isinstance(types, tuple) else (types,)
+    return " or ".join(dict.fromkeys(_TYPE_NAMES.get(t, t.__name__) for t in types))
+
+
+# Stored intent templates are frozen: lists into tuples, dicts into mapping proxies
+_FROZEN = {list: tuple, dict: MappingProxyType}
+
+
+def _accepted(types) -> Tuple[type, ...]:
+    types = types if isinstance(types, tuple) else (types,)
+    return types + tuple(_FROZEN[t] for t in types if t in _FROZEN)
+
+
+def compile_validator(action: str, fields: List[Field]) -> Callable[[dict], List[str]]:
+    """
+    Generate the validator for one action's fields.
+
+    Returns:
+        A function taking an intent and returning its problems ([] if valid).
+    """
+    namespace = {"_MISSING": _MISSING}
+    lines = ["def validate(intent):", "    errors = []", "    get = intent.get"]
+    for i, field in enumerate(fields):
+        namespace[f"_type{i}"] = _accepted(field.type)
+        name = repr(field.name)
+        wrong_type = repr(f"'{field.name}' must be {_type_name(field.type)}")
+        lines.append(f"    value = get({name}, _MISSING)")
+        if field.required:
+            lines.append("    if value is _MISSING or value is None:")
+            lines.append(f"        errors.append({repr(f'missing {field.name!r}')})")
+            lines.append(f"    elif not isinstance(value, _type{i}):")
+            lines.append(f"        errors.append({wrong_type})")
+            if field.non_empty:
+                lines.append("    elif type(value) is str and not value.strip():")
+                lines.append(f"        errors.append({repr(f'{field.name!r} is empty')})")
+        else:
+            lines.append(f"    if value is not _MISSING and value is not None and not isinstance(value, _type{i}):")
+            lines.append(f"        errors.append({wrong_type})")
+    lines.append("    return errors")
+    exec(compile("\n".join(lines), f"<intent schema {action}>", "exec"), namespace)
+    return namespace["validate"]
+
+
+class SchemaRegistry:
+    def __init__(self):
+        self._fields = {}
+        self._validators = {}
+
+    def register(self, action: str, *fields: Field):
+        """Add (or replace) the schema for an action."""
+        self._fields[action] = list(fields)
+        self._validators[action] = compile_validator(action, list(fields))
+
+    def __contains__(self, action) -> bool:
+        return action in self._validators
+
+    def actions(self) -> List[str]:
+        return list(self._validators)
+
+    def fields(self, action: str) -> List[Field]:
+        return list(self._fields.get(action, ()))
+
+    def validate(self, intent) -> List[str]:
+        """
+        Problems with an intent, or [] if it is valid. Intents whose action has
+        no schema are only checked for being an object with an action.
+        """
+        if not isinstance(intent, (dict, MappingProxyType)):
+            return ["intent is not a JSON object"]
+        action = intent.get("action")
+        if not isinstance(action, str) or not action:
+            return ["missing 'action'"]
+        validator = self._validators.get(action)
+        errors = validator(intent) if validator is not None else []
+        if action == MULTI_ACTION and not errors:
+            errors = self._validate_steps(intent["intents"])
+        return errors
+
+    def _validate_steps(self, steps) -> List[str]:
+        if not steps:
+            return ["'intents' is empty"]
+        errors = []
+        for number, step in enumerate(steps, 1):
+            if isinstance(step, (dict, MappingProxyType)) and step.get("action") == MULTI_ACTION:
+                errors.append(f"step {number}: multi intents can't be nested")
+            else:
+                errors.extend(f"step {number}: {error}" for error in self.validate(step))
+        return errors
+
+    def describe(self, action: str) -> Optional[str]:
+        """The fields of an action, as shown to the LLM when asking it to fix an intent."""
+        if action not in self._fields:
+            return None
+        parts = [f'"{field.name}": {_type_name(field.type)}{"" if field.required else " (optional)"}'
+                 for field in self._fields[action]]
+        return f'{{"action": "{action}", ' + ", ".join(parts) + "}"
+
+
+SCHEMAS = SchemaRegistry()
+
+
+def register_schema(action: str, *fields: Field):
+    """Add a schema to the default registry used by the assistant and the dispatcher."""
+    SCHEMAS.register(action, *fields)
+
+
+def validate_intent(intent) -> List[str]:
+    return SCHEMAS.validate(intent)
+
+
+def intent_list(intent) -> list:
+    """The steps of a multi intent, or a list holding just the intent."""
+    if isinstance(intent, (dict, MappingProxyType)) and intent.get("action") == MULTI_ACTION:
+        steps = intent.get("intents")
+        return list(steps) if isinstance(steps, (list, tuple)) else []
+    return [intent]
+
+
+SCHEMAS.register("rename_files", Field("directory"), Field("pattern", required=False))
+SCHEMAS.register("sort_files", Field("directory"), Field("file_type", required=False),
+                 Field("group_by", required=False))
+SCHEMAS.register("create_file", Field("filename"), Field("content", required=False))
+SCHEMAS.register("run_code", Field("code"))
+# Each step is validated on its own (see SchemaRegistry.validate)
+SCHEMAS.register(MULTI_ACTION, Field("intents", list))
+# Native forms of common generated code (see code_shapes.py)
+SCHEMAS.register("create_files", Field("filenames", list))
+SCHEMAS.register("create_directory", Field("directory"), Field("exist_ok", bool, required=False),
+                 Field("parents", bool, required=False))
+SCHEMAS.register("delete_file", Field("filename"))
+SCHEMAS.register("delete_directory", Field("directory"), Field("recursive", bool, required=False))
+SCHEMAS.register("open_url", Field("url"))
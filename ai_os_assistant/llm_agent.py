@@ -1,108 +1,637 @@
 
-import requests
+import os
 import re
 import json
-from utils import log
+import sys
+import threading
+import time
+from typing import Callable, List, Optional, Tuple
+from utils import log, log_enabled, DEBUG, WARNING, ERROR
+from tracing import span, mark, current_trace
+from metrics import LLM_LATENCY, LLM_FAILURES, LLM_ESCALATIONS, LLM_REPAIRS
+from model_router import ModelRouter, RoutingPolicy, default_policy
+from intents import MULTI_ACTION, SCHEMAS
+
+# Base URL of the Ollama server; OLLAMA_URL points the assistant at another
+# instance, e.g. the offline stand-in in mock_ollama.py
+OLLAMA_URL = os.environ.get("OLLAMA_URL", "http://localhost:11434").rstrip("/")
+OLLAMA_CHAT_URL = f"{OLLAMA_URL}/api/chat"
+
+
+# Model used for intents and generated code
+MODEL = "deepseek-r1:32b"
+
+# How long Ollama keeps the model loaded after a request (its default is 5m), so
+# prompts a few minutes apart don't each wait for a 32B model to reload
+KEEP_ALIVE = os.environ.get("OLLAMA_KEEP_ALIVE", "30m")
+
+# Ask Ollama to constrain replies to JSON ("format": "json"). Off by default:
+# deepseek-r1 skips its reasoning section when it is on
+JSON_FORMAT = os.environ.get("OLLAMA_JSON_FORMAT", "").lower() in ("1", "true", "yes")
+
+# Most tokens generated per request. A reply is one small JSON object, but
+# without JSON format a reasoning model writes its <think> section first
+MAX_TOKENS = 2048
+MAX_TOKENS_JSON = 256
+
+
+# Chooses the model for each request; created from OLLAMA_MODELS on first use
+_router = None
+
+
+def get_router() -> ModelRouter:
+    global _router
+    if _router is None:
+        _router = ModelRouter(default_policy(MODEL))
+    return _router
+
+
+def set_routing_policy(policy: RoutingPolicy):
+    """Use another list of models or escalation rules for later requests."""
+    global _router
+    _router = ModelRouter(policy)
+
+
+def set_ollama_url(url: str):
+    """Point later requests at another Ollama server."""
+    global OLLAMA_URL, OLLAMA_CHAT_URL
+    OLLAMA_URL = url.rstrip("/")
+    OLLAMA_CHAT_URL = f"{OLLAMA_URL}/api/chat"
+
+
+# requests takes longer to import than the rest of the assistant put together,
+# so it is only loaded when the first prompt actually needs the LLM
+_session = None
+_session_lock = threading.Lock()
+
+
+def _http_session():
+    """Shared requests session, created on first use so connections are reused."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                import requests
+                _session = requests.Session()
+    return _session
+
+
+class LLMCancelled(Exception):
+    """Raised by an LLM call whose Cancellation was cancelled before it finished."""
+
+
+class Cancellation:
+    """
+    Lets another thread abandon an LLM call. Cancelling closes the streaming
+    response, which unblocks the reader and tells Ollama to stop generating.
+    """
+
+    def __init__(self):
+        self._cancelled = threading.Event()
+        self._response = None
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def cancel(self):
+        with self._lock:
+            self._cancelled.set()
+            response = self._response
+        if response is not None:
+            response.close()
+
+    def _attach(self, response):
+        """Remember the response to close; closes it at once if already cancelled."""
+        with self._lock:
+            self._response = response
+            cancelled = self.cancelled
+        if cancelled:
+            response.close()
+            raise LLMCancelled()
+
+
+def _is_connection_error(error: Exception) -> bool:
+    requests = sys.modules.get("requests")
+    return requests is not None and isinstance(error, requests.exceptions.ConnectionError)
+
+def _chat_request(messages: List[dict], json_format: Optional[bool] = None, long_reply: bool = False,
+                  model: Optional[str] = None) -> dict:
+    """
+    Body of a chat request: keeps the model loaded, caps the reply length and
+    asks for JSON if enabled.
+
+    Args:
+        messages: The conversation.
+        json_format: Overrides JSON_FORMAT.
+        long_reply: The JSON itself may be long (generated code), so keep the larger cap.
+        model: Defaults to MODEL.
+    """
+    json_format = JSON_FORMAT if json_format is None else json_format
+    data = {
+        "model": model or MODEL,
+        "messages": messages,
+        "keep_alive": KEEP_ALIVE,
+        "options": {"temperature": 0,
+                    "num_predict": MAX_TOKENS_JSON if json_format and not long_reply else MAX_TOKENS},
+    }
+    if json_format:
+        data["format"] = "json"
+    return data
+
+
+THINK_OPEN = "<think>"
+THINK_CLOSE = "</think>"
+
+
+def _partial_tag(text: str, tag: str) -> int:
+    """Length of the longest end of text that could be the start of tag."""
+    for size in range(min(len(tag) - 1, len(text)), 0, -1):
+        if text.endswith(tag[:size]):
+            return size
+    return 0
+
+
+class _ThinkFilter:
+    """
+    Drop a reasoning model's <think> section from a reply as it streams.
+
+    feed() returns only the text after the section, so nothing before the
+    answer is buffered, searched for JSON or logged. Tags split across chunks
+    are recognised; the reasoning itself is only kept if keep_reasoning is set.
+    """
+
+    def __init__(self, keep_reasoning: bool = False):
+        # "start" until it's known whether the reply opens with <think>, then "reasoning" or "answer"
+        self.state = "start"
+        # Text that may be the start of a tag, held back until the next chunk
+        self.pending = ""
+        self.reasoning = [] if keep_reasoning else None
+        self.reasoning_chars = 0
+
+    def _reason(self, text: str):
+        self.reasoning_chars += len(text)
+        if self.reasoning is not None:
+            self.reasoning.append(text)
+
+    def feed(self, chunk: str) -> str:
+        if self.state == "answer":
+            return chunk
+        text = self.pending + chunk
+        self.pending = ""
+        if self.state == "start":
+            stripped = text.lstrip()
+            if stripped.startswith(THINK_OPEN):
+                self.state = "reasoning"
+                text = stripped[len(THINK_OPEN):]
+            elif THINK_OPEN.startswith(stripped):
+                # Only whitespace or part of the tag so far
+                self.pending = text
+                return ""
+            else:
+                self.state = "answer"
+                return text
+        if "<" not in text:
+            # Most reasoning chunks can't hold any part of the closing tag
+            self._reason(text)
+            return ""
+        end = text.find(THINK_CLOSE)
+        if end == -1:
+            keep = _partial_tag(text, THINK_CLOSE)
+            self._reason(text[:len(text) - keep])
+            self.pending = text[len(text) - keep:]
+            return ""
+        self._reason(text[:end])
+        self.state = "answer"
+        return text[end + len(THINK_CLOSE):]
+
+    @property
+    def answering(self) -> bool:
+        return self.state == "answer"
+
+
+class _JsonEnd:
+    """
+    Follows the answer text of a streamed reply and tells when its first JSON
+    object is complete, so the rest of the reply needn't be generated. An
+    array counts only if the answer starts with it; brackets in prose before
+    the JSON ("Sure [here it is]: {...}") don't.
+    """
+
+    def __init__(self):
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+        self.at_start = True
+
+    def feed(self, chunk: str) -> int:
+        """How much of the chunk the JSON value ends in (through its closing bracket), or -1."""
+        for i, char in enumerate(chunk):
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == "\\":
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+            elif self.depth:
+                if char == '"':
+                    self.in_string = True
+                elif char in "{[":
+                    self.depth += 1
+                elif char in "}]":
+                    self.depth -= 1
+                    if not self.depth:
+                        return i + 1
+            elif char == "{" or (char == "[" and self.at_start):
+                self.depth = 1
+            if self.at_start and not char.isspace():
+                self.at_start = False
+        return -1
+
 
 SYSTEM_PROMPT = """You are a system automation assistant for a local Python-based OS agent.
 You must respond ONLY with a JSON object. No explanations, no extra text, no code blocks. Examples:
 {"action": "run_code", "code": "open('file.txt', 'w').close()"}
+For a request to do several things, list the steps in order:
+{"action": "multi", "intents": [{"action": "create_file", "filename": "a.txt"}, {"action": "sort_files", "directory": "."}]}
 """
 
-def parse_prompt(prompt: str) -> dict:
-    # data = {
-    #     "model": "mistral",
-    #     "messages": [
-    #         {"role": "system", "content": SYSTEM_PROMPT},
-    #         {"role": "user", "content": prompt}
-    #     ]
-    # }
-    data = {
-        "model": "deepseek-r1:32b",
-        "messages": [
-            {"role": "system", "content": SYSTEM_PROMPT},
-            {"role": "user", "content": prompt}
-        ]
-    }
+def _stream_chat(data: dict, span_prefix: str, cancellation: Optional[Cancellation] = None,
+                 stop_after_json: bool = True) -> str:
+    """
+    Send a chat request to Ollama and return the assistant's reconstructed content.
 
-    try:
-        log(f"Sending request to Ollama with prompt: {prompt}")
-        response = requests.post("http://localhost:11434/api/chat", json=data)
-        response.raise_for_status()
+    The NDJSON response is read as it streams so the trace can record time to
+    connect, time to first token and time to the full response. A leading
+    <think> section is dropped as it arrives, so only the answer after it is
+    returned (the reasoning is logged in debug mode only). Unless
+    stop_after_json is False, the stream is closed as soon as the answer's JSON
+    object is complete, which also stops Ollama generating the rest.
 
-        raw_response = response.text
-        log("Raw Ollama response:\n" + raw_response)
+    Raises:
+        LLMCancelled: If the cancellation was cancelled before the reply was complete.
+    """
+    request_start = time.perf_counter()
+    with span(f"{span_prefix}.connect"):
+        response = _http_session().post(OLLAMA_CHAT_URL, json=data, stream=True)
+        if cancellation is not None:
+            cancellation._attach(response)
+        response.raise_for_status()
 
-        # Process each line of the streamed response and collect all content
-        content_parts = []
-        for line in raw_response.strip().splitlines():
+    # Only keep the raw lines and the reasoning around if they are going to be logged
+    debug = log_enabled(DEBUG)
+    raw_lines = [] if debug else None
+    content_parts = []
+    first_token = False
+    think = _ThinkFilter(keep_reasoning=debug)
+    json_end = _JsonEnd() if stop_after_json else None
+    try:
+        for line in response.iter_lines(decode_unicode=True):
+            if not line:
+                continue
+            if raw_lines is not None:
+                raw_lines.append(line)
             try:
                 parsed_line = json.loads(line)
-                if "message" in parsed_line and "content" in parsed_line["message"]:
-                    content_parts.append(parsed_line["message"]["content"])
             except json.JSONDecodeError as e:
-                log(f"Skipping invalid JSON line: {line} — {e}")
+                log(f"Skipping invalid JSON line: {line} — {e}", WARNING)
+                continue
+            # Reasoning sent separately (Ollama's "thinking" field) is never read
+            if "message" in parsed_line and "content" in parsed_line["message"]:
+                if not first_token:
+                    first_token = True
+                    mark(f"{span_prefix}.first_token", time.perf_counter() - request_start)
+                answering = think.answering
+                answer = think.feed(parsed_line["message"]["content"])
+                if not answering and think.answering:
+                    mark(f"{span_prefix}.reasoning", time.perf_counter() - request_start)
+                if not answer:
+                    continue
+                if json_end is not None:
+                    end = json_end.feed(answer)
+                    if end != -1:
+                        content_parts.append(answer[:end])
+                        break
+                content_parts.append(answer)
+    except Exception:
+        # Closing the response from another thread makes the read fail
+        if cancellation is not None and cancellation.cancelled:
+            raise LLMCancelled()
+        raise
+    finally:
+        response.close()
+    if cancellation is not None and cancellation.cancelled:
+        raise LLMCancelled()
+    elapsed = time.perf_counter() - request_start
+    mark(f"{span_prefix}.response", elapsed)
+    LLM_LATENCY.observe(elapsed, call=span_prefix)
 
-        content = "".join(content_parts)
-        log(f"Reconstructed assistant content: {content}")
+    if raw_lines is not None:
+        log("Raw Ollama response:\n" + "\n".join(raw_lines), DEBUG)
+    if think.reasoning:
+        log(f"Model reasoning ({think.reasoning_chars} chars):\n" + "".join(think.reasoning), DEBUG)
+    if think.state == "start":
+        # The reply was only whitespace or an unfinished tag
+        content_parts.append(think.pending)
+    return "".join(content_parts)
 
-        # Try the simplest approach first - find the outermost JSON object
-        try:
-            # Look for complete JSON objects with proper start/end structure
-            json_start = content.find('{')
-            if json_start != -1:
-                # Count braces to find the matching closing brace
-                brace_count = 1
-                pos = json_start + 1
-                while pos < len(content) and brace_count > 0:
-                    if content[pos] == '{':
-                        brace_count += 1
-                    elif content[pos] == '}':
-                        brace_count -= 1
-                    pos += 1
-                
-                if brace_count == 0:  # We found a complete, balanced JSON object
-                    json_str = content[json_start:pos]
-                    # Pre-process f-strings to protect them from JSON parser
-                    # Make sure to preserve the f prefix for f-strings
-                    processed_json = json_str
-                    return json.loads(processed_json)
-        except json.JSONDecodeError as e:
-            log(f"!! JSON parsing error with brace matching approach: {e}")
-        
-        # If that failed, try the regex approach that worked for some cases
-        try:
-            match = re.search(r'(\{(?:[^{}]|(?:\{(?:[^{}]|(?:\{[^{}]*\}))*\}))*\})', content, re.DOTALL)
-            if match:
-                json_str = match.group(0).strip()
-                # Don't strip f prefix from f-strings
+
+def _extract_intent_json(content: str) -> dict:
+    """Pull the first valid JSON object out of the model's reply."""
+    # Try the simplest approach first - find the outermost JSON object
+    try:
+        # Look for complete JSON objects with proper start/end structure
+        json_start = content.find('{')
+        if json_start != -1:
+            # Count braces to find the matching closing brace
+            brace_count = 1
+            pos = json_start + 1
+            while pos < len(content) and brace_count > 0:
+                if content[pos] == '{':
+                    brace_count += 1
+                elif content[pos] == '}':
+                    brace_count -= 1
+                pos += 1
+            
+            if brace_count == 0:  # We found a complete, balanced JSON object
+                json_str = content[json_start:pos]
+                # Pre-process f-strings to protect them from JSON parser
+                # Make sure to preserve the f prefix for f-strings
                 processed_json = json_str
                 return json.loads(processed_json)
-        except json.JSONDecodeError as e:
-            log(f"!! JSON parsing error with regex approach: {e} in string: {json_str}")
+    except json.JSONDecodeError as e:
+        log(f"!! JSON parsing error with brace matching approach: {e}", WARNING)
+    
+    # If that failed, try the regex approach that worked for some cases
+    try:
+        match = re.search(r'(\{(?:[^{}]|(?:\{(?:[^{}]|(?:\{[^{}]*\}))*\}))*\})', content, re.DOTALL)
+        if match:
+            json_str = match.group(0).strip()
+            # Don't strip f prefix from f-strings
+            processed_json = json_str
+            return json.loads(processed_json)
+    except json.JSONDecodeError as e:
+        log(f"!! JSON parsing error with regex approach: {e} in string: {json_str}", WARNING)
+    
+    # Final fallback - aggressively look for just the first JSON-like structure
+    try:
+        simple_match = re.search(r'\{.*?\}', content, re.DOTALL)
+        if simple_match:
+            json_str = simple_match.group(0)
+            # Don't strip f prefix from f-strings
+            processed_json = json_str
+            return json.loads(processed_json)
+    except Exception as e:
+        log(f"!! All JSON extraction methods failed: {e}", ERROR)
         
-        # Final fallback - aggressively look for just the first JSON-like structure
+    # If we got here, none of our approaches worked
+    log("!! Could not extract valid JSON from: " + content, ERROR)
+    raise ValueError("No valid JSON object found in assistant's content")
+
+
+def _extract_intents_json(content: str) -> dict:
+    """
+    Like _extract_intent_json, but a reply that is a JSON array of intents
+    becomes one multi intent.
+    """
+    array_start = content.find("[")
+    object_start = content.find("{")
+    if array_start != -1 and (object_start == -1 or array_start < object_start):
         try:
-            simple_match = re.search(r'\{.*?\}', content, re.DOTALL)
-            if simple_match:
-                json_str = simple_match.group(0)
+            steps, _ = json.JSONDecoder().raw_decode(content, array_start)
+        except json.JSONDecodeError:
+            steps = None
+        if isinstance(steps, list) and steps and all(isinstance(step, dict) for step in steps):
+            return steps[0] if len(steps) == 1 else {"action": MULTI_ACTION, "intents": steps}
+    return _extract_intent_json(content)
+
+
+def intent_messages(prompt: str, examples: Optional[List[Tuple[str, dict]]] = None) -> List[dict]:
+    """
+    Chat messages for an intent request. The system prompt always comes first
+    and never changes, so Ollama can reuse its cached evaluation; examples
+    follow as earlier turns of the conversation.
+    """
+    messages = [{"role": "system", "content": SYSTEM_PROMPT}]
+    for command, intent in examples or ():
+        messages.append({"role": "user", "content": command})
+        messages.append({"role": "assistant", "content": json.dumps(intent)})
+    messages.append({"role": "user", "content": prompt})
+    return messages
+
+
+def warm_up(timeout: float = 300.0, background: bool = False) -> bool:
+    """
+    Get ready for the first prompt now: create the HTTP session (importing
+    requests) and load the model into Ollama's memory (an empty chat request),
+    so the first prompt waits for neither.
+
+    Args:
+        timeout: Seconds to wait for Ollama to load the model.
+        background: Load the model on a daemon thread and return once the
+            session exists.
+
+    Returns:
+        True if Ollama loaded the model, or in the background, that loading started.
+    """
+    session = _http_session()
+    if background:
+        threading.Thread(target=warm_up, args=(timeout,), name="load-model", daemon=True).start()
+        return True
+    try:
+        response = session.post(OLLAMA_CHAT_URL, json={"model": MODEL, "messages": [], "keep_alive": KEEP_ALIVE},
+                                timeout=timeout)
+        response.raise_for_status()
+        log(f"Loaded {MODEL} (kept for {KEEP_ALIVE})")
+        return True
+    except Exception as e:
+        log(f"Could not preload {MODEL}: {e}", WARNING)
+        return False
+
+
+def _extract_code_json(content: str) -> dict:
+    """Pull the run_code intent out of a generate_code reply."""
+    # Try the simplest approach first - find the outermost JSON object
+    try:
+        # Look for complete JSON objects with proper start/end structure
+        json_start = content.find('{')
+        if json_start != -1:
+            # Count braces to find the matching closing brace
+            brace_count = 1
+            pos = json_start + 1
+            while pos < len(content) and brace_count > 0:
+                if content[pos] == '{':
+                    brace_count += 1
+                elif content[pos] == '}':
+                    brace_count -= 1
+                pos += 1
+            
+            if brace_count == 0:  # We found a complete, balanced JSON object
+                json_str = content[json_start:pos]
                 # Don't strip f prefix from f-strings
                 processed_json = json_str
-                return json.loads(processed_json)
-        except Exception as e:
-            log(f"!! All JSON extraction methods failed: {e}")
-            
-        # If we got here, none of our approaches worked
-        log("!! Could not extract valid JSON from: " + content)
-        raise ValueError("No valid JSON object found in assistant's content")
-
-    except requests.exceptions.ConnectionError:
-        log("!! Ollama is not running on localhost:11434.")
-        print("!! Ollama is not running on localhost:11434. Please start it by running:")
-        print("ollama run deepseek-r1:32b")
+                parsed = json.loads(processed_json)
+                if parsed.get("action") == "run_code" and "code" in parsed:
+                    return parsed
+                else:
+                    log("! Parsed response was not valid 'run_code' format.")
+    except json.JSONDecodeError as e:
+        log(f"!! JSON parsing error with brace matching approach in generate_code_for_action: {e}", WARNING)
+    
+    # If that failed, try the regex approach
+    try:
+        match = re.search(r'(\{(?:[^{}]|(?:\{(?:[^{}]|(?:\{[^{}]*\}))*\}))*\})', content, re.DOTALL)
+        if match:
+            json_str = match.group(0).strip()
+            # Don't strip f prefix from f-strings
+            processed_json = json_str
+            parsed = json.loads(processed_json)
+            if parsed.get("action") == "run_code" and "code" in parsed:
+                return parsed
+            else:
+                log("! Parsed response was not valid 'run_code' format.")
+    except json.JSONDecodeError as e:
+        log(f"!! JSON parsing error with regex approach in generate_code_for_action: {e}", WARNING)
+    
+    # Final fallback - aggressively look for just the first JSON-like structure
+    try:
+        simple_match = re.search(r'\{.*?\}', content, re.DOTALL)
+        if simple_match:
+            json_str = simple_match.group(0)
+            # Don't strip f prefix from f-strings
+            processed_json = json_str
+            parsed = json.loads(processed_json)
+            if parsed.get("action") == "run_code" and "code" in parsed:
+                return parsed
     except Exception as e:
-        log(f"!! LLM Error: {e}")
-        print("!! LLM Error:", e)
+        log(f"!! All JSON extraction methods failed in generate_code_for_action: {e}", ERROR)
+
+    log("! No valid JSON object found in fallback code response.", ERROR)
+    raise ValueError("No valid run_code JSON object found in fallback code response")
+
+
+def _is_missing_model(error: Exception) -> bool:
+    response = getattr(error, "response", None)
+    return response is not None and getattr(response, "status_code", None) == 404
+
+
+def _repair_messages(messages: List[dict], content: str, intent: dict, errors: List[str]) -> List[dict]:
+    """The conversation so far plus a request to fix the intent's schema errors."""
+    action = intent.get("action")
+    return messages + [
+        {"role": "assistant", "content": content},
+        {"role": "user", "content": f"That is not a valid {action} intent: {'; '.join(errors)}. "
+                                    f"Reply with the corrected JSON object only, in the form {SCHEMAS.describe(action)}"},
+    ]
+
+
+def _route(call: str, messages: List[dict], extract: Callable[[str], dict], prompt: str,
+           cancellation: Optional[Cancellation] = None, long_reply: bool = False) -> dict:
+    """
+    Send a request to each of the router's models for the prompt in turn, until
+    one gives a reply the router accepts. The last model's reply is used
+    whatever it is, and its errors are raised.
+
+    An intent that doesn't fit its action's schema is first sent back to the
+    same model with the problems listed (RoutingPolicy.repair_attempts times).
+    The conversation prefix is unchanged, so Ollama reuses its cached prompt
+    evaluation and only the short corrected reply is generated.
+
+    Args:
+        call: "parse_prompt" or "generate_code", for spans, logs and metrics.
+        messages: The conversation.
+        extract: Turns the reply into the result; raises if it can't.
+        prompt: The user prompt, for the router's choice of models.
+    """
+    router = get_router()
+    tiers = router.tiers_for(prompt)
+    for position, tier in enumerate(tiers):
+        last = position == len(tiers) - 1
+        attempt = messages
+        repairs = router.policy.repair_attempts
+        result = None
+        while True:
+            repairing = attempt is not messages
+            data = _chat_request(attempt, tier.uses_json_format(JSON_FORMAT), long_reply and not repairing,
+                                 tier.model)
+            try:
+                content = _stream_chat(data, call, cancellation)
+                log(f"Reconstructed assistant content from {tier.model}: {content}", DEBUG)
+                with span(f"{call}.extract_json"):
+                    result = extract(content)
+            except LLMCancelled:
+                raise
+            except Exception as e:
+                if repairing and not _is_connection_error(e):
+                    # Keep the intent that needed fixing; the fix attempt went nowhere
+                    LLM_REPAIRS.inc(call=call, model=tier.model, result="failed")
+                    reason = "invalid_intent"
+                    break
+                if last or _is_connection_error(e):
+                    raise
+                if _is_missing_model(e):
+                    router.mark_unavailable(tier.model)
+                    reason = "missing_model"
+                else:
+                    reason = type(e).__name__
+                result = None
+                break
+            reason = router.escalation_reason(result)
+            if repairing:
+                LLM_REPAIRS.inc(call=call, model=tier.model, result="fixed" if reason is None else "failed")
+            if reason != "invalid_intent" or not repairs:
+                break
+            repairs -= 1
+            errors = SCHEMAS.validate(result)
+            log(f"Asking {tier.model} to fix its {call} intent ({'; '.join(errors)}): {prompt}")
+            attempt = _repair_messages(messages, content, result, errors)
+        if result is not None and (reason is None or last):
+            current = current_trace()
+            if current is not None:
+                current.set(model=tier.model)
+            return result
+        LLM_ESCALATIONS.inc(call=call, model=tier.model, reason=reason)
+        log(f"Escalating {call} from {tier.model} ({reason}): {prompt}")
+    raise AssertionError("unreachable: the last tier always returns or raises")
+
+
+def parse_prompt(prompt: str, cancellation: Optional[Cancellation] = None,
+                 examples: Optional[List[Tuple[str, dict]]] = None) -> dict:
+    """
+    Ask the LLM for the intent of a prompt.
+
+    Args:
+        prompt: The user prompt.
+        cancellation: Lets another thread abandon the request.
+        examples: (command, intent) pairs from the pattern store shown to the
+            model before the prompt.
+
+    Returns:
+        The intent, or {"action": "unknown"} if the LLM failed. A prompt asking
+        for several things gives a multi intent (see intents.intent_list).
+
+    Raises:
+        LLMCancelled: If the request was cancelled.
+    """
+    try:
+        log(f"Sending request to Ollama with prompt: {prompt}")
+        return _route("parse_prompt", intent_messages(prompt, examples), _extract_intents_json, prompt, cancellation)
+
+    except LLMCancelled:
+        log(f"Cancelled LLM request for: {prompt}")
+        raise
+    except Exception as e:
+        if _is_connection_error(e):
+            LLM_FAILURES.inc(call="parse_prompt", reason="connection")
+            log(f"!! Ollama is not running on {OLLAMA_URL}.", ERROR)
+            print(f"!! Ollama is not running on {OLLAMA_URL}. Please start it by running:")
+            print(f"ollama run {MODEL}")
+        else:
+            LLM_FAILURES.inc(call="parse_prompt", reason=type(e).__name__)
+            log(f"!! LLM Error: {e}", ERROR)
+            print("!! LLM Error:", e)
 
     return {"action": "unknown"}
 
@@ -117,89 +646,19 @@ def generate_code_for_action(intent: dict, user_prompt: str = "") -> dict:
     # Otherwise, ask Ollama to interpret the original user request dynamically
     prompt = "You are an operating system assistant. Your job is to generate valid Python code to fulfill this user's request. Return your response as a JSON object in this format: { \"action\": \"run_code\", \"code\": \"<python code here>\" }. DO NOT include any markdown or comments. DO NOT explain your response. Just return the raw JSON." + f" User request: {user_prompt}"
 
-    data = {
-        "model": "deepseek-r1:32b",
-        "messages": [
-            {"role": "system", "content": "You are a code-only agent that writes cross-platform Python scripts for OS tasks."},
-            {"role": "user", "content": prompt}
-        ]
-    }
+    messages = [
+        {"role": "system", "content": "You are a code-only agent that writes cross-platform Python scripts for OS tasks."},
+        {"role": "user", "content": prompt}
+    ]
 
     try:
         log(f"Asking Ollama to generate fallback code for unknown action: {intent}")
-        response = requests.post("http://localhost:11434/api/chat", json=data)
-        response.raise_for_status()
-
-        content_parts = []
-        for line in response.text.strip().splitlines():
-            try:
-                parsed_line = json.loads(line)
-                if "message" in parsed_line and "content" in parsed_line["message"]:
-                    content_parts.append(parsed_line["message"]["content"])
-            except Exception as e:
-                log(f"Skipping invalid JSON line: {e}")
-
-        full_content = "".join(content_parts)
-        log("LLM fallback code content (raw):\n" + full_content)
-
-        # Try the simplest approach first - find the outermost JSON object
-        try:
-            # Look for complete JSON objects with proper start/end structure
-            json_start = full_content.find('{')
-            if json_start != -1:
-                # Count braces to find the matching closing brace
-                brace_count = 1
-                pos = json_start + 1
-                while pos < len(full_content) and brace_count > 0:
-                    if full_content[pos] == '{':
-                        brace_count += 1
-                    elif full_content[pos] == '}':
-                        brace_count -= 1
-                    pos += 1
-                
-                if brace_count == 0:  # We found a complete, balanced JSON object
-                    json_str = full_content[json_start:pos]
-                    # Don't strip f prefix from f-strings
-                    processed_json = json_str
-                    parsed = json.loads(processed_json)
-                    if parsed.get("action") == "run_code" and "code" in parsed:
-                        return parsed
-                    else:
-                        log("! Parsed response was not valid 'run_code' format.")
-        except json.JSONDecodeError as e:
-            log(f"!! JSON parsing error with brace matching approach in generate_code_for_action: {e}")
-        
-        # If that failed, try the regex approach
-        try:
-            match = re.search(r'(\{(?:[^{}]|(?:\{(?:[^{}]|(?:\{[^{}]*\}))*\}))*\})', full_content, re.DOTALL)
-            if match:
-                json_str = match.group(0).strip()
-                # Don't strip f prefix from f-strings
-                processed_json = json_str
-                parsed = json.loads(processed_json)
-                if parsed.get("action") == "run_code" and "code" in parsed:
-                    return parsed
-                else:
-                    log("! Parsed response was not valid 'run_code' format.")
-        except json.JSONDecodeError as e:
-            log(f"!! JSON parsing error with regex approach in generate_code_for_action: {e}")
-        
-        # Final fallback - aggressively look for just the first JSON-like structure
-        try:
-            simple_match = re.search(r'\{.*?\}', full_content, re.DOTALL)
-            if simple_match:
-                json_str = simple_match.group(0)
-                # Don't strip f prefix from f-strings
-                processed_json = json_str
-                parsed = json.loads(processed_json)
-                if parsed.get("action") == "run_code" and "code" in parsed:
-                    return parsed
-        except Exception as e:
-            log(f"!! All JSON extraction methods failed in generate_code_for_action: {e}")
-        
-        log("! No valid JSON object found in fallback code response.")
-
+        return _route("generate_code", messages, _extract_code_json, user_prompt, long_reply=True)
+    except ValueError as e:
+        LLM_FAILURES.inc(call="generate_code", reason="invalid_json")
+        log(f"!! Failed to generate fallback code: {e}", ERROR)
     except Exception as e:
-        log(f"!! Failed to generate fallback code: {e}")
+        LLM_FAILURES.inc(call="generate_code", reason=type(e).__name__)
+        log(f"!! Failed to generate fallback code: {e}", ERROR)
 
     return {"action": "unknown"}
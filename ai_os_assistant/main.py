@@ -1,92 +1,106 @@
+import argparse
+from startup import StartupReport
 
-from llm_agent import parse_prompt
-from dispatcher import dispatch_command
-from command_store import CommandStore
-from utils import log
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="AI OS Assistant")
+    parser.add_argument("--metrics-port", type=int, default=None,
+                        help="Serve Prometheus metrics on http://127.0.0.1:PORT/metrics")
+    parser.add_argument("--fast-start", action="store_true",
+                        help="Show the prompt immediately and load the pattern library in the background")
+    parser.add_argument("--startup-report", action="store_true",
+                        help="Print how long each startup phase and import took")
+    parser.add_argument("--consolidate-interval", type=float, default=None,
+                        help="Merge similar stored commands into patterns every N seconds in the background")
+    parser.add_argument("--max-commands", type=int, default=None,
+                        help="Most raw commands to keep stored; the coldest ones are evicted")
+    parser.add_argument("--eviction", choices=["lfu", "lru"], default="lfu",
+                        help="Evict the least frequently or least recently used commands (default: %(default)s)")
+    parser.add_argument("--archive", default=None, help="Append evicted commands to this JSON-lines file")
+    parser.add_argument("--speculate", type=float, nargs="?", const=0.8, default=None, metavar="MIN_SCORE",
+                        help="Ask the LLM while slow similarity matching runs; matches scoring at least "
+                             "MIN_SCORE (default 0.8) cancel it")
+    parser.add_argument("--few-shot", type=int, default=0, metavar="N",
+                        help="Show the LLM the N most similar stored commands as examples")
+    parser.add_argument("--trace", action="store_true",
+                        help="Write per-prompt stage timings (including the prompt text) to ai_assistant_trace.jsonl")
+    parser.add_argument("--watch", action="store_true",
+                        help="Reload patterns other processes save as soon as the file changes")
+    return parser.parse_args(argv)
+
+def show_resolved(result):
+    """Tell the user where an intent came from before it runs."""
+    if result.source == "pattern":
+        # Show variables if any were extracted
+        if result.variables:
+            var_display = ", ".join([f"{k}='{v}'" for k, v in result.variables.items()])
+            print(f"🔍 Recognized command pattern in category '{result.category}' with variables: {var_display}")
+        else:
+            print(f"🔍 Recognized similar command in category '{result.category}'")
+    elif result.message:
+        print(result.message)
+
+def main(argv=None):
+    report = StartupReport()
+    args = parse_args(argv)
+
+    # The LLM client (requests) is not imported here; it loads on the first prompt
+    # that no stored pattern can answer
+    with report.phase("imports"), report.track_imports():
+        from assistant import Assistant, SpeculationPolicy
+        from command_store import CommandStore
+        from utils import log
+
+    if args.trace:
+        from tracing import set_tracing
+        set_tracing(True)
 
-def main():
     log("Assistant started.")
     print("AI OS Assistant. Type a command or 'exit' to quit.")
     print("Special commands:")
     print("  - 'store last': Store the last command as a pattern")
     print("  - 'no store': Execute the next command without storing it")
     print("  - 'clear patterns': Clear all stored command patterns")
-    
-    # Initialize the command store
-    command_store = CommandStore()
-    last_prompt = ""
-    last_intent = None
-    skip_next_store = False
 
-    while True:
-        prompt = input("> ")
-        if prompt.lower() in ["exit", "quit"]:
-            log("Assistant exited by user.")
-            break
-        
-        # Special command to store the last command as a pattern
-        if prompt.lower() == "store last":
-            if last_prompt and last_intent:
-                log(f"Storing command as pattern: {last_prompt}")
-                command_store.add_pattern(last_prompt, last_intent, store_command=True)
-                continue
-            else:
-                print("No previous command to store.")
-                continue
-        
-        # Special command to skip storing the next command
-        if prompt.lower() == "no store":
-            skip_next_store = True
-            print("Next command will not be stored as a pattern.")
-            continue
-        
-        # Special command to clear all patterns
-        if prompt.lower() == "clear patterns":
-            command_store.patterns = {}
-            command_store.save_patterns()
-            print("✅ All command patterns cleared.")
-            continue
+    # Initialize the assistant and its command store
+    with report.phase("command store" + (" (loading in background)" if args.fast_start else "")):
+        command_store = CommandStore(load_in_background=args.fast_start, capacity=args.max_commands,
+                                     eviction=args.eviction, archive_path=args.archive)
+    speculation = SpeculationPolicy(args.speculate) if args.speculate is not None else None
+    assistant = Assistant(command_store, on_resolved=show_resolved, speculation=speculation,
+                          few_shot=args.few_shot)
 
-        log(f"User prompt: {prompt}")
-        
-        # Check if the command matches a stored pattern
-        match_result = command_store.match_command(prompt)
-        
-        if match_result:
-            intent, variables = match_result
-            category = command_store.detect_category(prompt)
-            log(f"Matched command pattern in category '{category}'. Variables: {variables}")
-            
-            # Show variables if any were extracted
-            if variables:
-                var_display = ", ".join([f"{k}='{v}'" for k, v in variables.items()])
-                print(f"🔍 Recognized command pattern in category '{category}' with variables: {var_display}")
-            else:
-                print(f"🔍 Recognized similar command in category '{category}'")
-            
-            # Flag that this intent came from a pattern
-            from_pattern = True
-        else:
-            # No match found, use LLM to parse the prompt
-            intent = parse_prompt(prompt)
-            log(f"LLM returned intent: {intent}")
-            
-            # Store the command and intent for future use
-            last_prompt = prompt
-            last_intent = intent
-            
-            # Store all commands by default unless skipped
-            if not skip_next_store:
-                command_store.add_pattern(prompt, intent, store_command=True)
-            else:
-                print("Command not stored as requested.")
-                skip_next_store = False
-                
-            # Flag that this intent came from the LLM
-            from_pattern = False
-        
-        # Dispatch the command
-        dispatch_command(intent, prompt, from_pattern)
+    if args.metrics_port is not None:
+        # Imported here so the HTTP server code is only loaded when asked for
+        from metrics import start_metrics_server, watch_command_store
+        watch_command_store(assistant.command_store)
+        server = start_metrics_server(args.metrics_port)
+        print(f"Metrics available at http://127.0.0.1:{server.server_address[1]}/metrics")
+
+    if args.consolidate_interval:
+        from consolidate import Consolidator
+        Consolidator(command_store, interval=args.consolidate_interval).start()
+
+    if args.watch:
+        command_store.watch()
+
+    if args.startup_report:
+        if command_store.wait_until_loaded(0):
+            report.add("pattern library load", command_store.load_seconds)
+        print(report.render())
+
+    try:
+        while True:
+            prompt = input("> ")
+            result = assistant.handle(prompt)
+            if result.kind == "exit":
+                break
+            if result.kind == "special" and result.message:
+                print(result.message)
+    except (EOFError, KeyboardInterrupt):
+        print()
+    finally:
+        # Hits recorded since the last save would otherwise be lost
+        command_store.flush_usage()
 
 if __name__ == "__main__":
     main()
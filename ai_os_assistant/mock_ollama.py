@@ -0,0 +1,362 @@
+"""
+Offline stand-in for the Ollama /api/chat endpoint.
+
+Serves canned intent responses as NDJSON streams, the same way Ollama does, so
+parse_prompt, generate_code_for_action and the main loop can be exercised and
+benchmarked without a GPU or a model server.
+
+Usage:
+    python mock_ollama.py --port 11500 --token-delay 0.01 --think-tokens 200
+    OLLAMA_URL=http://127.0.0.1:11500 python main.py
+
+Responses are chosen by the first rule whose regex matches the last user
+message. String values in the rule's intent may refer to the regex's named
+groups with \\g<name>. Extra rules can be loaded from a JSON file:
+
+    [{"match": "(?i)delete (?P<filename>\\S+)", "intent": {"action": "run_code",
+      "code": "import os; os.remove('\\g<filename>')"}}]
+"""
+import argparse
+import json
+import random
+import re
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Optional
+
+DEFAULT_MODEL = "deepseek-r1:32b"
+
+# generate_code_for_action requests are recognised by their prompts rather than the user text
+CODE_REQUEST = re.compile(r"(?i)code-only agent|generate valid python code")
+CODE_INTENT = {"action": "run_code", "code": "print('generated by mock ollama')"}
+
+# Built-in rules, tried in order; the last one always matches
+DEFAULT_RULES = [
+    {"match": r"(?i)(?:create|make)\s+(?:a\s+|me\s+a\s+)?(?:new\s+)?file\s+(?:named|called)\s+(?P<filename>[\w\-.]+)",
+     "intent": {"action": "run_code", "code": "open('\\g<filename>', 'w').close()"}},
+    {"match": r"(?i)(?:open|browse|go|navigate).*?\b(?P<url>(?:https?://|www\.)[\w\-./]+|[\w\-]+\.(?:com|org|net|io|edu|gov))",
+     "intent": {"action": "run_code", "code": "import webbrowser; webbrowser.open('\\g<url>')"}},
+    {"match": r"(?i)(?:search for|look up|google)\s+(?P<query>.+)",
+     "intent": {"action": "run_code", "code": "import webbrowser; webbrowser.open('https://www.google.com/search?q=\\g<query>')"}},
+    {"match": r"(?i)sort .*files in (?P<directory>\S+)",
+     "intent": {"action": "sort_files", "directory": "\\g<directory>", "file_type": ".txt", "group_by": "month"}},
+    {"match": r"(?s).*",
+     "intent": {"action": "run_code", "code": "print('mock ollama default response')"}},
+]
+
+FAILURE_MODES = ("http500", "disconnect", "garbage", "stall")
+
+
+class MockConfig:
+    """Knobs for the simulated model."""
+
+    def __init__(self, token_delay: float = 0.0, first_token_delay: float = 0.0, think_tokens: int = 0,
+                 trailing_tokens: int = 0, chars_per_token: int = 4, fail_rate: float = 0.0, fail_mode: str = "http500",
+                 stall_seconds: float = 30.0, seed: Optional[int] = None, rules: Optional[List[dict]] = None,
+                 model: str = DEFAULT_MODEL, missing_models=(), unknown_models=()):
+        self.token_delay = token_delay
+        self.first_token_delay = first_token_delay
+        self.think_tokens = think_tokens
+        self.trailing_tokens = trailing_tokens
+        self.chars_per_token = max(1, chars_per_token)
+        self.fail_rate = fail_rate
+        self.fail_mode = fail_mode
+        self.stall_seconds = stall_seconds
+        self.model = model
+        # Models answered with Ollama's 404 "model not found"
+        self.missing_models = set(missing_models)
+        # Models that answer every prompt with {"action": "unknown"}, like a weak model would
+        self.unknown_models = set(unknown_models)
+        self.rules = [(re.compile(rule["match"]), rule["intent"]) for rule in (rules or []) + DEFAULT_RULES]
+        self._random = random.Random(seed)
+        self._random_lock = threading.Lock()
+
+    def should_fail(self) -> bool:
+        if self.fail_rate <= 0:
+            return False
+        with self._random_lock:
+            return self._random.random() < self.fail_rate
+
+
+class MockStats:
+    def __init__(self):
+        self.requests = 0
+        self.failures = 0
+        self.tokens = 0
+        self._lock = threading.Lock()
+
+    def add(self, requests: int = 0, failures: int = 0, tokens: int = 0):
+        with self._lock:
+            self.requests += requests
+            self.failures += failures
+            self.tokens += tokens
+
+    def to_dict(self) -> dict:
+        return {"requests": self.requests, "failures": self.failures, "tokens": self.tokens}
+
+
+def render_intent(rules, text: str) -> dict:
+    """Build the intent for a user message from the first matching rule."""
+    for regex, intent in rules:
+        match = regex.search(text)
+        if match:
+            return {key: match.expand(value) if isinstance(value, str) else value for key, value in intent.items()}
+    return {"action": "unknown"}
+
+
+def build_reply(config: MockConfig, messages: List[dict], json_format: bool = False) -> str:
+    """
+    Full assistant reply: optional <think> preamble, the intent JSON and
+    optional chatter after it. With json_format (Ollama's "format": "json")
+    the reply is the JSON alone.
+    """
+    if any(CODE_REQUEST.search(str(m.get("content", ""))) for m in messages):
+        intent = CODE_INTENT
+    else:
+        user_text = next((str(m.get("content", "")) for m in reversed(messages) if m.get("role") == "user"), "")
+        intent = render_intent(config.rules, user_text)
+    reply = json.dumps(intent)
+    if json_format:
+        return reply
+    if config.trailing_tokens:
+        reply += "\n\nThis intent " + " ".join("explained" for _ in range(config.trailing_tokens))
+    if config.think_tokens:
+        thinking = " ".join("reasoning" for _ in range(config.think_tokens))
+        reply = f"<think>\n{thinking}\n</think>\n\n{reply}"
+    return reply
+
+
+def split_tokens(text: str, chars_per_token: int) -> List[str]:
+    return [text[i:i + chars_per_token] for i in range(0, len(text), chars_per_token)]
+
+
+class _ChatHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    @property
+    def config(self) -> MockConfig:
+        return self.server.config
+
+    def do_GET(self):
+        if self.path == "/api/tags":
+            self._send_json({"models": [{"name": self.config.model, "model": self.config.model}]})
+        elif self.path == "/mock/stats":
+            self._send_json(self.server.stats.to_dict())
+        else:
+            self.send_error(404)
+
+    def do_POST(self):
+        if self.path != "/api/chat":
+            self.send_error(404)
+            return
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            request = json.loads(self.rfile.read(length) or b"{}")
+        except json.JSONDecodeError:
+            self.send_error(400, "invalid JSON body")
+            return
+
+        self.server.stats.add(requests=1)
+        self.server.last_request = request
+        messages = request.get("messages", [])
+        model = request.get("model", self.config.model)
+
+        if model in self.config.missing_models:
+            self._send_json({"error": f"model '{model}' not found"}, status=404)
+            return
+
+        if not messages:
+            # Ollama loads the model and answers at once
+            self._send_json(self._chunk(model, "", done=True))
+            return
+
+        if self.config.should_fail():
+            self.server.stats.add(failures=1)
+            self._fail(self.config.fail_mode)
+            return
+
+        if model in self.config.unknown_models:
+            reply = json.dumps({"action": "unknown"})
+        else:
+            reply = build_reply(self.config, messages, request.get("format") == "json")
+        options = request.get("options") or {}
+        for stop in options.get("stop") or ():
+            if stop in reply:
+                reply = reply[:reply.index(stop)]
+        tokens = split_tokens(reply, self.config.chars_per_token)
+        if options.get("num_predict", -1) >= 0:
+            tokens = tokens[:options["num_predict"]]
+        self.server.stats.add(tokens=len(tokens))
+
+        if self.config.first_token_delay:
+            time.sleep(self.config.first_token_delay)
+
+        if request.get("stream", True) is False:
+            time.sleep(self.config.token_delay * len(tokens))
+            self._send_json(self._chunk(model, reply, done=True, eval_count=len(tokens)))
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            for token in tokens:
+                if self.config.token_delay:
+                    time.sleep(self.config.token_delay)
+                self._write_chunk(json.dumps(self._chunk(model, token)) + "\n")
+            self._write_chunk(json.dumps(self._chunk(model, "", done=True, eval_count=len(tokens))) + "\n")
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            # The client cancelled the request, which is allowed mid-stream
+            pass
+
+    def _chunk(self, model: str, content: str, done: bool = False, eval_count: int = 0) -> dict:
+        chunk = {
+            "model": model,
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "message": {"role": "assistant", "content": content},
+            "done": done,
+        }
+        if done:
+            chunk["done_reason"] = "stop"
+            chunk["eval_count"] = eval_count
+        return chunk
+
+    def _write_chunk(self, text: str):
+        data = text.encode("utf-8")
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def _send_json(self, payload: dict, status: int = 200):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _fail(self, mode: str):
+        if mode == "disconnect":
+            self.close_connection = True
+            self.connection.close()
+        elif mode == "garbage":
+            body = b"this is not json\n{\"message\": {\"content\": \"no closing brace\"\n"
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        elif mode == "stall":
+            time.sleep(self.config.stall_seconds)
+            self.send_error(504, "mock stall")
+        else:
+            self.send_error(500, "mock failure")
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _MockHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients close streams early on purpose (cancelled speculative calls,
+        # stopping once the intent JSON is complete); only report other errors
+        if not isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+            super().handle_error(request, client_address)
+
+
+class MockOllamaServer:
+    """
+    Run the stand-in server on a background thread.
+
+    Example:
+        with MockOllamaServer(MockConfig(token_delay=0.01)) as server:
+            os.environ["OLLAMA_URL"] = server.url
+    """
+
+    def __init__(self, config: Optional[MockConfig] = None, host: str = "127.0.0.1", port: int = 0):
+        self.config = config or MockConfig()
+        self.stats = MockStats()
+        self._server = _MockHTTPServer((host, port), _ChatHandler)
+        self._server.config = self.config
+        self._server.stats = self.stats
+        self._server.last_request = None
+        self._thread = None
+
+    @property
+    def last_request(self) -> Optional[dict]:
+        """Body of the most recent chat request."""
+        return self._server.last_request
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "MockOllamaServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, name="mock-ollama", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def add_mock_arguments(parser: argparse.ArgumentParser):
+    """Register the simulated-model options on another script's parser."""
+    parser.add_argument("--token-delay", type=float, default=0.0, help="Seconds between streamed tokens")
+    parser.add_argument("--first-token-delay", type=float, default=0.0,
+                        help="Seconds before the first token (prompt evaluation / model load)")
+    parser.add_argument("--think-tokens", type=int, default=0, help="Length of the <think> preamble in words")
+    parser.add_argument("--trailing-tokens", type=int, default=0,
+                        help="Words of explanation after the intent JSON")
+    parser.add_argument("--chars-per-token", type=int, default=4)
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="Fraction of requests that fail (0-1)")
+    parser.add_argument("--fail-mode", choices=FAILURE_MODES, default="http500")
+    parser.add_argument("--responses", help="JSON file with extra response rules")
+    parser.add_argument("--seed", type=int, default=None, help="Seed for failure injection")
+
+
+def config_from_args(args) -> MockConfig:
+    rules = None
+    if args.responses:
+        with open(args.responses, encoding="utf-8") as f:
+            rules = json.load(f)
+    return MockConfig(token_delay=args.token_delay, first_token_delay=args.first_token_delay,
+                      think_tokens=args.think_tokens, trailing_tokens=args.trailing_tokens,
+                      chars_per_token=args.chars_per_token,
+                      fail_rate=args.fail_rate, fail_mode=args.fail_mode, seed=args.seed, rules=rules)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline stand-in for the Ollama chat API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11500)
+    add_mock_arguments(parser)
+    args = parser.parse_args(argv)
+
+    server = MockOllamaServer(config_from_args(args), args.host, args.port)
+    print(f"Mock Ollama listening on {server.url} (set OLLAMA_URL={server.url})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
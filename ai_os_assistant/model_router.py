@@ -0,0 +1,130 @@
+"""
+Tiered model routing for LLM requests.
+
+Most prompts are simple file and URL intents a small instruct model answers in
+a fraction of the time a 32B reasoning model takes. The router sends each
+request to the first (smallest) model and moves on to the next one only when
+the answer can't be used: the JSON is missing or malformed, the action is
+unknown, the intent doesn't fit its action's schema (intents.py), generated
+code doesn't compile, or the model isn't installed. An intent that only misses
+its schema is first sent back to the same model with the problems listed,
+which costs a short reply rather than a bigger model.
+
+The model list comes from OLLAMA_MODELS (comma-separated, smallest first), e.g.
+
+    OLLAMA_MODELS=qwen2.5-coder:7b,deepseek-r1:32b python main.py
+
+and defaults to SMALL_MODEL then the large llm_agent.MODEL.
+"""
+import ast
+import os
+import threading
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+from intents import SCHEMAS, intent_list
+
+# Fast model tried first
+SMALL_MODEL = "qwen2.5-coder:7b"
+
+# Models whose replies start with a <think> section. They are only sent
+# "format": "json" if asked for (OLLAMA_JSON_FORMAT), since it suppresses the section
+REASONING_MODELS = ("deepseek-r1", "qwq", "qwen3")
+
+
+def is_reasoning_model(model: str) -> bool:
+    return model.startswith(REASONING_MODELS)
+
+
+@dataclass
+class ModelTier:
+    model: str
+    # Send "format": "json"; None for on, except for reasoning models
+    json_format: Optional[bool] = None
+    # Prompts with more words than this skip the tier, as too complex for it
+    max_prompt_words: Optional[int] = None
+
+    def uses_json_format(self, for_reasoning: bool = False) -> bool:
+        """
+        Args:
+            for_reasoning: The choice for reasoning models when json_format is None.
+        """
+        if self.json_format is not None:
+            return self.json_format
+        return for_reasoning if is_reasoning_model(self.model) else True
+
+
+@dataclass
+class RoutingPolicy:
+    """Which models to try, in order, and when to move on to the next one."""
+    tiers: List[ModelTier] = field(default_factory=list)
+    # Move on when the model answers with an unknown action (or {"action": "unknown"})
+    escalate_unknown: bool = True
+    # Move on when run_code's code is not valid Python
+    check_code: bool = True
+    # Times to ask the same model to fix an intent that doesn't fit its schema
+    repair_attempts: int = 1
+
+
+def default_policy(large_model: str) -> RoutingPolicy:
+    """The policy for OLLAMA_MODELS, or SMALL_MODEL for short prompts then large_model."""
+    models = [name.strip() for name in os.environ.get("OLLAMA_MODELS", "").split(",") if name.strip()]
+    if models:
+        return RoutingPolicy([ModelTier(model) for model in models])
+    return RoutingPolicy([ModelTier(SMALL_MODEL, max_prompt_words=40), ModelTier(large_model)])
+
+
+class ModelRouter:
+    """
+    Pick the models for a request and decide when an answer needs a bigger one.
+
+    Models Ollama reports as missing are skipped for the rest of the session.
+    """
+
+    def __init__(self, policy: RoutingPolicy):
+        if not policy.tiers:
+            raise ValueError("a routing policy needs at least one model")
+        self.policy = policy
+        self._unavailable = set()
+        self._lock = threading.Lock()
+
+    def tiers_for(self, prompt: str) -> List[ModelTier]:
+        """The tiers to try for a prompt, in order. The last tier is always included."""
+        words = len(prompt.split())
+        *smaller, last = self.policy.tiers
+        with self._lock:
+            unavailable = set(self._unavailable)
+        tiers = [tier for tier in smaller
+                 if tier.model not in unavailable
+                 and (tier.max_prompt_words is None or words <= tier.max_prompt_words)]
+        return tiers + [last]
+
+    def mark_unavailable(self, model: str):
+        with self._lock:
+            self._unavailable.add(model)
+
+    def escalation_reason(self, intent: dict) -> Optional[str]:
+        """Why an intent isn't good enough to use, or None if it is. Each step of a multi intent is checked."""
+        if not isinstance(intent, dict):
+            return "not_an_object"
+        steps = [step for step in intent_list(intent) if isinstance(step, dict)]
+        if self.policy.escalate_unknown and not all(self._known(step.get("action")) for step in steps):
+            return "unknown_action"
+        if SCHEMAS.validate(intent):
+            return "invalid_intent"
+        if self.policy.check_code:
+            for step in steps:
+                if step.get("action") == "run_code":
+                    try:
+                        ast.parse(step["code"])
+                    except SyntaxError:
+                        return "invalid_code"
+        return None
+
+    @staticmethod
+    def _known(action) -> bool:
+        if action in SCHEMAS:
+            return True
+        # Plugin actions are known once the plugins are loaded (on the first unknown action)
+        from dispatcher import ACTIONS
+        return isinstance(action, str) and ACTIONS.get(action) is not None
@@ -0,0 +1,270 @@
+"""
+Token trie over the placeholder patterns of one category.
+
+Each pattern is split into whitespace-separated words. Literal words are trie
+edges keyed by their lower-cased text; a word holding a {var} placeholder is a
+wildcard edge that captures one or more command words, with an optional literal
+prefix and suffix ("'{name}'" or "{folder}/"). Patterns that share a prefix such
+as "Create a file named" share the nodes for it, so a command is walked once
+for the whole category instead of being tried against one regex per pattern.
+
+Matching follows the regexes the patterns replace: case-insensitive, any
+whitespace between words, and each placeholder takes the shortest span that
+lets the rest of the pattern match. Patterns the trie can't represent (two
+placeholders in one word) are kept aside and matched with their regex.
+"""
+import re
+from typing import Dict, List, Optional, Tuple
+
+from intents import validate_intent
+from patterns import Pattern
+from utils import log, WARNING
+
+_WORD = re.compile(r"\S+")
+_WHITESPACE = re.compile(r"\s+")
+
+
+class _Node:
+    __slots__ = ("children", "wildcards", "terminals")
+
+    def __init__(self):
+        # lower-cased literal word -> node
+        self.children = {}
+        # (prefix, suffix) -> node, prefix and suffix lower-cased
+        self.wildcards = {}
+        # (priority, order, pattern, variable names in capture order) for patterns ending here
+        self.terminals = []
+
+
+def _pattern_words(pattern: Pattern) -> Optional[List[tuple]]:
+    """
+    Split a pattern into ("literal", text) and ("wildcard", prefix, name, suffix)
+    words, or None if a word holds more than one placeholder.
+    """
+    words = [[]]
+    for is_placeholder, text in pattern.segments:
+        if is_placeholder:
+            words[-1].append((True, text))
+            continue
+        chunks = _WHITESPACE.split(text)
+        words[-1].append((False, chunks[0]))
+        for chunk in chunks[1:]:
+            words.append([(False, chunk)])
+
+    result = []
+    for parts in words:
+        placeholders = [i for i, (is_placeholder, _) in enumerate(parts) if is_placeholder]
+        if not placeholders:
+            literal = "".join(text for _, text in parts)
+            if literal:
+                result.append(("literal", literal.lower()))
+        elif len(placeholders) == 1:
+            i = placeholders[0]
+            prefix = "".join(text for _, text in parts[:i]).lower()
+            suffix = "".join(text for _, text in parts[i + 1:]).lower()
+            result.append(("wildcard", prefix, parts[i][1], suffix))
+        else:
+            return None
+    return result
+
+
+class PatternTrie:
+    """
+    Match a command against every placeholder pattern of a category in one walk.
+
+    When several patterns match, the one with the most literal text wins (it is
+    the more specific pattern); ties go to the most used pattern, then to the
+    one stored first.
+    """
+
+    def __init__(self):
+        self.root = _Node()
+        self.size = 0
+        # Patterns with several placeholders in one word, matched by regex
+        self.fallback = []
+
+    def add(self, pattern: Pattern):
+        order = self.size
+        self.size += 1
+        words = _pattern_words(pattern)
+        if words is None:
+            priority = sum(len(text) for is_placeholder, text in pattern.segments if not is_placeholder)
+            self.fallback.append((priority, order, pattern))
+            return
+
+        node = self.root
+        names = []
+        priority = 0
+        for word in words:
+            if word[0] == "literal":
+                priority += len(word[1])
+                if word[1] not in node.children:
+                    node.children[word[1]] = _Node()
+                node = node.children[word[1]]
+            else:
+                _, prefix, name, suffix = word
+                priority += len(prefix) + len(suffix)
+                key = (prefix, suffix)
+                if key not in node.wildcards:
+                    node.wildcards[key] = _Node()
+                node = node.wildcards[key]
+                names.append(name)
+        node.terminals.append((priority, order, pattern, tuple(names)))
+
+    def __len__(self):
+        return self.size
+
+    def match_all(self, command: str) -> List[Tuple[Pattern, Dict[str, str]]]:
+        """
+        Every pattern that matches the command, best first, with the variables
+        each of them extracts.
+        """
+        words = [(m.group().lower(), m.start(), m.end()) for m in _WORD.finditer(command)]
+        found = {}
+        self._walk(self.root, words, 0, [], command, found)
+
+        for priority, order, pattern in self.fallback:
+            match = pattern.regex().match(command)
+            if match:
+                found[order] = (priority, order, pattern, match.groupdict())
+
+        ranked = sorted(found.values(), key=lambda item: (-item[0], -item[2].hits, item[1]))
+        return [(pattern, variables) for _, _, pattern, variables in ranked]
+
+    def match(self, command: str) -> Optional[Tuple[Pattern, Dict[str, str]]]:
+        """The best matching pattern and its variables, or None."""
+        matches = self.match_all(command)
+        return matches[0] if matches else None
+
+    def _walk(self, node: _Node, words: list, i: int, spans: list, command: str, found: dict):
+        if i == len(words):
+            for priority, order, pattern, names in node.terminals:
+                # The first match found for a pattern has the shortest early captures
+                if order not in found:
+                    variables = {}
+                    for name, (start, end) in zip(names, spans):
+                        variables[name] = command[start:end]
+                    found[order] = (priority, order, pattern, variables)
+            return
+
+        word, word_start, _ = words[i]
+        child = node.children.get(word)
+        if child is not None:
+            self._walk(child, words, i + 1, spans, command, found)
+
+        for (prefix, suffix), child in node.wildcards.items():
+            if not word.startswith(prefix):
+                continue
+            start = word_start + len(prefix)
+            for j in range(i, len(words)):
+                last_word, _, last_end = words[j]
+                end = last_end - len(suffix)
+                if end <= start or not last_word.endswith(suffix):
+                    continue
+                spans.append((start, end))
+                self._walk(child, words, j + 1, spans, command, found)
+                spans.pop()
+
+
+def _rank_key(pattern: Pattern) -> Tuple[int, float]:
+    return -pattern.hits, -pattern.last_used
+
+
+def _rank_position(ranked: List[Pattern], key: Tuple[int, float], low: int, high: int,
+                   moved: Optional[Pattern] = None) -> int:
+    """
+    The first position in ranked[low:high] whose key isn't less than key
+    (bisect_left). `moved` is ranked by `key` itself, since its usage has
+    already changed.
+    """
+    while low < high:
+        middle = (low + high) // 2
+        if ranked[middle] is not moved and _rank_key(ranked[middle]) < key:
+            low = middle + 1
+        else:
+            high = middle
+    return low
+
+
+class CategoryIndex:
+    """
+    Lookup structures for one category's pattern list: the trie of placeholder
+    patterns, a dict of raw commands for exact matches, and the patterns with a
+    stored command to compare for similarity, most used first.
+
+    The index remembers which list it was built from and how much of it; sync()
+    adds patterns appended since then and rebuilds if the list was replaced or
+    shortened. Patterns whose intent template doesn't fit its action's schema
+    are left out (and kept in `invalid`), so a match never yields an intent
+    the dispatcher can't run.
+    """
+
+    def __init__(self, patterns: List[Pattern]):
+        self.source = patterns
+        self.indexed = 0
+        self.trie = PatternTrie()
+        self.exact = {}
+        # Patterns with a raw or example command, in stored order
+        self.similar = []
+        self.invalid = []
+        self._ranked = None
+        self.sync(patterns)
+
+    def is_current(self, patterns: List[Pattern]) -> bool:
+        return patterns is self.source and len(patterns) == self.indexed
+
+    def sync(self, patterns: List[Pattern]) -> "CategoryIndex":
+        if patterns is not self.source or len(patterns) < self.indexed:
+            return CategoryIndex(patterns)
+        for pattern in patterns[self.indexed:]:
+            errors = validate_intent(pattern.intent_template)
+            if errors:
+                self.invalid.append(pattern)
+                log(f"Ignoring stored pattern '{pattern.key}' ({'; '.join(errors)})", WARNING)
+                continue
+            if pattern.variables:
+                self.trie.add(pattern)
+            if pattern.command_key is not None:
+                # The first stored copy of a command wins, as in a linear scan
+                self.exact.setdefault(pattern.command_key, pattern)
+            if pattern.raw_command is not None or pattern.example_command is not None:
+                self.similar.append(pattern)
+                self._ranked = None
+        self.indexed = len(patterns)
+        return self
+
+    def usage_changed(self):
+        """Re-rank the similarity candidates on next use, after usage changed in bulk (e.g. a reload)."""
+        self._ranked = None
+
+    def used(self, pattern: Pattern, hits: int, last_used: float):
+        """
+        Move a pattern that was just used up the ranking, rather than re-sorting
+        every candidate on the next similarity match.
+
+        Args:
+            pattern: The pattern, with its usage already updated.
+            hits: Its hit count before the use.
+            last_used: Its last use before this one.
+        """
+        ranked = self._ranked
+        if ranked is None:
+            return
+        previous = (-hits, -last_used)
+        old = _rank_position(ranked, previous, 0, len(ranked), pattern)
+        # Candidates with the same usage sit together; find this one among them
+        while old < len(ranked) and ranked[old] is not pattern:
+            if _rank_key(ranked[old]) != previous:
+                return
+            old += 1
+        if old == len(ranked):
+            return
+        del ranked[old]
+        ranked.insert(_rank_position(ranked, _rank_key(pattern), 0, old), pattern)
+
+    def ranked(self) -> List[Pattern]:
+        """Similarity candidates by hits, then most recent use, then stored order."""
+        if self._ranked is None:
+            # sorted() is stable, so patterns with equal usage keep their stored order
+            self._ranked = sorted(self.similar, key=_rank_key)
+        return self._ranked
@@ -0,0 +1,217 @@
+import re
+import sys
+from types import MappingProxyType
+from typing import Dict, List, Optional, Tuple
+
+from templates import compile_template
+
+# Keys Pattern knows about; anything else in the file is kept as is
+_KNOWN_KEYS = frozenset(("pattern", "intent_template", "variables", "example_command", "raw_command", "hits",
+                         "last_used"))
+
+
+# JSON values that are already immutable
+_SCALARS = (str, int, float, bool, type(None))
+
+
+def freeze(value):
+    """Return a read-only copy of a JSON value (dicts become mapping proxies, lists tuples)."""
+    if isinstance(value, dict):
+        return MappingProxyType({key: item if type(item) in _SCALARS else freeze(item)
+                                 for key, item in value.items()})
+    if isinstance(value, (list, tuple)):
+        return tuple(item if type(item) in _SCALARS else freeze(item) for item in value)
+    return value
+
+
+def thaw(value):
+    """Return a mutable copy of a value produced by freeze()."""
+    if isinstance(value, MappingProxyType):
+        return {key: thaw(item) for key, item in value.items()}
+    if isinstance(value, tuple):
+        return [thaw(item) for item in value]
+    return value
+
+
+def normalize_command(command: str) -> str:
+    """Lower-case a command and collapse its whitespace, for exact comparisons."""
+    return " ".join(command.lower().split())
+
+
+class Pattern:
+    """
+    One stored command pattern.
+
+    The pattern text is split into literal and placeholder segments once, so the
+    regex used for matching is built without rescanning the pattern; the regex
+    itself is compiled on the first match attempt, which keeps loading a large
+    library cheap. The intent template is frozen because every match renders a
+    fresh intent from it, through a renderer compiled on the first match.
+    """
+
+    __slots__ = ("category", "pattern", "variables", "intent_template", "example_command", "raw_command",
+                 "hits", "last_used", "tokens", "command_key", "segments", "extra", "_regex", "_flexible_regex", "_renderer")
+
+    def __init__(self, category: str, pattern: str, intent_template: dict, variables=(),
+                 example_command: Optional[str] = None, raw_command: Optional[str] = None,
+                 extra: Optional[dict] = None, hits: int = 0, last_used: float = 0.0):
+        self.category = sys.intern(category)
+        self.pattern = pattern
+        self.variables = tuple(sys.intern(name) for name in variables)
+        self.intent_template = freeze(intent_template)
+        self.example_command = example_command
+        self.raw_command = raw_command
+        # Times the pattern was used, including the commands merged into it
+        self.hits = hits
+        # time.time() of the last match (or of when the command was stored); 0 if never
+        self.last_used = last_used
+        self.tokens = tuple(pattern.lower().split())
+        self.command_key = normalize_command(raw_command) if raw_command else None
+        self.segments = self._split_segments(pattern, self.variables)
+        self.extra = extra or None
+        self._regex = None
+        self._flexible_regex = None
+        self._renderer = None
+
+    @staticmethod
+    def _split_segments(pattern: str, variables: Tuple[str, ...]) -> Tuple[Tuple[bool, str], ...]:
+        """
+        Split the pattern into (is_placeholder, text) segments. Only the first
+        occurrence of each variable's placeholder captures; later ones are literal.
+        """
+        if not variables:
+            return ((False, pattern),)
+        positions = []
+        for name in dict.fromkeys(variables):
+            start = pattern.find(f"{{{name}}}")
+            if start != -1:
+                positions.append((start, name))
+        segments = []
+        cursor = 0
+        for start, name in sorted(positions):
+            if start < cursor:
+                # Overlaps a placeholder that was already taken
+                continue
+            if start > cursor:
+                segments.append((False, pattern[cursor:start]))
+            segments.append((True, name))
+            cursor = start + len(name) + 2
+        if cursor < len(pattern):
+            segments.append((False, pattern[cursor:]))
+        return tuple(segments)
+
+    @classmethod
+    def from_dict(cls, category: str, data: dict) -> "Pattern":
+        extra = None
+        if not data.keys() <= _KNOWN_KEYS:
+            extra = {key: value for key, value in data.items() if key not in _KNOWN_KEYS}
+        raw_command = data.get("raw_command")
+        return cls(category, data.get("pattern") or raw_command or "", data.get("intent_template") or {},
+                   data.get("variables") or (), data.get("example_command"), raw_command, extra,
+                   data.get("hits", 0), data.get("last_used", 0.0))
+
+    def to_dict(self, usage: bool = True) -> dict:
+        """
+        The JSON form of the pattern.
+
+        Args:
+            usage: Include hits and last use. command_patterns.json leaves them
+                out; they are kept in a side file (see CommandStore).
+        """
+        data = {
+            "pattern": self.pattern,
+            "intent_template": thaw(self.intent_template),
+            "variables": list(self.variables),
+        }
+        if self.example_command is not None:
+            data["example_command"] = self.example_command
+        if self.raw_command is not None:
+            data["raw_command"] = self.raw_command
+        if usage and self.hits:
+            data["hits"] = self.hits
+        if usage and self.last_used:
+            data["last_used"] = self.last_used
+        if self.extra:
+            data.update(self.extra)
+        return data
+
+    def record_use(self, when: float):
+        self.hits += 1
+        self.last_used = when
+    
+    def merge_usage(self, other: "Pattern") -> bool:
+        """Keep the higher hit count and the later use of two copies of a pattern; True if either changed."""
+        if other.hits <= self.hits and other.last_used <= self.last_used:
+            return False
+        self.hits = max(self.hits, other.hits)
+        self.last_used = max(self.last_used, other.last_used)
+        return True
+    
+    def same_content(self, other: "Pattern") -> bool:
+        """Whether two patterns match and render the same, whatever their usage."""
+        return (self.category == other.category and self.pattern == other.pattern
+                and self.variables == other.variables and self.intent_template == other.intent_template
+                and self.example_command == other.example_command and self.raw_command == other.raw_command
+                and self.extra == other.extra)
+    
+    @property
+    def key(self) -> str:
+        """Identity of the pattern, used to merge libraries written by different processes."""
+        return self.pattern or self.raw_command
+
+    def regex(self, flexible: bool = True) -> "re.Pattern":
+        """
+        The compiled regex for the pattern, with one named group per placeholder.
+
+        Args:
+            flexible: Match case-insensitively and allow any whitespace between words.
+        """
+        compiled = self._flexible_regex if flexible else self._regex
+        if compiled is None:
+            parts = []
+            for is_placeholder, text in self.segments:
+                if is_placeholder:
+                    parts.append(f"(?P<{text}>.+?)")
+                else:
+                    literal = re.escape(text)
+                    # Allow any whitespace between words
+                    parts.append(literal.replace("\\ ", r"\s+") if flexible else literal)
+            compiled = re.compile("^" + "".join(parts) + "$", re.IGNORECASE if flexible else 0)
+            if flexible:
+                self._flexible_regex = compiled
+            else:
+                self._regex = compiled
+        return compiled
+
+    def render_intent(self, variables: Dict[str, str]) -> dict:
+        """Return a new intent with the extracted variables filled into the template."""
+        if self._renderer is None:
+            self._renderer = compile_template(self.intent_template, self.variables)
+        return self._renderer(variables)
+
+    def __eq__(self, other):
+        if not isinstance(other, Pattern):
+            return NotImplemented
+        return self.category == other.category and self.to_dict() == other.to_dict()
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"Pattern({self.category!r}, {self.pattern!r})"
+
+
+def same_patterns(first: List[Pattern], second: List[Pattern]) -> bool:
+    """Whether two pattern lists differ only in usage (hits and last use)."""
+    return len(first) == len(second) and all(a.same_content(b) for a, b in zip(first, second))
+
+
+def load_library(data: dict) -> Dict[str, List[Pattern]]:
+    """Convert the JSON pattern library ({category: [dict, ...]}) to Pattern records."""
+    return {sys.intern(category): [entry if isinstance(entry, Pattern) else Pattern.from_dict(category, entry)
+                                   for entry in entries]
+            for category, entries in data.items()}
+
+
+def dump_library(library: Dict[str, List[Pattern]], usage: bool = True) -> dict:
+    """Convert Pattern records back to the JSON pattern library, with or without their usage."""
+    return {category: [entry.to_dict(usage) for entry in entries] for category, entries in library.items()}
@@ -0,0 +1,76 @@
+import builtins
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+
+class StartupReport:
+    """
+    Timing of the assistant's startup phases and of the modules it imports.
+
+    The import table is the same idea as `python -X importtime`, limited to
+    modules loaded for the first time inside track_imports().
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = []
+        self.imports = []
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.perf_counter() - start))
+
+    def add(self, name: str, seconds: float):
+        self.phases.append((name, seconds))
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    @contextmanager
+    def track_imports(self):
+        """Record how long each newly imported module takes, including its own imports."""
+        original_import = builtins.__import__
+        main_thread = threading.get_ident()
+        depth = [0]
+
+        def timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+            if level != 0 or name in sys.modules or threading.get_ident() != main_thread:
+                return original_import(name, globals, locals, fromlist, level)
+            index = len(self.imports)
+            self.imports.append(None)
+            depth[0] += 1
+            start = time.perf_counter()
+            try:
+                return original_import(name, globals, locals, fromlist, level)
+            finally:
+                depth[0] -= 1
+                self.imports[index] = (depth[0], name, time.perf_counter() - start)
+
+        builtins.__import__ = timed_import
+        try:
+            yield
+        finally:
+            builtins.__import__ = original_import
+
+    def render(self, max_imports: int = 25) -> str:
+        lines = ["Startup timing (ms):"]
+        for name, seconds in self.phases:
+            lines.append(f"  {seconds * 1000:9.1f}  {name}")
+        lines.append(f"  {self.elapsed() * 1000:9.1f}  total until now")
+
+        imports = [record for record in self.imports if record is not None]
+        if imports:
+            lines.append("Imports (cumulative ms | module):")
+            # Keep the tree order but drop the cheapest modules
+            keep = {id(r) for r in sorted(imports, key=lambda r: r[2], reverse=True)[:max_imports]}
+            for record in imports:
+                if id(record) in keep:
+                    record_depth, name, seconds = record
+                    lines.append(f"  {seconds * 1000:9.1f} | {'  ' * record_depth}{name}")
+        return "\n".join(lines)
@@ -0,0 +1,114 @@
+"""
+Intent templates: intents with {name} placeholders for a pattern's variables.
+
+A template is compiled once into nested render functions, so filling it in is a
+single pass that never rescans text already substituted; a value containing
+"{name}" (common in generated f-string code) stays as it is. Only the pattern's
+own variable names are placeholders, and a literal "{name}" for one of those
+names is written "{{name}}" in the stored template.
+"""
+import re
+from types import MappingProxyType
+from typing import Callable, Dict, Iterable, Tuple
+
+Renderer = Callable[[Dict[str, str]], object]
+
+
+class _Placeholder:
+    __slots__ = ("name", "text")
+
+    def __init__(self, name: str):
+        self.name = name
+        # Rendered as is when the variable has no value (exact and fuzzy matches)
+        self.text = f"{{{name}}}"
+
+
+def _placeholder_regex(names: Iterable[str]) -> "re.Pattern":
+    alternatives = "|".join(re.escape(name) for name in sorted(set(names), key=len, reverse=True))
+    return re.compile(r"\{\{(%s)\}\}|\{(%s)\}" % (alternatives, alternatives))
+
+
+def _split(text: str, regex: "re.Pattern") -> Tuple[object, ...]:
+    """Split a template string into literal strings and placeholders."""
+    parts = []
+    cursor = 0
+    for match in regex.finditer(text):
+        if match.start() > cursor:
+            parts.append(text[cursor:match.start()])
+        escaped, name = match.groups()
+        parts.append(f"{{{escaped}}}" if escaped else _Placeholder(name))
+        cursor = match.end()
+    if cursor < len(text):
+        parts.append(text[cursor:])
+    return tuple(parts)
+
+
+def _compile(value, regex) -> Renderer:
+    if isinstance(value, str):
+        parts = _split(value, regex) if regex is not None else (value,)
+        if all(type(part) is str for part in parts):
+            literal = "".join(parts)
+            return lambda values: literal
+        if len(parts) == 1:
+            placeholder = parts[0]
+            return lambda values: values.get(placeholder.name, placeholder.text)
+        return lambda values: "".join([part if type(part) is str else values.get(part.name, part.text)
+                                       for part in parts])
+    if isinstance(value, (dict, MappingProxyType)):
+        items = tuple((key, _compile(item, regex)) for key, item in value.items())
+        return lambda values: {key: render(values) for key, render in items}
+    if isinstance(value, (list, tuple)):
+        renderers = tuple(_compile(item, regex) for item in value)
+        return lambda values: [render(values) for render in renderers]
+    return lambda values: value
+
+
+def compile_template(template, variables: Iterable[str]) -> Renderer:
+    """
+    Compile an intent template (nested dicts, lists and strings) for the given
+    variable names.
+
+    Returns:
+        A function that takes {variable: value} and returns a new intent.
+        Placeholders without a value are left as "{name}".
+    """
+    variables = tuple(variables)
+    return _compile(template, _placeholder_regex(variables) if variables else None)
+
+
+def make_template(intent, values: Dict[str, str]):
+    """
+    Turn a concrete intent into a template by replacing each variable's value
+    with its placeholder, in every string of the intent (nested ones included).
+    Existing "{name}" text for those variables is escaped as "{{name}}".
+
+    Args:
+        intent: The intent the command was parsed into.
+        values: {variable name: value extracted from the command}.
+    """
+    values = {name: value for name, value in values.items() if value}
+    if not values:
+        return intent
+    placeholders = "|".join(re.escape(f"{{{name}}}") for name in values)
+    # Longest values first, so a value that contains another one wins
+    by_value = {}
+    for name, value in sorted(values.items(), key=lambda item: len(item[1]), reverse=True):
+        by_value.setdefault(value, name)
+    alternatives = "|".join(re.escape(value) for value in by_value)
+    regex = re.compile(f"({placeholders})|({alternatives})")
+
+    def substitute(match):
+        if match.group(1):
+            return "{" + match.group(1) + "}"
+        return f"{{{by_value[match.group(2)]}}}"
+
+    def convert(value):
+        if isinstance(value, str):
+            return regex.sub(substitute, value)
+        if isinstance(value, dict):
+            return {key: convert(item) for key, item in value.items()}
+        if isinstance(value, list):
+            return [convert(item) for item in value]
+        return value
+
+    return convert(intent)
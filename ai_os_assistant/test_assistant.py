@@ -0,0 +1,81 @@
+import threading
+import time
+from mock_ollama import MockConfig
+from assistant import Assistant, SpeculationPolicy
+from testing import mock_ollama, temp_store
+
+def test_assistant_handle():
+    """Test the in-process API: LLM miss, learned pattern hit and special commands."""
+    with mock_ollama() as server, temp_store() as store:
+        assistant = Assistant(store, execute=False)
+
+        first = assistant.handle("Create a file named report.txt")
+        print(first)
+        assert first.source == "llm"
+        assert first.stored
+        assert first.intent == {"action": "create_file", "filename": "report.txt"}
+        assert "parse_prompt.response" in first.timings
+
+        second = assistant.handle("Create a file named data.csv")
+        print(second)
+        assert second.source == "pattern"
+        assert second.match_stage == "regex"
+        assert second.matched_pattern == "Create a file named {filename}"
+        assert second.variables == {"filename": "data.csv"}
+        assert second.intent == {"action": "create_file", "filename": "data.csv"}
+        assert second.outcome is None
+        assert server.stats.requests == 1
+
+        assert assistant.handle("no store").kind == "special"
+        assert not assistant.handle("Tell me a joke").stored
+        assert assistant.handle("store last").stored
+        assert assistant.handle("quit").kind == "exit"
+
+def test_speculative_matching():
+    """Test the LLM call made alongside slow matching: cancelled by a close match, used otherwise."""
+    with temp_store() as store:
+        store.add_pattern("check disk usage now", {"action": "run_code", "code": "print('disk')"}, store_command=True)
+        assistant = Assistant(store, execute=False, speculation=SpeculationPolicy(min_score=0.8))
+
+        with mock_ollama(MockConfig(first_token_delay=3.0)):
+            # A confident fuzzy match cancels the slow LLM request
+            start = time.perf_counter()
+            close = assistant.handle("please check disk usage now")
+            print(close)
+            assert close.source == "pattern" and close.match_stage == "fuzzy"
+            assert time.perf_counter() - start < 2.0
+
+            # A weaker one waits for the LLM
+            weak = assistant.handle("check cpu usage now")
+            print(weak)
+            assert weak.source == "llm"
+            assert weak.intent == {"action": "run_code", "code": "print('mock ollama default response')"}
+
+        with mock_ollama():
+            # The LLM answering first stops a long similarity scan
+            def slow_scan(command, category, stop=None):
+                stop.wait(10)
+                return None
+            store.find_best_raw_command_match = slow_scan
+            start = time.perf_counter()
+            first = assistant.handle("Create a file named notes.md")
+            print(first)
+            assert first.source == "llm"
+            assert first.intent == {"action": "create_file", "filename": "notes.md"}
+            assert time.perf_counter() - start < 5.0
+
+            # Few-shot examples are scored on the LLM's thread, not before matching carries on
+            scored_on = []
+            few_shot_examples = store.few_shot_examples
+            def record_thread(*args, **kwargs):
+                scored_on.append(threading.current_thread().name)
+                return few_shot_examples(*args, **kwargs)
+            store.few_shot_examples = record_thread
+            assistant = Assistant(store, execute=False, speculation=SpeculationPolicy(min_score=0.8), few_shot=1)
+            assert assistant.handle("check gpu usage now").source == "llm"
+            assert scored_on == ["speculative-llm"], scored_on
+
+if __name__ == "__main__":
+    test_assistant_handle()
+    test_speculative_matching()
+    print("Test complete!")
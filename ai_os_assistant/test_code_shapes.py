@@ -0,0 +1,76 @@
+import os
+import json
+from code_shapes import recognize, native_intent, main
+from dispatcher import dispatch_command
+from command_store import CommandStore
+from testing import temp_folder
+
+def test_recognized_shapes():
+    """Test that common generated-code shapes map onto native intents."""
+    assert recognize("open('{filename}', 'w').close()") == {"action": "create_file", "filename": "{filename}"}
+    assert recognize("with open('a.txt', 'w') as f:\n    f.write('hi\\n')") == \
+        {"action": "create_file", "filename": "a.txt", "content": "hi\n"}
+    assert recognize("open('a.txt', 'w').close(); open('b.txt', 'w').close()") == \
+        {"action": "create_files", "filenames": ["a.txt", "b.txt"]}
+    assert recognize("for i in range(1, 4):\n    open(str(i) + '.txt', 'w').close()") == \
+        {"action": "create_files", "filenames": ["1.txt", "2.txt", "3.txt"]}
+    assert recognize("import os\nos.makedirs('out', exist_ok=True)") == {"action": "create_directory", "directory": "out"}
+    # Without exist_ok, or with mkdir, the native intent still fails or skips parents the same way
+    assert recognize("import os\nos.makedirs('out')") == {"action": "create_directory", "directory": "out", "exist_ok": False}
+    assert recognize("import os\nos.mkdir('out')") == \
+        {"action": "create_directory", "directory": "out", "exist_ok": False, "parents": False}
+    assert recognize("with open('a.txt', 'w', encoding='UTF-8') as f:\n    f.write('é')") == \
+        {"action": "create_file", "filename": "a.txt", "content": "é"}
+    assert recognize("import os; os.remove('old.log')") == {"action": "delete_file", "filename": "old.log"}
+    assert recognize("import shutil\nshutil.rmtree('build')") == {"action": "delete_directory", "directory": "build"}
+    assert recognize("import webbrowser\nwebbrowser.open('https://python.org')") == \
+        {"action": "open_url", "url": "https://python.org"}
+
+    # Anything else stays generated code
+    for code in ("import os; os.system('calc')", "open(name, 'w').close()", "open('a.txt', 'a').close()",
+                 "with open('a.txt', 'w', encoding='latin-1') as f:\n    f.write('é')",
+                 "open('a.txt', 'w', newline='').close()", "import os; os.makedirs('out', exist_ok=flag)",
+                 "for i in range(n):\n    open(str(i), 'w').close()", "import subprocess\nos.remove('x')", "not python("):
+        assert recognize(code) is None, code
+    intent = {"action": "run_code", "code": "print('hi')"}
+    assert native_intent(intent) is intent
+    print("✅ Generated code shapes are recognized")
+
+def test_native_dispatch_and_library_rewrite():
+    """Test that native intents run and that stored run_code patterns are rewritten."""
+    with temp_folder() as folder:
+        target = os.path.join(folder, "made")
+        assert dispatch_command({"action": "create_directory", "directory": target}) == "ok"
+        assert dispatch_command({"action": "create_directory", "directory": target, "exist_ok": False}) == "error"
+        assert dispatch_command({"action": "create_directory", "directory": os.path.join(target, "x", "y"),
+                                 "parents": False}) == "error"
+        assert dispatch_command({"action": "create_files", "filenames": [os.path.join(target, "a.txt")]}) == "ok"
+        assert os.path.exists(os.path.join(target, "a.txt"))
+        assert dispatch_command({"action": "delete_directory", "directory": target}) == "ok"
+        assert not os.path.exists(target)
+
+        path = os.path.join(folder, "command_patterns.json")
+        with open(path, "w") as f:
+            json.dump({"file_creation": [
+                {"pattern": "Make me a file called {filename}", "variables": ["filename"], "hits": 4,
+                 "intent_template": {"action": "run_code", "code": "open('{filename}', 'w').close()"}},
+                {"pattern": "Run the calculator program", "variables": [],
+                 "intent_template": {"action": "run_code", "code": "import os; os.system('calc')"}},
+            ]}, f)
+        main(["--path", path])
+        with open(path) as f:
+            stored = json.load(f)["file_creation"]
+        assert stored[0]["intent_template"] == {"action": "create_file", "filename": "{filename}"}
+        assert CommandStore(path=path, refresh_interval=None).patterns["file_creation"][0].hits == 4
+        assert stored[1]["intent_template"]["action"] == "run_code"
+
+        # Prompts learned as generated code before are still learned as native intents
+        store = CommandStore(path=os.path.join(folder, "learned.json"), refresh_interval=None)
+        assert store.add_pattern("Open www.example.com", {"action": "run_code", "code": "import webbrowser; webbrowser.open('www.example.com')"})
+        assert store.match_command("Open www.github.com")[0] == {"action": "open_url", "url": "www.github.com"}
+    print("✅ Native intents run and the library is rewritten")
+
+if __name__ == "__main__":
+    test_recognized_shapes()
+    test_native_dispatch_and_library_rewrite()
+    print("Test complete!")
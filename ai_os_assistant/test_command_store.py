@@ -1,139 +1,323 @@
 import os
+import sys
 import json
+import subprocess
+import time
+import command_store
 from command_store import CommandStore
 from utils import log
+from testing import temp_folder, temp_library, temp_store
 
 def test_enhanced_pattern_matching():
     """Test the enhanced command pattern matching system."""
-    # Create a test command store
-    store = CommandStore()
-    
-    # Override the store patterns for testing
-    store.patterns = {}
-    
-    print("\n=== Testing Command Pattern Storage and Matching ===\n")
-    
-    # Test 1: Auto-categorization
-    print("--- Test 1: Command Categorization ---")
-    test_commands = [
-        "Open my default browser to www.example.com",
-        "Create a file named report.txt",
-        "Search for the best pizza recipes",
-        "Launch Notepad and open the config file",
-        "Delete all files in the temp directory",
-        "Rename file data.csv to data_old.csv"
-    ]
-    
-    for cmd in test_commands:
-        category = store.detect_category(cmd)
-        print(f"Command: '{cmd}'")
-        print(f"Detected category: '{category}'\n")
-    
-    # Test 2: Variable extraction
-    print("--- Test 2: Variable Extraction ---")
-    variable_test_commands = [
-        ("Open my default browser to www.example.com", "open_webpage"),
-        ("Create a file named test.txt", "file_creation"),
-        ("Search for quantum computing tutorials", "search_query"),
-    ]
-    
-    for cmd, category in variable_test_commands:
-        variables = store.extract_potential_variables(cmd, category)
-        print(f"Command: '{cmd}'")
-        print(f"Variables extracted: {variables}\n")
-    
-    # Test 3: Pattern creation and matching
-    print("--- Test 3: Pattern Storage and Matching ---")
-    
-    # Example intents for different commands
-    web_intent = {
-        "action": "run_code",
-        "code": "import webbrowser; webbrowser.open('www.example.com')"
-    }
-    
-    file_intent = {
-        "action": "create_file",
-        "filename": "test.txt"
-    }
-    
-    search_intent = {
-        "action": "run_code",
-        "code": "import webbrowser; webbrowser.open('https://www.google.com/search?q=quantum+computing+tutorials')"
-    }
-    
-    # Store patterns
-    test_storage = [
-        ("Open my default browser to www.example.com", web_intent),
-        ("Create a file named test.txt", file_intent),
-        ("Search for quantum computing tutorials", search_intent)
-    ]
-    
-    for cmd, intent in test_storage:
-        print(f"Storing command: '{cmd}'")
-        store.add_pattern(cmd, intent, store_command=True)
-        print()
-    
-    # Test matching with variations
-    test_matches = [
-        "Open my default browser to www.github.com",
-        "Create a file named report.docx",
-        "Search for machine learning basics",
-        # Similar but not exact
-        "Open my web browser to www.github.com",
-        # Non-matching command
-        "Reboot the system in 5 minutes"
-    ]
-    
-    # Add a raw command (no variables) to test similarity matching
-    print("\n--- Adding a raw command for similarity testing ---")
-    raw_command = "Show me system information"
-    raw_intent = {
-        "action": "run_code",
-        "code": "import platform; print(platform.uname())"
-    }
-    print(f"Storing raw command: '{raw_command}'")
-    store.add_pattern(raw_command, raw_intent, store_command=True)
-    
-    # Test similar variations of the raw command
-    similar_commands = [
-        "Display system info",
-        "Show system information",
-        "Get my system details"
-    ]
-    
-    print("\n--- Testing Pattern Matching with Variations ---")
-    # First test variable-based patterns
-    for test_cmd in test_matches:
-        print(f"Testing command: '{test_cmd}'")
-        match_result = store.match_command(test_cmd)
-        
-        if match_result:
-            intent, variables = match_result
-            print(f"✅ MATCHED: {test_cmd}")
-            if variables:
-                print(f"  Variables: {variables}")
-            print(f"  Intent: {intent}")
-        else:
-            print(f"❌ NOT MATCHED: {test_cmd}")
-        print()
-    
-    # Now test similarity-based matching
-    print("\n--- Testing Similarity Matching ---")
-    for test_cmd in similar_commands:
-        print(f"Testing similar command: '{test_cmd}'")
-        match_result = store.match_command(test_cmd)
-        
-        if match_result:
-            intent, variables = match_result
-            print(f"✅ MATCHED: {test_cmd}")
-            if variables:
-                print(f"  Variables: {variables}")
-            print(f"  Intent: {intent}")
-        else:
-            print(f"❌ NOT MATCHED: {test_cmd}")
-        print()
-    
-    print("Test complete!")
+    # Create a test command store backed by a scratch file so the real library is untouched
+    with temp_store() as store:
+        # Override the store patterns for testing
+        store.patterns = {}
+        
+        print("\n=== Testing Command Pattern Storage and Matching ===\n")
+        
+        # Test 1: Auto-categorization
+        print("--- Test 1: Command Categorization ---")
+        test_commands = [
+            "Open my default browser to www.example.com",
+            "Create a file named report.txt",
+            "Search for the best pizza recipes",
+            "Launch Notepad and open the config file",
+            "Delete all files in the temp directory",
+            "Rename file data.csv to data_old.csv"
+        ]
+        
+        for cmd in test_commands:
+            category = store.detect_category(cmd)
+            print(f"Command: '{cmd}'")
+            print(f"Detected category: '{category}'\n")
+        
+        # Test 2: Variable extraction
+        print("--- Test 2: Variable Extraction ---")
+        variable_test_commands = [
+            ("Open my default browser to www.example.com", "open_webpage"),
+            ("Create a file named test.txt", "file_creation"),
+            ("Search for quantum computing tutorials", "search_query"),
+        ]
+        
+        for cmd, category in variable_test_commands:
+            variables = store.extract_potential_variables(cmd, category)
+            print(f"Command: '{cmd}'")
+            print(f"Variables extracted: {variables}\n")
+        
+        # Test 3: Pattern creation and matching
+        print("--- Test 3: Pattern Storage and Matching ---")
+        
+        # Example intents for different commands
+        web_intent = {
+            "action": "run_code",
+            "code": "import webbrowser; webbrowser.open('www.example.com')"
+        }
+        
+        file_intent = {
+            "action": "create_file",
+            "filename": "test.txt"
+        }
+        
+        search_intent = {
+            "action": "run_code",
+            "code": "import webbrowser; webbrowser.open('https://www.google.com/search?q=quantum+computing+tutorials')"
+        }
+        
+        # Store patterns
+        test_storage = [
+            ("Open my default browser to www.example.com", web_intent),
+            ("Create a file named test.txt", file_intent),
+            ("Search for quantum computing tutorials", search_intent)
+        ]
+        
+        for cmd, intent in test_storage:
+            print(f"Storing command: '{cmd}'")
+            store.add_pattern(cmd, intent, store_command=True)
+            print()
+        
+        # Test matching with variations
+        test_matches = [
+            "Open my default browser to www.github.com",
+            "Create a file named report.docx",
+            "Search for machine learning basics",
+            # Similar but not exact
+            "Open my web browser to www.github.com",
+            # Non-matching command
+            "Reboot the system in 5 minutes"
+        ]
+        
+        # Add a raw command (no variables) to test similarity matching
+        print("\n--- Adding a raw command for similarity testing ---")
+        raw_command = "Show me system information"
+        raw_intent = {
+            "action": "run_code",
+            "code": "import platform; print(platform.uname())"
+        }
+        print(f"Storing raw command: '{raw_command}'")
+        store.add_pattern(raw_command, raw_intent, store_command=True)
+        
+        # Test similar variations of the raw command
+        similar_commands = [
+            "Display system info",
+            "Show system information",
+            "Get my system details"
+        ]
+        
+        print("\n--- Testing Pattern Matching with Variations ---")
+        # First test variable-based patterns
+        for test_cmd in test_matches:
+            print(f"Testing command: '{test_cmd}'")
+            match_result = store.match_command(test_cmd)
+            
+            if match_result:
+                intent, variables = match_result
+                print(f"✅ MATCHED: {test_cmd}")
+                if variables:
+                    print(f"  Variables: {variables}")
+                print(f"  Intent: {intent}")
+            else:
+                print(f"❌ NOT MATCHED: {test_cmd}")
+            print()
+        
+        # Now test similarity-based matching
+        print("\n--- Testing Similarity Matching ---")
+        for test_cmd in similar_commands:
+            print(f"Testing similar command: '{test_cmd}'")
+            match_result = store.match_command(test_cmd)
+            
+            if match_result:
+                intent, variables = match_result
+                print(f"✅ MATCHED: {test_cmd}")
+                if variables:
+                    print(f"  Variables: {variables}")
+                print(f"  Intent: {intent}")
+            else:
+                print(f"❌ NOT MATCHED: {test_cmd}")
+            print()
+        
+        print("Test complete!")
+
+def test_background_loading():
+    """Patterns loaded on a background thread are available once the load finishes."""
+    with temp_library() as path:
+        with open(path, "w") as f:
+            json.dump({"file_creation": [{"pattern": "create a file named {filename}",
+                                          "intent": {"action": "create_file"}}]}, f)
+        
+        store = CommandStore(path=path, load_in_background=True)
+        assert store.wait_until_loaded(5)
+        assert store.load_seconds is not None
+        assert list(store.patterns) == ["file_creation"]
+        print("✅ Background loading works")
+
+def test_shared_store_between_processes():
+    """Patterns saved by several processes at once are merged, and picked up by the others."""
+    with temp_library() as path:
+        reader = CommandStore(path=path, refresh_interval=None)
+        stale = CommandStore(path=path, refresh_interval=None)
+        
+        worker = (
+            "import sys; from command_store import CommandStore\n"
+            "store = CommandStore(path=sys.argv[1], refresh_interval=None)\n"
+            "for step in 'abcdefghij':\n"
+            "    store.add_pattern(f'run job {sys.argv[2]} {step}', {'action': 'run_code', 'code': 'pass'}, store_command=True)\n"
+        )
+        here = os.path.dirname(os.path.abspath(__file__))
+        workers = [subprocess.Popen([sys.executable, "-c", worker, path, name], cwd=here, stdout=subprocess.DEVNULL)
+                   for name in ("alpha", "beta", "gamma", "delta")]
+        for process in workers:
+            assert process.wait(timeout=60) == 0
+        
+        with open(path) as f:
+            saved = [p["raw_command"] for patterns in json.load(f).values() for p in patterns]
+        assert len(saved) == 40, len(saved)
+        
+        assert reader.reload_changes() == {"custom_command"}
+        assert len(reader.patterns["custom_command"]) == 40
+        assert reader.reload_changes() == set()
+        
+        # Saving from a store that hasn't seen the others' patterns keeps them
+        stale.add_pattern("run job extra", {"action": "run_code", "code": "pass"}, store_command=True)
+        with open(path) as f:
+            assert len(json.load(f)["custom_command"]) == 41
+        
+        reader.clear_patterns()
+        with open(path) as f:
+            assert json.load(f) == {}
+        print("✅ Patterns are shared safely between processes")
+
+def test_removals_by_other_processes_stick():
+    """A save merges in what other processes removed instead of writing its stale copy back."""
+    with temp_library() as path:
+        first = CommandStore(path=path, refresh_interval=None)
+        second = CommandStore(path=path, refresh_interval=None)
+        first.add_pattern("run job nightly", {"action": "run_code", "code": "pass"}, store_command=True)
+        second.update_patterns(lambda patterns: patterns["custom_command"].clear())
+        first.add_pattern("run job weekly", {"action": "run_code", "code": "pass"}, store_command=True)
+        
+        saved = [p.raw_command for p in CommandStore(path=path, refresh_interval=None).patterns["custom_command"]]
+        assert saved == ["run job weekly"], saved
+        assert [p.raw_command for p in first.patterns["custom_command"]] == ["run job weekly"]
+        print("✅ Removals made by other processes stick")
+
+def test_usage_saves_stay_off_the_match_path():
+    """Hits are saved in the background, and other stores take usage-only changes without re-indexing."""
+    with temp_library() as path:
+        store = CommandStore(path=path, refresh_interval=None)
+        store.add_pattern("run job nightly", {"action": "run_code", "code": "pass"}, store_command=True)
+        other = CommandStore(path=path, refresh_interval=None)
+        entries = other.patterns["custom_command"]
+        index = other.category_index("custom_command")
+        
+        saved = os.stat(path).st_mtime_ns
+        assert store.match_command("run job nightly")
+        assert os.stat(path).st_mtime_ns == saved
+        assert store in command_store._unsaved_usage
+        
+        # Usage goes to the side file, not the pattern library
+        store.flush_usage()
+        assert os.stat(path).st_mtime_ns == saved
+        assert other.reload_changes() == set()
+        assert other.patterns["custom_command"] is entries and other.category_index("custom_command") is index
+        assert CommandStore(path=path, refresh_interval=None).patterns["custom_command"][0].hits == 2
+        with open(path) as f:
+            assert "hits" not in json.load(f)["custom_command"][0]
+        
+        # Learning a pattern brings in the usage other stores saved
+        other.add_pattern("run job weekly", {"action": "run_code", "code": "pass"}, store_command=True)
+        assert entries[0].hits == 2
+        
+        # A usage save never writes assigned patterns over the library
+        store.patterns = {"custom_command": [store.patterns["custom_command"][0].to_dict()]}
+        assert store.match_command("run job nightly")
+        store.flush_usage()
+        with open(path) as f:
+            assert len(json.load(f)["custom_command"]) == 2
+        print("✅ Usage is saved off the match path")
+
+def test_usage_ordering_and_eviction():
+    """Hot commands win ties and survive eviction; evicted commands go to the archive."""
+    with temp_folder() as folder:
+        path = os.path.join(folder, "command_patterns.json")
+        archive = os.path.join(folder, "evicted.jsonl")
+        store = CommandStore(path=path, refresh_interval=None, capacity=3, archive_path=archive)
+        intent = {"action": "run_code", "code": "pass"}
+        for command in ("check disk usage now", "check logs usage now", "check fans usage now"):
+            store.add_pattern(command, intent, store_command=True)
+        
+        # Equally similar to all three; the most used one is picked
+        store.match_command("check fans usage now")
+        store.match_command("check fans usage now")
+        match = store.match_command_details("check cpu usage now")
+        assert match["stage"] == "fuzzy" and match["pattern"] == "check fans usage now", match
+        
+        store.match_command("check disk usage now")
+        store.add_pattern("check temp usage now", intent, store_command=True)
+        remaining = [p.raw_command for p in store.patterns["custom_command"]]
+        assert remaining == ["check disk usage now", "check fans usage now", "check temp usage now"], remaining
+        with open(archive) as f:
+            evicted = [json.loads(line) for line in f]
+        assert [e["raw_command"] for e in evicted] == ["check logs usage now"]
+        
+        store.flush_usage()
+        hits = {p.raw_command: p.hits for p in CommandStore(path=path, refresh_interval=None).patterns["custom_command"]}
+        assert hits == {"check disk usage now": 2, "check fans usage now": 4, "check temp usage now": 1}, hits
+        print("✅ Usage ordering and eviction work")
+
+def test_watched_store_reloads_changed_categories():
+    """A watched store picks up another process's save without a match, parsing only the categories it changed."""
+    for use_inotify in (True, False):
+        with temp_library() as path:
+            watched = CommandStore(path=path, refresh_interval=None)
+            watched.add_pattern("create file notes.txt", {"action": "create_file", "filename": "notes.txt"}, store_command=True)
+            watched.add_pattern("run job nightly", {"action": "run_code", "code": "pass"}, store_command=True)
+            untouched = watched.patterns["file_creation"]
+            writer = CommandStore(path=path, refresh_interval=None)
+            
+            parsed = []
+            load_library = command_store.load_library
+            command_store.load_library = lambda data: parsed.append(sorted(data)) or load_library(data)
+            watcher = watched.watch(poll_interval=0.05, use_inotify=use_inotify)
+            try:
+                assert watcher.mode == ("inotify" if use_inotify and sys.platform.startswith("linux") else "polling")
+                writer.add_pattern("run job weekly", {"action": "run_code", "code": "print(1)"}, store_command=True)
+                deadline = time.monotonic() + 5
+                while len(watched.patterns["custom_command"]) < 2 and time.monotonic() < deadline:
+                    time.sleep(0.01)
+            finally:
+                watched.stop_watching()
+                command_store.load_library = load_library
+            
+            assert len(watched.patterns["custom_command"]) == 2, watcher.mode
+            assert parsed == [["custom_command"]], parsed
+            assert watched.patterns["file_creation"] is untouched
+            # The new index was built by the watcher, before the first match needs it
+            assert watched._indexes["custom_command"].source is watched.patterns["custom_command"]
+            assert watched.match_command("run job weekly")[0] == {"action": "run_code", "code": "print(1)"}
+    print("✅ Watched stores reload changed categories as they are saved")
+
+def test_first_reload_parses_changed_categories():
+    """The first reload after a store loads the file parses only the categories changed since."""
+    with temp_library() as path:
+        writer = CommandStore(path=path, refresh_interval=None)
+        writer.add_pattern("create file notes.txt", {"action": "create_file", "filename": "notes.txt"}, store_command=True)
+        writer.add_pattern("run job nightly", {"action": "run_code", "code": "pass"}, store_command=True)
+        reader = CommandStore(path=path, refresh_interval=None)
+        reader.match_command("run job nightly")
+        writer.add_pattern("run job weekly", {"action": "run_code", "code": "print(1)"}, store_command=True)
+
+        parsed = []
+        load_library = command_store.load_library
+        command_store.load_library = lambda data: parsed.append(sorted(data)) or load_library(data)
+        try:
+            assert reader.reload_changes() == {"custom_command"}
+        finally:
+            command_store.load_library = load_library
+        assert parsed == [["custom_command"]], parsed
+        assert len(reader.patterns["custom_command"]) == 2
+        print("✅ The first reload parses only changed categories")
 
 if __name__ == "__main__":
     # Delete the command pattern file if it exists (for clean testing)
@@ -149,6 +333,13 @@ if __name__ == "__main__":
     
     try:
         test_enhanced_pattern_matching()
+        test_background_loading()
+        test_shared_store_between_processes()
+        test_removals_by_other_processes_stick()
+        test_usage_saves_stay_off_the_match_path()
+        test_usage_ordering_and_eviction()
+        test_watched_store_reloads_changed_categories()
+        test_first_reload_parses_changed_categories()
     finally:
         # Restore the original patterns file if it was backed up
         if os.path.exists("command_patterns_backup.json"):
@@ -0,0 +1,46 @@
+import json
+from command_store import CommandStore
+from consolidate import Consolidator
+from patterns import Pattern
+from testing import temp_library
+
+def test_consolidation():
+    """Test merging similar raw commands into one pattern, and absorbing ones a pattern already covers."""
+    with temp_library() as path:
+        store = CommandStore(path=path, refresh_interval=None)
+        commands = {
+            "launch notepad please": "import subprocess; subprocess.Popen('notepad')",
+            "launch calc please": "import subprocess; subprocess.Popen('calc')",
+            "launch mspaint please": "import subprocess; subprocess.Popen('mspaint')",
+            "show the weather in Paris": "print(weather('Paris'))",
+            "show the weather in Rome": "print(weather('Rome', units='c'))",
+        }
+        for command, code in commands.items():
+            store.add_pattern(command, {"action": "run_code", "code": code}, store_command=True)
+        store.add_pattern("Create a file named notes.txt", {"action": "create_file", "filename": "notes.txt"})
+        # A raw command the file pattern above already answers
+        store.patterns["file_creation"].append(Pattern(
+            "file_creation", "Create a file named todo.txt", {"action": "create_file", "filename": "todo.txt"},
+            raw_command="Create a file named todo.txt"))
+    
+        merges = Consolidator(store).run_once()
+        print([(m.category, m.pattern.pattern, len(m.members)) for m in merges])
+        assert {(m.pattern.pattern, len(m.members), m.existing) for m in merges} == {
+            ("launch {value} please", 3, False), ("Create a file named {filename}", 1, True)}
+    
+        with open(path) as f:
+            saved = json.load(f)
+        assert [p["pattern"] for p in saved["program_launch"]] == ["launch {value} please"]
+        assert CommandStore(path=path, refresh_interval=None).patterns["program_launch"][0].hits == 3
+        assert len(saved["file_creation"]) == 1
+        # Commands with different intents are left alone
+        assert len(saved["custom_command"]) == 2
+    
+        intent, variables = store.match_command("launch wordpad please")
+        assert variables == {"value": "wordpad"}
+        assert intent["code"] == "import subprocess; subprocess.Popen('wordpad')"
+    print("✅ Consolidation works")
+
+if __name__ == "__main__":
+    test_consolidation()
+    print("Test complete!")
@@ -0,0 +1,56 @@
+import os
+import sys
+from command_store import CommandStore
+from assistant_client import AssistantClient
+from daemon import AssistantDaemon, _ThreadOutput
+from dispatcher import dispatch_command
+from testing import mock_ollama, temp_folder
+
+def test_daemon_shared_store():
+    """Test that two clients share one warm store and get their own output back."""
+    with temp_folder() as workdir, mock_ollama() as server:
+        address = os.path.join(workdir, "assistant.sock")
+        store = CommandStore(path=os.path.join(workdir, "command_patterns.json"))
+        daemon = AssistantDaemon(address, store, execute=False).start()
+        try:
+            with AssistantClient(address) as first, AssistantClient(address) as second:
+                learned = first.handle("Create a file named report.txt")
+                print(learned)
+                assert learned["ok"]
+                assert learned["result"]["source"] == "llm"
+                assert learned["result"]["stored"]
+
+                reused = second.handle("Create a file named data.csv")
+                print(reused)
+                assert reused["result"]["source"] == "pattern"
+                assert reused["result"]["variables"] == {"filename": "data.csv"}
+                assert "Recognized command pattern" in reused["output"]
+                assert server.stats.requests == 1
+
+                # "store last" state belongs to the connection that sent the prompt
+                assert not second.handle("store last")["result"]["stored"]
+                assert first.request({"op": "bogus"})["ok"] is False
+                assert "2 client(s)" in first.ping()["status"]
+                assert first.shutdown()["ok"]
+        finally:
+            daemon.stop()
+        assert not os.path.exists(address)
+
+def test_multi_step_output_is_captured():
+    """Test that what the steps of a multi intent print, on the dispatcher's pool threads, reaches the request's capture."""
+    output = _ThreadOutput(sys.stdout)
+    original, sys.stdout = sys.stdout, output
+    try:
+        with temp_folder() as folder, output.capture() as captured:
+            outcome = dispatch_command({"action": "multi", "intents": [
+                {"action": "create_file", "filename": os.path.join(folder, "a.txt")},
+                {"action": "create_directory", "directory": os.path.join(folder, "b")}]})
+    finally:
+        sys.stdout = original
+    assert outcome == "ok"
+    assert "Created file" in captured.getvalue() and "Created folder" in captured.getvalue(), captured.getvalue()
+
+if __name__ == "__main__":
+    test_daemon_shared_store()
+    test_multi_step_output_is_captured()
+    print("Test complete!")
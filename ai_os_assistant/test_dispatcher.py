@@ -0,0 +1,130 @@
+import os
+import sys
+import asyncio
+import threading
+import dispatcher
+from dispatcher import ActionRegistry, ACTIONS, dependencies, dispatch_batch, dispatch_command, dispatch_intents
+from intents import Field, SchemaRegistry
+from testing import temp_folder
+
+def test_action_registry():
+    """Test registered, async and invalid actions."""
+    schemas = SchemaRegistry()
+    registry = ActionRegistry(schemas)
+    seen = []
+    registry.register("beep", seen.append, Field("times", int))
+    assert registry.get("beep").handler == seen.append and "beep" in schemas
+    registry.call(registry.get("beep").handler, {"action": "beep", "times": 2})
+
+    async def wait_and_record(intent):
+        await asyncio.sleep(0.01)
+        seen.append(intent)
+    registry.register("wait", wait_and_record)
+    registry.call(registry.get("wait").handler, {"action": "wait"})
+    assert seen == [{"action": "beep", "times": 2}, {"action": "wait"}]
+
+    assert dispatch_command({"action": "run_code", "code": "x = 1"}) == "ok"
+    assert dispatch_command({"action": "run_code", "code": 3}) == "invalid"
+    print("✅ Actions are dispatched through the registry")
+
+def test_batched_create_file():
+    """Test that runs of create_file intents, and ready steps of a multi intent, are written by one batch call."""
+    batches = []
+    original = ACTIONS.get("create_file")
+    ACTIONS.register("create_file", original.handler, paths=original.paths,
+                     batch=lambda intents: (batches.append(len(intents)), original.batch(intents)))
+    with temp_folder() as folder, temp_folder() as unrelated:
+        paths = [os.path.join(folder, name) for name in ("a.txt", "b.txt", "c.txt")]
+        try:
+            outcomes = dispatch_batch([{"action": "create_file", "filename": paths[0], "content": "a"},
+                                       {"action": "create_file", "filename": paths[1]},
+                                       {"action": "create_file"},
+                                       {"action": "create_file", "filename": paths[2]}])
+            # Independent steps of a multi intent are batched too
+            others = [os.path.join(folder, name) for name in ("d.txt", "e.txt")]
+            steps = [{"action": "create_file", "filename": path} for path in others]
+            assert dispatch_intents(steps + [{"action": "sort_files", "directory": unrelated}]) == ["ok"] * 3
+        finally:
+            ACTIONS.register("create_file", original.handler, batch=original.batch, paths=original.paths)
+        assert outcomes == ["ok", "ok", "invalid", "ok"], outcomes
+        assert batches == [2, 2]
+        assert all(os.path.exists(path) for path in others)
+        assert all(os.path.exists(path) for path in paths)
+        with open(paths[0]) as f:
+            assert f.read() == "a"
+    print("✅ create_file intents are batched")
+
+def test_entry_point_plugins():
+    """Test that actions from an installed plugin's entry point are loaded on first use."""
+    with temp_folder() as folder:
+        with open(os.path.join(folder, "shout_plugin.py"), "w") as f:
+            f.write("def register(actions):\n"
+                    "    actions.register('shout', lambda intent: print(intent['text'].upper()))\n")
+        dist_info = os.path.join(folder, "shout_plugin-1.0.dist-info")
+        os.mkdir(dist_info)
+        with open(os.path.join(dist_info, "METADATA"), "w") as f:
+            f.write("Metadata-Version: 2.1\nName: shout-plugin\nVersion: 1.0\n")
+        with open(os.path.join(dist_info, "entry_points.txt"), "w") as f:
+            f.write(f"[{dispatcher.PLUGIN_GROUP}]\nshout = shout_plugin:register\n")
+        sys.path.insert(0, folder)
+        try:
+            registry = ActionRegistry(SchemaRegistry())
+            assert "shout" not in registry
+            assert registry.get("shout") is not None
+            assert registry.get("whisper") is None
+        finally:
+            sys.path.remove(folder)
+    print("✅ Action plugins are loaded from entry points")
+
+def test_multi_intent_ordering():
+    """Test that independent steps run in parallel and dependent ones wait, or are skipped after a failure."""
+    with temp_folder() as folder, temp_folder() as elsewhere:
+        steps = [{"action": "create_file", "filename": os.path.join(folder, "a.txt")},
+                 {"action": "create_file", "filename": os.path.join(folder, "b.txt")},
+                 {"action": "sort_files", "directory": folder},
+                 {"action": "open_url", "url": "https://example.com"},
+                 {"action": "run_code", "code": "pass"}]
+        assert dependencies(steps) == [set(), set(), {0, 1}, set(), {0, 1, 2, 3}]
+
+        events = []
+        lock = threading.Lock()
+        def record(name, fail=False, barrier=None):
+            def handler(intent):
+                with lock:
+                    events.append(("start", intent[name]))
+                if barrier is not None:
+                    barrier.wait()
+                with lock:
+                    events.append(("end", intent[name]))
+                if fail:
+                    raise OSError("disk full")
+            return handler
+        originals = {action: ACTIONS.get(action) for action in ("create_file", "sort_files", "delete_file")}
+        # Neither file step gets past the barrier unless both run at once
+        together = threading.Barrier(2, timeout=10)
+        ACTIONS.register("create_file", record("filename", barrier=together), paths=("filename",))
+        ACTIONS.register("sort_files", record("directory"), paths=("directory",))
+        ACTIONS.register("delete_file", record("filename", fail=True), paths=("filename",))
+        try:
+            assert dispatch_intents(steps[:3]) == ["ok", "ok", "ok"]
+            # Both files at once, then the sort
+            assert not together.broken
+            assert [kind for kind, _ in events[:2]] == ["start", "start"]
+            assert events[4:] == [("start", folder), ("end", folder)], events
+
+            ACTIONS.register("create_file", record("filename"), paths=("filename",))
+            unrelated = {"action": "create_file", "filename": os.path.join(elsewhere, "c.txt")}
+            failing = [{"action": "delete_file", "filename": os.path.join(folder, "a.txt")}, steps[2], unrelated]
+            assert dispatch_command({"action": "multi", "intents": failing}) == "error"
+            assert dispatch_intents(failing) == ["error", "skipped", "ok"]
+        finally:
+            for action, entry in originals.items():
+                ACTIONS.register(action, entry.handler, batch=entry.batch, paths=entry.paths)
+    print("✅ Multi intents run in dependency order")
+
+if __name__ == "__main__":
+    test_action_registry()
+    test_batched_create_file()
+    test_entry_point_plugins()
+    test_multi_intent_ordering()
+    print("Test complete!")
@@ -0,0 +1,42 @@
+import re
+from extractors import ExtractorRegistry, EXTRACTORS, GENERIC
+from testing import temp_store
+
+def test_extractor_registry():
+    """Test that extractors return every candidate with its span, and user-defined extractors."""
+    command = "Create a file named notes.txt and todo.md or plan.csv"
+    candidates = EXTRACTORS.extract(command, "file_creation")
+    print(candidates)
+    assert [(c.name, c.value) for c in candidates] == [("filename", "notes.txt"), ("filename_2", "plan.csv")]
+    assert [command[c.start:c.end] for c in candidates] == ["notes.txt", "plan.csv"]
+    
+    # Categories without a match fall back to the generic extractors
+    assert [c.name for c in EXTRACTORS.extract('Say "hello there" 3 times', "custom_command")] == ["quoted_text", "number"]
+    
+    registry = ExtractorRegistry()
+    registry.register("program_launch", "program", r"\blaunch\s+(\w+)", re.IGNORECASE)
+    registry.register(GENERIC, "number", r"\b\d+\b")
+    assert [c.value for c in registry.extract("Launch notepad", "program_launch")] == ["notepad"]
+    assert registry.extract("Launch 2 windows", "program_launch")[0].value == "2"
+    print("✅ Extractor registry works")
+
+def test_multi_variable_patterns():
+    """Test that add_pattern learns every variable of a command in one pattern."""
+    with temp_store() as store:
+        intent = {"action": "run_code", "code": "open('a.txt', 'w').close(); open('b.csv', 'w').close()"}
+        assert store.add_pattern("Create a file named a.txt and b.csv", intent, store_command=True)
+    
+        pattern = store.patterns["file_creation"][0]
+        assert pattern.pattern == "Create a file named {filename} and {filename_2}"
+        # The generated code is stored as the native create_files intent
+        assert pattern.intent_template["filenames"] == ("{filename}", "{filename_2}")
+    
+        intent, variables = store.match_command("create a file named x.py and y.json")
+        assert variables == {"filename": "x.py", "filename_2": "y.json"}
+        assert intent == {"action": "create_files", "filenames": ["x.py", "y.json"]}
+    print("✅ Multi-variable patterns work")
+
+if __name__ == "__main__":
+    test_extractor_registry()
+    test_multi_variable_patterns()
+    print("Test complete!")
@@ -0,0 +1,73 @@
+import json
+from intents import SchemaRegistry, Field, validate_intent
+from command_store import CommandStore
+from dispatcher import dispatch_command
+from mock_ollama import MockConfig
+from model_router import ModelTier, RoutingPolicy, default_policy
+from metrics import LLM_REPAIRS
+import llm_agent
+from testing import mock_ollama, temp_library
+
+def test_intent_validation():
+    """Test the compiled validators for the built-in and registered actions."""
+    assert validate_intent({"action": "create_file", "filename": "a.txt"}) == []
+    assert validate_intent({"action": "create_file", "filename": "  "}) == ["'filename' is empty"]
+    assert validate_intent({"action": "sort_files", "group_by": 3}) == ["missing 'directory'", "'group_by' must be a string"]
+    assert validate_intent({"action": "run_code"}) == ["missing 'code'"]
+    assert validate_intent({"code": "pass"}) == ["missing 'action'"]
+    assert validate_intent(["run_code"]) == ["intent is not a JSON object"]
+    # Actions without a schema are left to the code-generating fallback
+    assert validate_intent({"action": "play_music"}) == []
+
+    registry = SchemaRegistry()
+    registry.register("open_url", Field("url"), Field("new_tab", bool, required=False))
+    assert "open_url" in registry and registry.actions() == ["open_url"]
+    assert registry.validate({"action": "open_url", "url": "a.com", "new_tab": "yes"}) == ["'new_tab' must be true or false"]
+    assert registry.describe("open_url") == '{"action": "open_url", "url": a string, "new_tab": true or false (optional)}'
+    print("✅ Intents are validated against their schemas")
+
+def test_invalid_intents_are_not_stored_or_matched():
+    """Test that invalid intents are refused when stored, skipped when loaded and not dispatched."""
+    with temp_library() as path:
+        with open(path, "w") as f:
+            json.dump({"custom_command": [
+                {"pattern": "tidy downloads", "intent_template": {"action": "sort_files"}, "variables": [],
+                 "raw_command": "tidy downloads"},
+                {"pattern": "tidy desktop", "intent_template": {"action": "sort_files", "directory": "~/Desktop"},
+                 "variables": [], "raw_command": "tidy desktop"},
+            ]}, f)
+        store = CommandStore(path=path, refresh_interval=None)
+        assert store.match_command("tidy downloads") is None
+        assert store.match_command("tidy desktop")[0] == {"action": "sort_files", "directory": "~/Desktop"}
+        assert not store.add_pattern("make notes", {"action": "create_file"}, store_command=True)
+        assert dispatch_command({"action": "rename_files"}) == "invalid"
+    print("✅ Invalid intents are kept out of the store and the dispatcher")
+
+def test_invalid_intent_repair():
+    """Test that an intent missing a field is sent back to the same model once before escalating."""
+    rules = [{"match": "not a valid rename_files intent", "intent": {"action": "rename_files", "directory": "photos"}},
+             {"match": "(?i)rename my photos", "intent": {"action": "rename_files"}},
+             {"match": "(?i)rename my music", "intent": {"action": "rename_files", "directory": ""}}]
+    llm_agent.set_routing_policy(RoutingPolicy([ModelTier(llm_agent.MODEL)]))
+    repairs = LLM_REPAIRS.value(call="parse_prompt", model=llm_agent.MODEL, result="fixed")
+    try:
+        with mock_ollama(MockConfig(rules=rules)) as server:
+            intent = llm_agent.parse_prompt("rename my photos")
+            assert intent == {"action": "rename_files", "directory": "photos"}, intent
+            messages = server.last_request["messages"]
+            assert messages[-2]["role"] == "assistant" and "missing 'directory'" in messages[-1]["content"]
+            assert server.stats.requests == 2
+            assert LLM_REPAIRS.value(call="parse_prompt", model=llm_agent.MODEL, result="fixed") == repairs + 1
+
+            # With repairs off, the last model's reply is used even though it doesn't fit
+            llm_agent.set_routing_policy(RoutingPolicy([ModelTier(llm_agent.MODEL)], repair_attempts=0))
+            assert llm_agent.parse_prompt("rename my music") == {"action": "rename_files", "directory": ""}
+            assert server.stats.requests == 3
+    finally:
+        llm_agent.set_routing_policy(default_policy(llm_agent.MODEL))
+
+if __name__ == "__main__":
+    test_intent_validation()
+    test_invalid_intents_are_not_stored_or_matched()
+    test_invalid_intent_repair()
+    print("Test complete!")
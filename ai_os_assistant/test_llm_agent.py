@@ -0,0 +1,166 @@
+import io
+import json
+from contextlib import ExitStack, redirect_stderr
+from mock_ollama import MockConfig
+from model_router import ModelTier, RoutingPolicy, SMALL_MODEL, default_policy
+from metrics import LLM_ESCALATIONS
+import llm_agent
+from testing import mock_ollama
+
+_server = None
+_module_resources = ExitStack()
+
+def setup_module(module=None):
+    """Start the Ollama stand-in shared by these tests and point llm_agent at it."""
+    global _server
+    _server = _module_resources.enter_context(mock_ollama(MockConfig(think_tokens=50)))
+
+def teardown_module(module=None):
+    """Stop the stand-in and point llm_agent back at the server it used before."""
+    _module_resources.close()
+
+def test_parse_prompt_with_mock_ollama():
+    """Test intent parsing against the offline Ollama stand-in, including a <think> preamble."""
+    # The reasoning model, which writes the <think> preamble
+    llm_agent.set_routing_policy(RoutingPolicy([ModelTier(llm_agent.MODEL)]))
+    try:
+        intent = llm_agent.parse_prompt("Create a file named report.txt")
+        print(f"Intent: {intent}")
+        assert intent == {"action": "run_code", "code": "open('report.txt', 'w').close()"}
+
+        code = llm_agent.generate_code_for_action({"action": "unknown"}, "Show the time")
+        print(f"Generated: {code}")
+        assert code["action"] == "run_code"
+    finally:
+        llm_agent.set_routing_policy(default_policy(llm_agent.MODEL))
+
+def test_parse_prompt_failure_injection():
+    """Test that backend failures fall back to an unknown intent."""
+    _server.config.fail_rate = 1.0
+    try:
+        for mode in ("http500", "garbage", "disconnect"):
+            _server.config.fail_mode = mode
+            assert llm_agent.parse_prompt("Create a file named report.txt") == {"action": "unknown"}
+            print(f"Failure mode '{mode}' handled")
+    finally:
+        _server.config.fail_rate = 0.0
+
+    # Clients hanging up mid-stream are expected, so only other errors are reported
+    for error in (ConnectionResetError(), BrokenPipeError(), ValueError("bad request")):
+        stderr = io.StringIO()
+        with redirect_stderr(stderr):
+            try:
+                raise error
+            except Exception:
+                _server._server.handle_error(None, ("127.0.0.1", 0))
+        assert bool(stderr.getvalue()) == isinstance(error, ValueError), stderr.getvalue()
+
+def test_request_shaping():
+    """Test keep_alive, token caps, JSON format, few-shot examples and stopping after the intent."""
+    llm_agent.set_routing_policy(RoutingPolicy([ModelTier(llm_agent.MODEL)]))
+    _server.config.trailing_tokens = 100
+    try:
+        examples = [("Create a file named a.txt", {"action": "run_code", "code": "open('a.txt', 'w').close()"})]
+        intent = llm_agent.parse_prompt("Create a file named report.txt", examples=examples)
+        assert intent == {"action": "run_code", "code": "open('report.txt', 'w').close()"}
+        request = _server.last_request
+        assert request["keep_alive"] == llm_agent.KEEP_ALIVE
+        assert request["options"]["num_predict"] == llm_agent.MAX_TOKENS
+        assert "format" not in request
+        assert [m["role"] for m in request["messages"]] == ["system", "user", "assistant", "user"]
+
+        # The stream is closed once the JSON after the reasoning section is complete
+        content = llm_agent._stream_chat(llm_agent._chat_request(llm_agent.intent_messages("Open www.example.com")),
+                                         "parse_prompt")
+        assert content.endswith("webbrowser.open('www.example.com')\"}"), content[-80:]
+
+        llm_agent._stream_chat(llm_agent._chat_request(llm_agent.intent_messages("Create a file named x.txt"),
+                                                       json_format=True), "parse_prompt")
+        assert _server.last_request["format"] == "json"
+        assert _server.last_request["options"]["num_predict"] == llm_agent.MAX_TOKENS_JSON
+    finally:
+        _server.config.trailing_tokens = 0
+        llm_agent.set_routing_policy(default_policy(llm_agent.MODEL))
+
+    assert llm_agent.warm_up()
+    # In the background, the HTTP session is ready as soon as it returns
+    assert llm_agent.warm_up(background=True) and llm_agent._session is not None
+
+def test_think_filter():
+    """Test that the <think> section is dropped while streaming, even with tags split across chunks."""
+    think = llm_agent._ThinkFilter()
+    chunks = ["\n<th", "ink>plan: {\"action\": \"x\"} then", " done</thi", "nk>\n\n", '{"code": "print(\'}\')"', ", \"a\": {}", "} trailing"]
+    answers = [think.feed(chunk) for chunk in chunks]
+    assert answers[:3] == ["", "", ""], answers
+    assert "".join(answers) == "\n\n" + "".join(chunks[4:])
+    assert think.reasoning is None and think.reasoning_chars == len('plan: {"action": "x"} then done')
+
+    json_end = llm_agent._JsonEnd()
+    assert [json_end.feed(answer) for answer in answers[3:]] == [-1, -1, -1, 1]
+
+    # Replies without a reasoning section pass straight through
+    plain = llm_agent._ThinkFilter()
+    assert plain.feed("  ") == "" and plain.feed('{"action": "run_code"}') == '  {"action": "run_code"}'
+
+    # Braces in the reasoning no longer reach JSON extraction
+    content = "".join(llm_agent._ThinkFilter().feed(chunk) for chunk in ["<think>maybe {oops}</think>", '{"action": "run_code", "code": "pass"}'])
+    assert llm_agent._extract_intent_json(content) == {"action": "run_code", "code": "pass"}
+
+def test_model_routing():
+    """Test that the small model answers first and the large one takes over when it falls short."""
+    llm_agent.set_routing_policy(default_policy(llm_agent.MODEL))
+    try:
+        intent = llm_agent.parse_prompt("Create a file named report.txt")
+        assert intent == {"action": "run_code", "code": "open('report.txt', 'w').close()"}
+        assert _server.last_request["model"] == SMALL_MODEL
+        assert _server.last_request["format"] == "json"
+
+        _server.config.unknown_models = {SMALL_MODEL}
+        escalations = LLM_ESCALATIONS.value(call="parse_prompt", model=SMALL_MODEL, reason="unknown_action")
+        intent = llm_agent.parse_prompt("Create a file named report.txt")
+        assert intent == {"action": "run_code", "code": "open('report.txt', 'w').close()"}
+        assert _server.last_request["model"] == llm_agent.MODEL
+        assert LLM_ESCALATIONS.value(call="parse_prompt", model=SMALL_MODEL, reason="unknown_action") == escalations + 1
+
+        # A model that isn't installed is skipped from then on
+        _server.config.missing_models = {SMALL_MODEL}
+        assert llm_agent.generate_code_for_action({"action": "unknown"}, "Show the time")["action"] == "run_code"
+        requests = _server.stats.requests
+        llm_agent.parse_prompt("Create a file named report.txt")
+        assert _server.stats.requests == requests + 1
+        assert _server.last_request["model"] == llm_agent.MODEL
+    finally:
+        _server.config.unknown_models = set()
+        _server.config.missing_models = set()
+        llm_agent.set_routing_policy(default_policy(llm_agent.MODEL))
+
+def test_multi_intent_replies():
+    """Test that a JSON array reply becomes a multi intent and is read to its end."""
+    steps = [{"action": "create_file", "filename": "a.txt"}, {"action": "sort_files", "directory": "."}]
+    content = "[" + ", ".join(json.dumps(step) for step in steps) + "] and some chatter"
+    assert llm_agent._extract_intents_json(content) == {"action": "multi", "intents": steps}
+    assert llm_agent._extract_intents_json(json.dumps(steps[:1])) == steps[0]
+    assert llm_agent._JsonEnd().feed(content) == content.index("]") + 1
+    # Brackets in prose before the JSON don't start an array
+    chatty = 'Sure [here it is]: {"action": "run_code", "code": "pass"} done'
+    end = llm_agent._JsonEnd().feed(chatty)
+    assert chatty[:end].endswith('"pass"}')
+    assert llm_agent._extract_intents_json(chatty[:end]) == {"action": "run_code", "code": "pass"}
+
+    router = llm_agent.get_router()
+    assert router.escalation_reason({"action": "multi", "intents": steps}) is None
+    assert router.escalation_reason({"action": "multi", "intents": [steps[0], {"action": "dance"}]}) == "unknown_action"
+    assert router.escalation_reason({"action": "multi", "intents": [{"action": "create_file"}]}) == "invalid_intent"
+
+if __name__ == "__main__":
+    setup_module()
+    try:
+        test_parse_prompt_with_mock_ollama()
+        test_parse_prompt_failure_injection()
+        test_request_shaping()
+        test_think_filter()
+        test_model_routing()
+        test_multi_intent_replies()
+    finally:
+        teardown_module()
+    print("Test complete!")
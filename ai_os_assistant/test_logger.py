@@ -0,0 +1,39 @@
+import os
+import tempfile
+from utils import BackgroundLogger, DEBUG, INFO, ERROR
+
+def test_background_logger():
+    """Test batched writing, level filtering and size-based rotation."""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "test.log")
+        logger = BackgroundLogger(path, level=INFO, max_bytes=0)
+
+        logger.log("hidden debug line", DEBUG)
+        for i in range(100):
+            logger.log(f"line {i}")
+        logger.log("something broke", ERROR)
+        logger.flush()
+
+        with open(path, encoding="utf-8") as f:
+            lines = f.read().splitlines()
+        print(f"Wrote {len(lines)} lines")
+        assert len(lines) == 101
+        assert lines[0].endswith(" line 0")
+        assert lines[-1].endswith("ERROR: something broke")
+        assert not any("hidden debug line" in line for line in lines)
+        logger.close()
+
+        # Rotation keeps at most backup_count old files
+        rotating = BackgroundLogger(path, max_bytes=200, backup_count=2)
+        for i in range(50):
+            rotating.log(f"rotating line {i}")
+            rotating.flush()
+        rotating.close()
+        assert os.path.exists(path + ".1")
+        assert os.path.exists(path + ".2")
+        assert not os.path.exists(path + ".3")
+        print("Rotation OK")
+
+if __name__ == "__main__":
+    test_background_logger()
+    print("Test complete!")
@@ -0,0 +1,46 @@
+import urllib.request
+from metrics import MetricsRegistry, start_metrics_server, REGISTRY, PATTERN_MATCHES
+from testing import temp_store
+
+def test_prometheus_rendering():
+    """Test counter and histogram output in the Prometheus text format."""
+    registry = MetricsRegistry()
+    hits = registry.counter("test_hits_total", "Test hits.", ["category"])
+    latency = registry.histogram("test_latency_seconds", "Test latency.", buckets=(0.1, 1))
+
+    hits.inc(category="file_creation")
+    hits.inc(2, category="file_creation")
+    latency.observe(0.05)
+    latency.observe(0.5)
+    latency.observe(5)
+
+    text = registry.render()
+    print(text)
+    assert '# TYPE test_hits_total counter' in text
+    assert 'test_hits_total{category="file_creation"} 3' in text
+    assert 'test_latency_seconds_bucket{le="0.1"} 1' in text
+    assert 'test_latency_seconds_bucket{le="1"} 2' in text
+    assert 'test_latency_seconds_bucket{le="+Inf"} 3' in text
+    assert 'test_latency_seconds_count 3' in text
+
+def test_metrics_endpoint():
+    """Test that pattern matches show up on the HTTP endpoint."""
+    before = PATTERN_MATCHES.value(category="system_operation", stage="none", result="miss")
+    with temp_store() as store:
+        store.match_command("Reboot the system in 5 minutes")
+    assert PATTERN_MATCHES.value(category="system_operation", stage="none", result="miss") == before + 1
+
+    server = start_metrics_server(0)
+    try:
+        url = f"http://127.0.0.1:{server.server_address[1]}/metrics"
+        with urllib.request.urlopen(url) as response:
+            body = response.read().decode("utf-8")
+        assert 'assistant_pattern_match_total{category="system_operation",stage="none",result="miss"}' in body
+    finally:
+        server.shutdown()
+        server.server_close()
+
+if __name__ == "__main__":
+    test_prometheus_rendering()
+    test_metrics_endpoint()
+    print("Test complete!")
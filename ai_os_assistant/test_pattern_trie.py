@@ -0,0 +1,75 @@
+import random
+from patterns import Pattern
+from pattern_trie import CategoryIndex, PatternTrie
+
+def _pattern(text, variables):
+    return Pattern("custom_command", text, {"action": "run_code", "code": "pass"}, variables)
+
+def test_trie_matches_like_regex():
+    """Test that the trie extracts the same variables as each pattern's regex."""
+    patterns = [
+        _pattern("Create a file named {filename}", ["filename"]),
+        _pattern("Open my default browser to {url}", ["url"]),
+        _pattern("Rename {old} to {new}", ["old", "new"]),
+        _pattern("Copy '{source}' into {folder}/", ["source", "folder"]),
+        _pattern("Move {a}-{b} now", ["a", "b"]),  # two placeholders in one word: regex fallback
+    ]
+    commands = [
+        "create  a FILE named report.txt", "Create a file named my notes.txt", "Open my default browser to www.example.com",
+        "Rename a b to c d to e", "Copy 'x y' into docs/", "Copy 'x' into /", "Move 1-2 now", "Create a file named",
+        "Open my default browser", "Rename to x",
+    ]
+    # Seeded, so a failing command can be reproduced
+    rng = random.Random(1234)
+    for _ in range(200):
+        words = rng.choices(["a", "to", "x.txt", "'q'", "docs/", "named", "file"], k=rng.randint(1, 6))
+        commands.append(rng.choice(["Rename ", "Copy ", "Create a file named "]) + " ".join(words))
+    
+    for pattern in patterns:
+        trie = PatternTrie()
+        trie.add(pattern)
+        for command in commands:
+            regex_match = pattern.regex().match(command)
+            expected = regex_match.groupdict() if regex_match else None
+            found = trie.match(command)
+            assert (found[1] if found else None) == expected, (pattern, command, found, expected)
+    print("✅ Trie matches agree with the pattern regexes")
+
+def test_trie_priority():
+    """Test that the most specific pattern wins and ties go to the first stored."""
+    trie = PatternTrie()
+    general = _pattern("Open {target}", ["target"])
+    specific = _pattern("Open the folder {path}", ["path"])
+    duplicate = _pattern("Open the folder {folder}", ["folder"])
+    for pattern in (general, specific, duplicate):
+        trie.add(pattern)
+    
+    matches = trie.match_all("open the folder C:\\Temp")
+    assert [pattern for pattern, _ in matches] == [specific, duplicate, general]
+    assert matches[0][1] == {"path": "C:\\Temp"}
+    assert trie.match("open notepad") == (general, {"target": "notepad"})
+    print("✅ Trie priority rules work")
+
+def test_ranking_follows_hits():
+    """Test that a hit moves the pattern up the similarity ranking without re-sorting it."""
+    rng = random.Random(99)
+    patterns = [Pattern("custom_command", f"run job {i}", {"action": "run_code", "code": "pass"},
+                        raw_command=f"run job {i}", hits=rng.randint(0, 3), last_used=rng.choice([0.0, float(i)]))
+                for i in range(50)]
+    index = CategoryIndex(patterns)
+    ranked = index.ranked()
+    for step in range(200):
+        pattern = rng.choice(patterns)
+        hits, last_used = pattern.hits, pattern.last_used
+        pattern.record_use(1000.0 + step)
+        index.used(pattern, hits, last_used)
+        assert index.ranked() is ranked
+        assert [(p.hits, p.last_used) for p in ranked] == sorted(((p.hits, p.last_used) for p in patterns), reverse=True)
+    assert sorted(map(id, ranked)) == sorted(map(id, patterns))
+    print("✅ Hits re-rank patterns in place")
+
+if __name__ == "__main__":
+    test_trie_matches_like_regex()
+    test_trie_priority()
+    test_ranking_follows_hits()
+    print("Test complete!")
@@ -0,0 +1,65 @@
+from patterns import Pattern, load_library, dump_library
+from templates import compile_template, make_template
+
+def test_pattern_records():
+    """Test Pattern records: JSON round trip, regex matching and the frozen template."""
+    library = {
+        "file_creation": [
+            {"pattern": "Create a file named {filename}", "intent_template": {"action": "run_code",
+             "code": "open('{filename}', 'w').close()"}, "variables": ["filename"],
+             "example_command": "Create a file named a.txt", "usage": 3},
+        ],
+        "custom_command": [
+            {"raw_command": "Show me system information", "pattern": "Show me system information",
+             "intent_template": {"action": "run_code", "code": "import platform"}, "variables": []},
+        ],
+    }
+    records = load_library(library)
+    assert dump_library(records) == library
+    
+    pattern = records["file_creation"][0]
+    assert pattern.segments == ((False, "Create a file named "), (True, "filename"))
+    assert pattern.tokens == ("create", "a", "file", "named", "{filename}")
+    match = pattern.regex().match("create  A file named b.csv")
+    assert match.groupdict() == {"filename": "b.csv"}
+    assert pattern.regex(flexible=False).match("create a file named b.csv") is None
+    assert pattern.render_intent(match.groupdict())["code"] == "open('b.csv', 'w').close()"
+    
+    # Rendering hands out a copy; the template itself can't be changed
+    pattern.render_intent({})["action"] = "changed"
+    try:
+        pattern.intent_template["action"] = "changed"
+        assert False, "intent template should be read-only"
+    except TypeError:
+        pass
+    assert pattern.intent_template["action"] == "run_code"
+    
+    raw = records["custom_command"][0]
+    assert raw.command_key == "show me system information"
+    assert raw.key == "Show me system information"
+    print("✅ Pattern records work")
+
+def test_intent_templates():
+    """Test template compilation: nested values, escaping and values that contain placeholders."""
+    intent = {"action": "create_files", "files": [{"name": "a.txt", "content": "print(f'{name}')"}],
+              "options": {"folder": "docs", "mode": "w"}}
+    template = make_template(intent, {"name": "a.txt", "folder": "docs"})
+    print(f"Template: {template}")
+    assert template["files"][0] == {"name": "{name}", "content": "print(f'{{name}}')"}
+    assert template["options"]["folder"] == "{folder}"
+    
+    render = compile_template(template, ["name", "folder"])
+    # A value containing another placeholder is inserted as is
+    rendered = render({"name": "{folder}.txt", "folder": "out"})
+    assert rendered["files"][0] == {"name": "{folder}.txt", "content": "print(f'{name}')"}
+    assert rendered["options"] == {"folder": "out", "mode": "w"}
+    assert render({"name": "a.txt", "folder": "docs"}) == intent
+    
+    # Missing values and unknown names stay literal
+    assert compile_template({"code": "{x} {y}"}, ["x"])({}) == {"code": "{x} {y}"}
+    print("✅ Intent templates work")
+
+if __name__ == "__main__":
+    test_pattern_records()
+    test_intent_templates()
+    print("Test complete!")
@@ -0,0 +1,60 @@
+import json
+import os
+import tempfile
+import tracing
+from command_store import CommandStore
+
+def test_trace_record():
+    """Test that one JSON line with per-stage spans is written per prompt."""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "trace.jsonl")
+        enabled = tracing.tracing_enabled()
+        tracing.set_tracing(True, path)
+        try:
+            store = CommandStore(path=os.path.join(tmp, "command_patterns.json"))
+            store.patterns = {
+                "file_creation": [{
+                    "pattern": "Create a file named {filename}",
+                    "intent_template": {"action": "create_file", "filename": "{filename}"},
+                    "variables": ["filename"],
+                }]
+            }
+
+            with tracing.trace("Create a file named notes.txt") as current:
+                result = store.match_command("Create a file named notes.txt")
+                current.set(source="pattern")
+            with tracing.trace("Reboot the system"):
+                assert store.match_command("Reboot the system") is None
+            tracing.flush_traces()
+        finally:
+            tracing.set_tracing(enabled, tracing.TRACE_FILE)
+
+        with open(path, encoding="utf-8") as f:
+            records = [json.loads(line) for line in f]
+        for record in records:
+            print(record)
+
+        assert result[0] == {"action": "create_file", "filename": "notes.txt"}
+        assert len(records) == 2
+        assert records[0]["source"] == "pattern"
+        assert {"detect_category", "match_command", "match_command.exact", "match_command.regex"} <= set(records[0]["spans"])
+        assert "match_command.fuzzy" in records[1]["spans"]
+
+def test_tracing_is_opt_in():
+    """Test that nothing is written unless tracing was turned on."""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "trace.jsonl")
+        enabled = tracing.tracing_enabled()
+        tracing.set_tracing(False, path)
+        try:
+            with tracing.trace("Create a file named secret.txt"):
+                pass
+            tracing.flush_traces()
+        finally:
+            tracing.set_tracing(enabled, tracing.TRACE_FILE)
+        assert not os.path.exists(path)
+
+if __name__ == "__main__":
+    test_trace_record()
+    test_tracing_is_opt_in()
+    print("Test complete!")
@@ -0,0 +1,52 @@
+"""
+Helpers shared by the test_*.py modules: scratch folders and pattern stores
+that are removed afterwards, and a mock Ollama server llm_agent talks to
+only while it runs.
+"""
+import os
+import tempfile
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+import llm_agent
+from command_store import COMMAND_STORE_FILE, CommandStore
+from mock_ollama import MockConfig, MockOllamaServer
+
+
+@contextmanager
+def temp_folder() -> Iterator[str]:
+    """A scratch folder, removed with everything in it afterwards."""
+    with tempfile.TemporaryDirectory() as folder:
+        yield folder
+
+
+@contextmanager
+def temp_library() -> Iterator[str]:
+    """Path of a pattern library in a scratch folder; the file doesn't exist yet."""
+    with temp_folder() as folder:
+        yield os.path.join(folder, COMMAND_STORE_FILE)
+
+
+@contextmanager
+def temp_store(**kwargs) -> Iterator[CommandStore]:
+    """A CommandStore on an empty scratch library; kwargs are passed to CommandStore."""
+    with temp_library() as path:
+        yield CommandStore(path=path, **kwargs)
+
+
+@contextmanager
+def ollama_at(url: str) -> Iterator[None]:
+    """Point llm_agent at url, and back at the previous server afterwards."""
+    previous = llm_agent.OLLAMA_URL
+    llm_agent.set_ollama_url(url)
+    try:
+        yield
+    finally:
+        llm_agent.set_ollama_url(previous)
+
+
+@contextmanager
+def mock_ollama(config: Optional[MockConfig] = None) -> Iterator[MockOllamaServer]:
+    """Run a MockOllamaServer and point llm_agent at it while it runs."""
+    with MockOllamaServer(config) as server, ollama_at(server.url):
+        yield server
@@ -0,0 +1,141 @@
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Optional
+
+from utils import BackgroundLogger
+
+# File that receives one JSON object per handled prompt
+TRACE_FILE = "ai_assistant_trace.jsonl"
+
+
+class _TraceWriter(BackgroundLogger):
+    """Background writer that emits each queued record as a JSON line."""
+
+    def format(self, timestamp: float, level: int, record) -> str:
+        return json.dumps(record, ensure_ascii=False) + "\n"
+
+
+class Trace:
+    """Timing spans and fields collected while handling a single prompt."""
+
+    def __init__(self, prompt: str):
+        self.prompt = prompt
+        self.started = time.time()
+        self._start = time.perf_counter()
+        self.spans = {}
+        self.fields = {}
+        # Steps of a multi intent add their spans from several threads
+        self._lock = threading.Lock()
+
+    def add(self, name: str, seconds: float):
+        """Add a duration to a span. Repeated spans accumulate."""
+        with self._lock:
+            self.spans[name] = self.spans.get(name, 0.0) + seconds
+
+    def set(self, **fields):
+        self.fields.update(fields)
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self._start
+
+    def to_record(self) -> dict:
+        record = {
+            "ts": datetime.fromtimestamp(self.started).isoformat(timespec="milliseconds"),
+            "prompt": self.prompt,
+            "total_ms": round(self.elapsed() * 1000, 3),
+            "spans": {name: round(seconds * 1000, 3) for name, seconds in self.spans.items()},
+        }
+        record.update(self.fields)
+        return record
+
+
+_current_trace = contextvars.ContextVar("current_trace", default=None)
+# Off unless asked for: records contain the raw prompts
+_enabled = os.environ.get("AI_ASSISTANT_TRACE", "0").lower() in ("1", "true", "yes")
+_writer = _TraceWriter(TRACE_FILE)
+
+
+def set_tracing(enabled: bool, path: Optional[str] = None):
+    """Turn trace output on or off, optionally redirecting it to another file."""
+    global _enabled, _writer
+    _enabled = enabled
+    if path and path != _writer.path:
+        _writer.close()
+        _writer = _TraceWriter(path)
+
+
+def tracing_enabled() -> bool:
+    return _enabled
+
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+
+@contextmanager
+def trace(prompt: str):
+    """
+    Collect spans for one prompt and write them as a single JSON line on exit.
+
+    Args:
+        prompt: The user prompt being handled.
+
+    Yields:
+        The Trace, so callers can attach fields such as the match source.
+    """
+    current = Trace(prompt)
+    token = _current_trace.set(current)
+    try:
+        yield current
+    finally:
+        _current_trace.reset(token)
+        if _enabled:
+            _writer.log(current.to_record())
+
+
+@contextmanager
+def span(name: str):
+    """Time a block and add it to the active trace (no-op without one)."""
+    current = _current_trace.get()
+    if current is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        current.add(name, time.perf_counter() - start)
+
+
+def timed(name: str):
+    """Decorator form of span() for timing a whole function."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            current = _current_trace.get()
+            if current is None:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                current.add(name, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+def mark(name: str, seconds: float):
+    """Record a duration measured elsewhere, e.g. time to first token."""
+    current = _current_trace.get()
+    if current is not None:
+        current.add(name, seconds)
+
+
+def flush_traces():
+    _writer.flush()
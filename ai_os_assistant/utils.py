@@ -1,7 +1,178 @@
-
+import atexit
+import os
+import queue
+import threading
+import time
 from datetime import datetime
 
-def log(message):
-    timestamp = datetime.now().strftime("[%Y-%m-%d %H:%M:%S]")
-    with open("ai_assistant.log", "a", encoding="utf-8") as f:
-        f.write(f"{timestamp} {message}\n")
+# File the assistant writes its log to
+LOG_FILE = "ai_assistant.log"
+
+# Log levels (same numeric values as the standard logging module)
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+
+LEVEL_NAMES = {DEBUG: "DEBUG", INFO: "INFO", WARNING: "WARNING", ERROR: "ERROR"}
+
+
+def parse_level(value, default: int = INFO) -> int:
+    """Turn a level name ("debug") or number ("10") into a numeric log level."""
+    if value is None or value == "":
+        return default
+    if isinstance(value, int):
+        return value
+    value = str(value).strip()
+    if value.isdigit():
+        return int(value)
+    for number, name in LEVEL_NAMES.items():
+        if name == value.upper():
+            return number
+    return default
+
+
+class BackgroundLogger:
+    """
+    Append-only log file written from a background thread.
+
+    Callers only put a record on a queue; the writer thread keeps the file open,
+    writes queued records in batches, flushes once per batch and rotates the file
+    when it grows past max_bytes.
+    """
+
+    def __init__(self, path: str = LOG_FILE, level: int = INFO, max_bytes: int = 5 * 1024 * 1024,
+                 backup_count: int = 3, flush_interval: float = 0.5, batch_size: int = 256):
+        self.path = path
+        self.level = level
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._file = None
+        self._closed = False
+
+    def is_enabled_for(self, level: int) -> bool:
+        return level >= self.level
+
+    def log(self, message, level: int = INFO):
+        """Queue a message for writing. Returns immediately."""
+        if level < self.level or self._closed:
+            return
+        if self._thread is None:
+            self._start()
+        self._queue.put((time.time(), level, message))
+
+    def flush(self, timeout: float = 5.0):
+        """Block until everything queued so far has been written to disk."""
+        if self._thread is None or not self._thread.is_alive():
+            return
+        done = threading.Event()
+        self._queue.put(done)
+        done.wait(timeout)
+
+    def close(self):
+        """Flush pending records, stop the writer thread and close the file."""
+        if self._closed:
+            return
+        self.flush()
+        self._closed = True
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join(timeout=5.0)
+
+    def format(self, timestamp: float, level: int, message) -> str:
+        stamp = datetime.fromtimestamp(timestamp).strftime("[%Y-%m-%d %H:%M:%S]")
+        if level == INFO:
+            return f"{stamp} {message}\n"
+        return f"{stamp} {LEVEL_NAMES.get(level, level)}: {message}\n"
+
+    def _start(self):
+        with self._start_lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name=f"log-writer:{self.path}", daemon=True)
+            self._thread.start()
+            atexit.register(self.close)
+
+    def _run(self):
+        while True:
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+
+            lines = []
+            waiters = []
+            stop = False
+            # Drain whatever else is already queued so it goes out in one write
+            while True:
+                if item is None:
+                    stop = True
+                elif isinstance(item, threading.Event):
+                    waiters.append(item)
+                else:
+                    lines.append(self.format(*item))
+                if stop or len(lines) >= self.batch_size:
+                    break
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+
+            if lines:
+                self._write("".join(lines))
+            for waiter in waiters:
+                waiter.set()
+            if stop:
+                if self._file is not None:
+                    self._file.close()
+                    self._file = None
+                return
+
+    def _write(self, text: str):
+        try:
+            if self._file is None:
+                self._file = open(self.path, "a", encoding="utf-8")
+            self._file.write(text)
+            self._file.flush()
+            if self.max_bytes and self._file.tell() >= self.max_bytes:
+                self._rotate()
+        except OSError:
+            # Logging must never take the assistant down
+            self._file = None
+
+    def _rotate(self):
+        self._file.close()
+        self._file = None
+        if self.backup_count <= 0:
+            os.remove(self.path)
+            return
+        for i in range(self.backup_count - 1, 0, -1):
+            src = f"{self.path}.{i}"
+            if os.path.exists(src):
+                os.replace(src, f"{self.path}.{i + 1}")
+        os.replace(self.path, f"{self.path}.1")
+
+
+_logger = BackgroundLogger(level=parse_level(os.environ.get("AI_ASSISTANT_LOG_LEVEL")))
+
+
+def log(message, level: int = INFO):
+    _logger.log(message, level)
+
+
+def log_enabled(level: int) -> bool:
+    """Check the level before building an expensive log message."""
+    return _logger.is_enabled_for(level)
+
+
+def set_log_level(level):
+    _logger.level = parse_level(level)
+
+
+def flush_log():
+    _logger.flush()
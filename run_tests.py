@@ -1,8 +1,17 @@
+import argparse
 import subprocess
 import os
+import sys
 import time
 
-def run_tests():
+def start_mock_ollama(args):
+    """Start the offline Ollama stand-in from ai_os_assistant/mock_ollama.py."""
+    from mock_ollama import MockOllamaServer, config_from_args
+    server = MockOllamaServer(config_from_args(args)).start()
+    print(f"Using mock Ollama at {server.url}")
+    return server
+
+def run_tests(ollama_url=None):
     # This script ('run_tests.py') is expected to be in the project root directory.
     # The AI assistant's code (main.py, etc.) is in a subdirectory (e.g., 'ai_os_assistant').
     
@@ -26,11 +35,17 @@ def run_tests():
     print(f"Test cases file: {full_test_cases_path}")
     print(f"Executing: {' '.join(command_to_run)}")
 
+    # Point the assistant at another Ollama instance (e.g. the mock) if requested
+    env = dict(os.environ)
+    if ollama_url:
+        env["OLLAMA_URL"] = ollama_url
+
     process = None
     try:
         process = subprocess.Popen(
             command_to_run,
             cwd=assistant_run_cwd,
+            env=env,
             stdin=subprocess.PIPE,
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE,
@@ -194,4 +209,18 @@ def run_tests():
             print("Assistant process exit code not definitively captured (may have been killed).", flush=True)
 
 if __name__ == "__main__":
-    run_tests()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Run test_cases.txt through the AI OS Assistant")
+    parser.add_argument("--mock-ollama", action="store_true",
+                        help="Answer LLM requests with the offline stand-in instead of a live model")
+    parser.add_argument("--ollama-url", help="Ollama base URL to use (default: OLLAMA_URL or localhost:11434)")
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "ai_os_assistant"))
+    from mock_ollama import add_mock_arguments
+    add_mock_arguments(parser)
+    args = parser.parse_args()
+
+    mock_server = start_mock_ollama(args) if args.mock_ollama else None
+    try:
+        run_tests(mock_server.url if mock_server else args.ollama_url)
+    finally:
+        if mock_server:
+            mock_server.stop()
\ No newline at end of file
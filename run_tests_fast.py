@@ -0,0 +1,254 @@
+import argparse
+import json
+import os
+import queue
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ASSISTANT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ai_os_assistant")
+MAIN_SCRIPT = os.path.join(ASSISTANT_DIR, "main.py")
+TEST_CASES = os.path.join(ASSISTANT_DIR, "test_cases.txt")
+PATTERNS_FILE = os.path.join(ASSISTANT_DIR, "command_patterns.json")
+PROMPT = "> "
+READ_SIZE = 65536
+
+try:
+    import selectors
+    _USE_SELECTORS = os.name != "nt"  # Windows selectors only work on sockets
+except ImportError:
+    _USE_SELECTORS = False
+
+
+class AssistantProcess:
+    """
+    One assistant subprocess whose stdout is read in blocks.
+
+    Output is accumulated until it ends with the input prompt, which is checked
+    once per block instead of once per character.
+    """
+
+    def __init__(self, cwd, env):
+        self.process = subprocess.Popen(
+            [sys.executable, "-u", MAIN_SCRIPT],
+            cwd=cwd,
+            env=env,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            bufsize=0,
+        )
+        self._fd = self.process.stdout.fileno()
+        if _USE_SELECTORS:
+            os.set_blocking(self._fd, False)
+            self._selector = selectors.DefaultSelector()
+            self._selector.register(self._fd, selectors.EVENT_READ)
+        else:
+            # Pipes can't be polled on Windows; a reader thread hands over blocks instead
+            self._blocks = queue.Queue()
+            threading.Thread(target=self._pump, daemon=True).start()
+
+    def _pump(self):
+        while True:
+            # stdout is unbuffered, so read() returns whatever is available
+            block = self.process.stdout.read(READ_SIZE)
+            self._blocks.put(block)
+            if not block:
+                return
+
+    def _read_block(self, timeout):
+        """Return the next chunk of output, b"" on EOF, or None on timeout."""
+        if _USE_SELECTORS:
+            if not self._selector.select(timeout):
+                return None
+            try:
+                return os.read(self._fd, READ_SIZE)
+            except BlockingIOError:
+                return None
+        try:
+            return self._blocks.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def read_until_prompt(self, timeout: float) -> str:
+        """Collect output until the assistant is waiting for input again."""
+        chunks = []
+        tail = b""
+        prompt = PROMPT.encode()
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError("assistant did not return to the prompt")
+            block = self._read_block(remaining)
+            if block is None:
+                continue
+            if not block:
+                break
+            chunks.append(block)
+            # Only the end of the new data can complete the prompt
+            tail = (tail + block)[-len(prompt):]
+            if tail == prompt:
+                break
+        return b"".join(chunks).decode("utf-8", errors="replace")
+
+    def send(self, line: str):
+        self.process.stdin.write((line + "\n").encode("utf-8"))
+        self.process.stdin.flush()
+
+    def close(self, timeout: float = 10.0):
+        try:
+            if self.process.poll() is None:
+                self.send("exit")
+                self.process.stdin.close()
+            self.process.wait(timeout=timeout)
+        except (BrokenPipeError, OSError, subprocess.TimeoutExpired):
+            self.process.kill()
+            self.process.wait()
+
+
+def load_test_commands(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith("#")]
+
+
+def run_shard(shard_id, commands, env, timeout, isolate):
+    """Run a list of commands through one assistant process and time each of them."""
+    workdir = ASSISTANT_DIR
+    if isolate:
+        # Each shard works on its own copy of the pattern library and its own files
+        workdir = tempfile.mkdtemp(prefix=f"assistant_shard{shard_id}_")
+        if os.path.exists(PATTERNS_FILE):
+            shutil.copy(PATTERNS_FILE, workdir)
+
+    results = []
+    banner = ""
+    shard_error = None
+    startup = time.perf_counter()
+    assistant = AssistantProcess(workdir, env)
+    try:
+        try:
+            banner = assistant.read_until_prompt(timeout)
+        except (TimeoutError, BrokenPipeError, OSError) as e:
+            # Never got to the prompt, so none of the shard's commands can run
+            shard_error = str(e) or type(e).__name__
+            commands = []
+        startup = time.perf_counter() - startup
+        for command in commands:
+            start = time.perf_counter()
+            try:
+                assistant.send(command)
+                output = assistant.read_until_prompt(timeout)
+                error = None
+            except (TimeoutError, BrokenPipeError, OSError) as e:
+                output, error = "", str(e) or type(e).__name__
+            results.append({
+                "shard": shard_id,
+                "command": command,
+                "seconds": time.perf_counter() - start,
+                "output": output[:-len(PROMPT)] if output.endswith(PROMPT) else output,
+                "error": error,
+            })
+            if error:
+                break
+    finally:
+        assistant.close()
+        if isolate:
+            shutil.rmtree(workdir, ignore_errors=True)
+    return {"shard": shard_id, "startup_seconds": startup, "banner": banner, "results": results,
+            "error": shard_error}
+
+
+def split_into_shards(commands, count):
+    shards = [[] for _ in range(max(1, min(count, len(commands))))]
+    for i, command in enumerate(commands):
+        shards[i % len(shards)].append(command)
+    return shards
+
+
+def print_report(shard_runs, total_seconds, quiet):
+    results = [r for run in shard_runs for r in run["results"]]
+    broken = [run for run in shard_runs if run["error"]]
+    for run in broken:
+        print(f"!! [shard {run['shard']}] assistant did not start: {run['error']}")
+    if not quiet:
+        for run in shard_runs:
+            for result in run["results"]:
+                print(f"\n>>> [shard {result['shard']}] {result['command']}  ({result['seconds'] * 1000:.1f} ms)")
+                print(result["output"].rstrip())
+                if result["error"]:
+                    print(f"!! {result['error']}")
+
+    print("\n--- Per-command latency ---")
+    print(f"{'ms':>10}  shard  command")
+    for result in sorted(results, key=lambda r: r["seconds"], reverse=True):
+        print(f"{result['seconds'] * 1000:>10.1f}  {result['shard']:>5}  {result['command']}")
+
+    if results:
+        latencies = sorted(r["seconds"] for r in results)
+        print("\n--- Summary ---")
+        print(f"Commands: {len(results)} across {len(shard_runs)} process(es)")
+        started = [run["startup_seconds"] for run in shard_runs if not run["error"]]
+        print(f"Startup: {statistics.mean(started) * 1000:.1f} ms per process")
+        print(f"Latency p50: {statistics.median(latencies) * 1000:.1f} ms, max: {latencies[-1] * 1000:.1f} ms")
+        print(f"Wall time: {total_seconds:.2f} s")
+    failures = [r for r in results if r["error"]]
+    if failures:
+        print(f"{len(failures)} command(s) failed")
+    if broken:
+        print(f"{len(broken)} assistant process(es) failed to start")
+    return not failures and not broken
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run test_cases.txt through several assistant processes in parallel")
+    parser.add_argument("--cases", default=TEST_CASES, help="Test cases file (default: %(default)s)")
+    parser.add_argument("--jobs", "-j", type=int, default=os.cpu_count() or 2, help="Assistant processes to run")
+    parser.add_argument("--timeout", type=float, default=300.0, help="Seconds to wait for each command")
+    parser.add_argument("--shared-dir", action="store_true",
+                        help="Run every shard in ai_os_assistant/ instead of an isolated scratch copy")
+    parser.add_argument("--quiet", action="store_true", help="Only print the latency report")
+    parser.add_argument("--json", help="Also write the per-command results to this file")
+    parser.add_argument("--mock-ollama", action="store_true",
+                        help="Answer LLM requests with the offline stand-in instead of a live model")
+    sys.path.insert(0, ASSISTANT_DIR)
+    from mock_ollama import MockOllamaServer, add_mock_arguments, config_from_args
+    add_mock_arguments(parser)
+    args = parser.parse_args(argv)
+
+    commands = load_test_commands(args.cases)
+    if not commands:
+        print(f"No test commands found in {args.cases}")
+        return 1
+
+    mock_server = MockOllamaServer(config_from_args(args)).start() if args.mock_ollama else None
+    env = dict(os.environ)
+    if mock_server:
+        env["OLLAMA_URL"] = mock_server.url
+
+    shards = split_into_shards(commands, args.jobs)
+    print(f"Running {len(commands)} command(s) in {len(shards)} assistant process(es)...")
+    start = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=len(shards)) as pool:
+            futures = [pool.submit(run_shard, i, shard, env, args.timeout, not args.shared_dir)
+                       for i, shard in enumerate(shards)]
+            shard_runs = [future.result() for future in futures]
+    finally:
+        if mock_server:
+            mock_server.stop()
+    ok = print_report(shard_runs, time.perf_counter() - start, args.quiet)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(shard_runs, f, indent=2)
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())